@@ -20,7 +20,11 @@ logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def create_app():
+def create_base_app():
+    """只配置数据库和 GCP 账户的 app: 不建表、不注册路由、不启动后台线程
+    
+    多进程执行模式的同步子进程使用（表和索引已由父进程创建）。
+    """
     # 加载 .env 文件
     load_dotenv()
     
@@ -28,14 +32,19 @@ def create_app():
                 static_folder='static',
                 template_folder='templates')
     
-    # 配置数据库
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{os.getenv('MYSQL_USER')}:{os.getenv('MYSQL_PASSWORD')}@{os.getenv('MYSQL_HOST')}/{os.getenv('MYSQL_DB')}"
+    # 配置数据库（DATABASE_URL 用于本地测试和压测，如 sqlite:///data/fake.db）
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or f"mysql+pymysql://{os.getenv('MYSQL_USER')}:{os.getenv('MYSQL_PASSWORD')}@{os.getenv('MYSQL_HOST')}/{os.getenv('MYSQL_DB')}"
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
+    # 配置连接池（大小、pre-ping、回收时间）
+    from services.billing_service import get_engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    
     # 配置GCP账户信息
     app.config['GCP_ACCOUNT_NAMES'] = os.getenv('GCP_ACCOUNT_NAMES', '').split(',')
+    credentials_dir = os.getenv('GCP_CREDENTIALS_DIR', '/app/credentials')
     app.config['GCP_ACCOUNTS'] = [
-        {'name': name, 'credentials_file': f'/app/credentials/{name}.json'}
+        {'name': name, 'credentials_file': os.path.join(credentials_dir, f'{name}.json')}
         for name in app.config['GCP_ACCOUNT_NAMES']
     ]
     
@@ -43,6 +52,13 @@ def create_app():
     from models import db
     db.init_app(app)
     
+    return app
+
+def create_app():
+    app = create_base_app()
+    
+    from models import db, ensure_columns, ensure_indexes
+    
     # 注册路由
     from routes.api import api_bp
     from routes.web import web_bp
@@ -53,6 +69,35 @@ def create_app():
     # 创建数据库表
     with app.app_context():
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        
+        from services.billing_service import install_pool_instrumentation
+        install_pool_instrumentation(db.engine)
+    
+    # Prometheus 指标: 数据库语句和请求耗时
+    from services.metrics import init_metrics
+    init_metrics(app)
+    
+    # 启动审计日志异步写入器
+    from services.audit_log import init_audit_writer
+    init_audit_writer(app)
+    
+    # 共享服务账号凭据，并在令牌过期前后台刷新
+    from services.token_manager import init_token_manager
+    init_token_manager(app)
+    
+    # 权限移除成功后同步更新 IAM 清单
+    from services.iam_inventory import init_iam_inventory
+    init_iam_inventory(app)
+    
+    # Google API 调用量台账定期写入数据库
+    from services.quota import init_quota_ledger
+    init_quota_ledger(app)
+    
+    # 按需性能剖析: 请求抽样钩子和触发文件监视
+    from services.profiling import init_profiling
+    init_profiling(app)
     
     return app
 
@@ -65,9 +110,15 @@ def start_update_thread(app):
     logging.info("Update thread started")
 
 def main():
+    """开发模式入口: Flask 开发服务器 + 进程内同步线程
+    
+    生产环境请使用 gunicorn (wsgi:app) 运行 Web，并用 python -m services.sync_worker
+    单独运行同步任务，此时设置 RUN_SYNC_IN_WEB=false。
+    """
     logging.info("Starting GCP Billing Monitor")
     app = create_app()
-    start_update_thread(app)
+    if os.getenv('RUN_SYNC_IN_WEB', 'true').lower() == 'true':
+        start_update_thread(app)
     app.run(host='0.0.0.0', port=8848)
 
 if __name__ == "__main__":
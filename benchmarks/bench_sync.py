@@ -0,0 +1,404 @@
+# benchmarks/bench_sync.py - 同步引擎端到端压测
+#
+# 每个场景在独立子进程中运行（配置在导入时读取、峰值 RSS 互不影响）: 在另一个进程中启动本地 Google API 替身
+# (services/fake_gcp.py，不与被测的同步争用 GIL，通过 /_fake/ 管理接口控制)，按场景生成数据，
+# 用 SQLite（或 --database-url 指定的本地 MySQL）
+# 连续执行几轮 run_sync_cycle（update_project_status 每轮执行的内容；账单关闭场景执行快速轮询 poll_once），
+# SQLite 下服务账号串行处理（见 _configure_environment）。记录每轮的:
+#   wall_time               整轮耗时（秒）
+#   api_calls_per_project   Google API 调用数 / 项目数
+#   db_statements           数据库语句数（包括异步写入的审计日志）
+#   rebind_seconds          从本轮开始到关闭账单上不再有项目的时间，本轮开始时没有待换绑项目则为 null
+#   remaining_on_closed     本轮结束时仍绑定在关闭账单上的项目数（任一轮大于 0 时以状态码 1 退出）
+#   failed_accounts         全量同步中处理失败的服务账号数（快速轮询轮次为 null）
+# 以及整个场景的 peak_rss_mb（同步进程，不含替身进程）。
+#
+# 用法:
+#   python -m benchmarks.bench_sync --profiles smoke --output data/benchmarks/baseline.json
+#   python -m benchmarks.bench_sync --profiles smoke --baseline data/benchmarks/baseline.json
+# 与基线相比任一指标变差超过 --tolerance（默认 20%），或基线中有值的指标本次缺失 (null) 时以状态码 1 退出。
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 场景: seed 为 FakeGcpState.seed 的参数；steps 为依次执行的轮次:
+#   discover / steady   执行一轮全量同步（首轮发现项目 / 无变化的常规轮次）
+#   close:0.4           关闭 40% 开启中的账单账户，然后执行一轮快速账单轮询（生产环境处理账单关闭的路径）
+PROFILES: Dict[str, Dict[str, Any]] = {
+    'smoke': {
+        'description': '2 个服务账号 × 100 个项目，快速检查',
+        'seed': {'accounts': 2, 'projects': 100, 'billing_accounts': 40, 'bound_ratio': 0.8, 'closed_ratio': 0.1},
+        'steps': ['discover', 'steady']
+    },
+    'single-10k': {
+        'description': '1 个服务账号 × 10000 个项目',
+        'seed': {'accounts': 1, 'projects': 10000, 'billing_accounts': 3500, 'bound_ratio': 0.9, 'closed_ratio': 0.05},
+        'steps': ['discover', 'steady']
+    },
+    'many-50x200': {
+        'description': '50 个服务账号 × 200 个项目',
+        'seed': {'accounts': 50, 'projects': 200, 'billing_accounts': 75, 'bound_ratio': 0.9, 'closed_ratio': 0.05},
+        'steps': ['discover', 'steady']
+    },
+    'mass-closure': {
+        'description': '10 个服务账号 × 500 个项目，稳定后一次关闭 40% 的账单账户',
+        'seed': {'accounts': 10, 'projects': 500, 'billing_accounts': 300, 'bound_ratio': 0.8, 'closed_ratio': 0.0},
+        'steps': ['discover', 'close:0.4', 'steady']
+    }
+}
+
+# 与基线比较的指标（都是越小越好）
+COMPARED_METRICS = ('wall_time', 'api_calls_per_project', 'db_statements', 'rebind_seconds', 'failed_accounts')
+# 耗时低于该值时不比较（噪声大于差异）
+MIN_COMPARED_SECONDS = 0.05
+
+# ==================== 子进程: 运行单个场景 ====================
+
+def _configure_environment(args, fake_url: str, credentials_dir: str, account_names: List[str], workdir: str):
+    """必须在导入 app / services 之前调用，CONFIG 在导入时读取环境变量"""
+    os.environ.update({
+        'GCP_API_ENDPOINT': fake_url,
+        'GCP_CREDENTIALS_DIR': credentials_dir,
+        'GCP_ACCOUNT_NAMES': ','.join(account_names),
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'SYNC_EXECUTION_MODE': args.mode,
+        'MAX_QPS_PER_ACCOUNT': str(args.qps),
+        'AUDIT_SPILL_PATH': os.path.join(workdir, 'audit_spill.jsonl'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'TRACING_ENABLED': 'false',
+        'METRICS_PORT': '0'
+    })
+    if not args.database_url:
+        # SQLite 同一时刻只允许一个写事务，而同步在 API 调用期间持有会话，
+        # 并发处理多个服务账号会得到 database is locked；SQLite 下串行处理账号，并发数据请用 --database-url
+        os.environ['MAX_WORKERS'] = '1'
+
+def _serve_fake(conn, latency: float, seed: Dict[str, Any], credentials_dir: str):
+    """替身进程入口: 生成数据、写入凭据，把 (地址, 账号列表) 发回后一直运行到被终止"""
+    from services.fake_gcp import FakeGcpConfig, FakeGcpServer, FakeGcpState
+
+    state = FakeGcpState(FakeGcpConfig(latency=latency))
+    state.seed(**seed)
+    server = FakeGcpServer(state)
+    conn.send((server.url, server.write_credentials(credentials_dir)))
+    conn.close()
+    server.serve_forever()
+
+class _FakeGcpProcess:
+    """在独立进程中运行的替身，通过 /_fake/ 管理接口读取状态和关闭账单"""
+
+    def __init__(self, latency: float, seed: Dict[str, Any], credentials_dir: str):
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_serve_fake, args=(child_conn, latency, seed, credentials_dir), name='fake-gcp', daemon=True
+        )
+        self.process.start()
+        if not parent_conn.poll(120):
+            self.stop()
+            raise RuntimeError('替身进程启动超时')
+        self.url, self.accounts = parent_conn.recv()
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(
+            f"{self.url}{path}", data=data, method=method, headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self._request('GET', '/_fake/state')
+
+    def stats(self) -> Dict[str, Any]:
+        return self._request('GET', '/_fake/stats')
+
+    def reset_stats(self):
+        self._request('POST', '/_fake/reset-stats', {})
+
+    def close_billing_accounts(self, fraction: float) -> List[str]:
+        return self._request('POST', '/_fake/close-billing', {'fraction': fraction})['closed']
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join(10)
+
+class _StatementCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+
+class _RebindWatcher:
+    """轮次进行中定期检查替身状态（_FakeGcpProcess），记录关闭账单上的项目全部换绑的时间"""
+
+    def __init__(self, state, interval: float = 0.1):
+        self.state = state
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.rebound_at: Optional[float] = None
+        self.initial = state.snapshot()['projects_on_closed_billing']
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        if self.initial:
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.state.snapshot()['projects_on_closed_billing'] == 0:
+                self.rebound_at = time.perf_counter() - self.start
+                return
+
+    def stop(self) -> Optional[float]:
+        self._stop_event.set()
+        if not self.initial:
+            return None
+        self._thread.join()
+        if self.rebound_at is None and self.state.snapshot()['projects_on_closed_billing'] == 0:
+            self.rebound_at = time.perf_counter() - self.start
+        return round(self.rebound_at, 3) if self.rebound_at is not None else None
+
+def run_profile(name: str, args) -> Dict[str, Any]:
+    profile = PROFILES[name]
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    credentials_dir = os.path.join(workdir, 'credentials')
+    state = _FakeGcpProcess(args.latency, dict(profile['seed'], seed=args.seed), credentials_dir)
+    try:
+        return _run_cycles(name, args, profile, state, workdir)
+    finally:
+        state.stop()
+
+def _run_cycles(name: str, args, profile: Dict[str, Any], state: _FakeGcpProcess, workdir: str) -> Dict[str, Any]:
+    _configure_environment(args, state.url, os.path.join(workdir, 'credentials'), [a['name'] for a in state.accounts], workdir)
+
+    from sqlalchemy import event
+    from app import create_app
+    from models import db
+    from services.audit_log import get_audit_writer
+    from services.billing_poll import poll_once
+    from services.billing_service import run_sync_cycle
+
+    logging.getLogger().setLevel(logging.WARNING)
+    app = create_app()
+    with app.app_context():
+        if args.database_url:
+            # 本地 MySQL: 每个场景从空表开始
+            db.drop_all()
+            db.create_all()
+        counter = _StatementCounter()
+        event.listen(db.engine, 'before_cursor_execute', counter)
+
+    project_count = state.snapshot()['projects']
+    cycles = []
+    for cycle, step in enumerate(profile['steps']):
+        if step.startswith('close:'):
+            closed = state.close_billing_accounts(float(step.split(':', 1)[1]))
+            logging.warning(f"[{name}] 关闭 {len(closed)} 个账单账户")
+
+        state.reset_stats()
+        statements_before = counter.count
+        watcher = _RebindWatcher(state)
+        start = time.perf_counter()
+        with app.app_context():
+            if step.startswith('close:'):
+                # round_index=0: 强制完整列出账单账户，不复用上一轮的列表
+                poll_once(app, app.config['GCP_ACCOUNTS'], 0)
+                failed_count = None
+            else:
+                _, failed_count = run_sync_cycle(app, app.config['GCP_ACCOUNTS'], cycle)
+        wall_time = time.perf_counter() - start
+        rebind_seconds = watcher.stop()
+        writer = get_audit_writer()
+        if writer is not None:
+            writer.flush()
+
+        stats = state.stats()
+        api_calls = stats['total_calls']
+        snapshot = stats['state']
+        cycles.append({
+            'step': step,
+            'wall_time': round(wall_time, 3),
+            'api_calls': api_calls,
+            'api_calls_per_project': round(api_calls / max(1, project_count), 3),
+            'db_statements': counter.count - statements_before,
+            'rebind_seconds': rebind_seconds,
+            'projects_to_rebind': watcher.initial,
+            'remaining_on_closed': snapshot['projects_on_closed_billing'],
+            'failed_accounts': failed_count,
+            'api_calls_by_method': stats['calls']
+        })
+        logging.warning(f"[{name}] 第 {cycle} 轮 ({step}): {wall_time:.2f}s, {api_calls} 次 API 调用")
+
+    return {
+        'description': profile['description'],
+        'seed': profile['seed'],
+        'projects': project_count,
+        'cycles': cycles,
+        # Linux 上 ru_maxrss 单位为 KB
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+# ==================== 主进程: 调度场景、保存和比较结果 ====================
+
+def _child_command(name: str, args, output_path: str) -> List[str]:
+    command = [
+        sys.executable, '-m', 'benchmarks.bench_sync', '--child', name, '--child-output', output_path,
+        '--mode', args.mode, '--latency', str(args.latency), '--qps', str(args.qps), '--seed', str(args.seed)
+    ]
+    if args.database_url:
+        command += ['--database-url', args.database_url]
+    return command
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_all(args) -> Dict[str, Any]:
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'mode': args.mode,
+            'latency': args.latency,
+            'qps': args.qps,
+            'database': 'mysql' if args.database_url else 'sqlite'
+        },
+        'profiles': {}
+    }
+    for name in args.profiles:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            output_path = f.name
+        try:
+            subprocess.run(_child_command(name, args, output_path), cwd=REPO_ROOT, check=True)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                results['profiles'][name] = json.load(f)
+        finally:
+            os.remove(output_path)
+    return results
+
+def _flatten(results: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """{场景.轮次.指标: 值}，未记录的指标为 None"""
+    values = {}
+    for name, profile in results['profiles'].items():
+        values[f"{name}.peak_rss_mb"] = profile.get('peak_rss_mb')
+        for index, cycle in enumerate(profile['cycles']):
+            for metric in COMPARED_METRICS:
+                values[f"{name}.cycle{index}.{metric}"] = cycle.get(metric)
+    return values
+
+def check_results(results: Dict[str, Any]) -> List[str]:
+    """不依赖基线的检查: 任一轮结束时仍有项目绑定在关闭的账单上"""
+    problems = []
+    for name, profile in results['profiles'].items():
+        for index, cycle in enumerate(profile['cycles']):
+            if cycle.get('remaining_on_closed'):
+                problems.append(f"{name}.cycle{index} ({cycle['step']}): {cycle['remaining_on_closed']} 个项目仍绑定在关闭的账单上")
+    return problems
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回相对基线变差超过 tolerance 的指标说明；基线中有值而本次缺失（null 或没有该轮）也算变差"""
+    current, previous = _flatten(results), _flatten(baseline)
+    regressions = []
+    for key in sorted(previous.keys()):
+        old, new = previous[key], current.get(key)
+        if old is None:
+            continue
+        if new is None:
+            regressions.append(f"{key}: {old} -> {'null' if key in current else 'missing'}")
+            continue
+        if key.endswith(('wall_time', 'rebind_seconds')) and max(old, new) < MIN_COMPARED_SECONDS:
+            continue
+        if new > old * (1 + tolerance):
+            change = f"+{(new - old) / old:.0%}" if old else 'new'
+            regressions.append(f"{key}: {old} -> {new} ({change})")
+    return regressions
+
+def print_summary(results: Dict[str, Any]):
+    print(f"{'profile':<14} {'cycle':<14} {'wall(s)':>9} {'calls/proj':>10} {'db stmts':>9} {'rebind(s)':>10} {'left':>6}")
+    for name, profile in results['profiles'].items():
+        for cycle in profile['cycles']:
+            rebind = '-' if cycle['rebind_seconds'] is None else f"{cycle['rebind_seconds']:.2f}"
+            print(
+                f"{name:<14} {cycle['step']:<14} {cycle['wall_time']:>9.2f} {cycle['api_calls_per_project']:>10.2f} "
+                f"{cycle['db_statements']:>9} {rebind:>10} {cycle['remaining_on_closed']:>6}"
+            )
+        print(f"{name:<14} peak RSS {profile['peak_rss_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='同步引擎端到端压测')
+    parser.add_argument('--profiles', default='smoke', help=f"逗号分隔: {', '.join(PROFILES)}，或 all")
+    parser.add_argument('--mode', default='thread', choices=('thread', 'async', 'process'), help='SYNC_EXECUTION_MODE')
+    parser.add_argument('--latency', type=float, default=0.005, help='替身每个请求的延迟（秒）')
+    parser.add_argument('--qps', type=int, default=1000, help='MAX_QPS_PER_ACCOUNT')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', default='', help='默认每个场景使用新的 SQLite 文件')
+    parser.add_argument('--output', default='', help='结果 JSON 路径，默认 data/benchmarks/<时间>.json')
+    parser.add_argument('--baseline', default='', help='与该结果文件比较')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--child', default='', help=argparse.SUPPRESS)
+    parser.add_argument('--child-output', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.child:
+        result = run_profile(args.child, args)
+        with open(args.child_output, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    args.profiles = list(PROFILES) if args.profiles == 'all' else [name.strip() for name in args.profiles.split(',')]
+    unknown = [name for name in args.profiles if name not in PROFILES]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    results = run_all(args)
+    output = args.output or os.path.join('data', 'benchmarks', f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print_summary(results)
+    print(f"结果已保存: {output}")
+
+    problems = check_results(results)
+    if problems:
+        print("同步结果不正确:")
+        for line in problems:
+            print(f"  {line}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"相对基线变差超过 {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("未发现超过阈值的回归")
+
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+# benchmarks/micro.py - 热点函数微基准
+#
+# 覆盖同步和 API 的几条热点路径，输入为合成数据，规模 10² / 10⁴ / 10⁶:
+#   billing_usage           get_current_billing_usage（n 个项目）
+#   allocation_plan         get_billing_allocation_plan（n 个待分配项目，n/2 个账单）
+#   rate_limiter_t*         RateLimiter.acquire 在 1 / 8 / 32 个线程争用下获取 n 个令牌（令牌充足，只测锁和记账开销；
+#                           包括启动线程的时间，小规模时以线程启动为主）
+#   rate_limiter_throttled  令牌不足时 8 个线程以 QPS 上限获取 n 个令牌，记录实际达到的 QPS
+#   retry_overhead          retry_with_exponential_backoff 包装一次成功调用相对直接调用的额外开销
+#   retry_path              第一次 503、第二次成功（延迟为 0），测重试记账（日志、指标、配额）的开销
+#   serialize_*             n 个项目经 to_dict + jsonify / fast_jsonify / 列式响应编码
+#
+# 稳定比较: 每个用例先预热一次，再采样 --repeat 次（采样期间关闭 GC），小规模用例在一次采样内循环到
+# 至少 MIN_SAMPLE_SECONDS 以降低计时噪声；结果记录每次操作耗时的中位数、最小值和最大值。
+# 与 --baseline 比较时，只有中位数超过基线中位数 (1 + tolerance) 倍且超过基线最大值才算回归。
+#
+# 用法:
+#   python -m benchmarks.micro --output data/benchmarks/micro-baseline.json
+#   python -m benchmarks.micro --max-size 10000 --baseline data/benchmarks/micro-baseline.json
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_sync import _git_commit
+
+SIZES = (100, 10_000, 1_000_000)
+MIN_SAMPLE_SECONDS = 0.05
+LIMITER_THREADS = (1, 8, 32)
+
+# ==================== 合成数据 ====================
+
+def _billing_names(count: int) -> List[str]:
+    return [f"billingAccounts/{index:06X}-BENCH-{index % 97:02d}" for index in range(count)]
+
+def _projects_billing_info(size: int, rng: random.Random) -> Dict[str, str]:
+    """约 10% 的项目没有账单，其余分布在 size/50 个账单上"""
+    billings = _billing_names(max(1, size // 50))
+    info = {}
+    for index in range(size):
+        roll = rng.random()
+        if roll < 0.05:
+            info[f"bench-project-{index}"] = None
+        elif roll < 0.1:
+            info[f"bench-project-{index}"] = 'None'
+        else:
+            info[f"bench-project-{index}"] = rng.choice(billings)
+    return info
+
+def _project_rows(size: int):
+    """与 Project.api_columns 顺序一致的行元组"""
+    updated_at = datetime(2024, 1, 1, 12, 0, 0)
+    billings = _billing_names((size + 2) // 3)
+    rows = []
+    for index in range(size):
+        billing = billings[index // 3]
+        rows.append((index + 1, f"bench-project-{index}", billing.split('/')[-1], billing,
+                     f"Bench Billing {index // 3}", index % 50 + 1, updated_at))
+    return rows
+
+# ==================== 用例 ====================
+# 每个 setup 函数返回 (执行一次操作的函数, 附加指标函数或 None)，准备数据的时间不计入
+
+def setup_billing_usage(size: int, rng: random.Random):
+    from services.billing_service import get_current_billing_usage
+
+    info = _projects_billing_info(size, rng)
+    return lambda: get_current_billing_usage(info), None
+
+def setup_allocation_plan(size: int, rng: random.Random):
+    from services.billing_service import CONFIG, get_billing_allocation_plan
+
+    unbound = [f"bench-unbound-{index}" for index in range(size)]
+    billings = _billing_names(max(1, size // 2))
+    usage = {billing: rng.randint(0, CONFIG.max_projects_per_billing) for billing in billings}
+    return lambda: get_billing_allocation_plan(unbound, billings, usage), None
+
+def _setup_rate_limiter(size: int, threads: int):
+    from services.billing_service import RateLimiter
+
+    def run():
+        # 令牌充足: 不会进入 sleep，只测锁争用和令牌计算
+        limiter = RateLimiter(10 ** 9, 'bench')
+        per_thread = max(1, size // threads)
+        workers = [
+            threading.Thread(target=lambda: [limiter.acquire() for _ in range(per_thread)])
+            for _ in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    return run, None
+
+def setup_rate_limiter_throttled(size: int, rng: random.Random):
+    from services.billing_service import RateLimiter
+
+    max_qps, threads = 1000, 8
+    achieved = []
+
+    def run():
+        limiter = RateLimiter(max_qps, 'bench-throttled')
+        # 初始令牌桶是满的，先取空，只测稳态
+        while limiter.tokens >= 1:
+            limiter.acquire()
+        per_thread = max(1, size // threads)
+        start = time.perf_counter()
+        workers = [
+            threading.Thread(target=lambda: [limiter.acquire() for _ in range(per_thread)])
+            for _ in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        achieved.append(per_thread * threads / (time.perf_counter() - start))
+
+    return run, lambda: {'max_qps': max_qps, 'achieved_qps': round(statistics.median(achieved), 1)}
+
+def setup_retry_overhead(size: int, rng: random.Random):
+    from services.billing_service import retry_with_exponential_backoff
+
+    func = lambda: None
+
+    def run():
+        for _ in range(size):
+            retry_with_exponential_backoff(func)
+
+    return run, None
+
+def setup_retry_path(size: int, rng: random.Random):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    from services.billing_service import retry_with_exponential_backoff
+
+    error = HttpError(httplib2.Response({'status': 503}), b'{}')
+
+    def run():
+        for _ in range(size):
+            attempts = []
+
+            def flaky():
+                attempts.append(1)
+                if len(attempts) == 1:
+                    raise error
+
+            retry_with_exponential_backoff(flaky, max_retries=3, base_delay=0, max_delay=0, enable_jitter=False)
+
+    return run, None
+
+def _serialization_app():
+    from flask import Flask
+
+    return Flask('bench')
+
+def setup_serialize_to_dict(size: int, rng: random.Random):
+    from flask import jsonify
+    from models import Project
+
+    app = _serialization_app()
+    projects = [Project(**dict(zip(Project.api_columns, row))) for row in _project_rows(size)]
+
+    def run():
+        with app.app_context():
+            jsonify({'status': 'success', 'data': [project.to_dict() for project in projects]}).get_data()
+
+    return run, None
+
+def setup_serialize_rows(size: int, rng: random.Random):
+    from models import Project
+    from routes.serialization import fast_jsonify, rows_payload
+
+    app = _serialization_app()
+    rows = _project_rows(size)
+
+    def run():
+        with app.app_context():
+            fast_jsonify({'status': 'success', 'data': rows_payload(Project.api_columns, rows)}).get_data()
+
+    return run, None
+
+def setup_serialize_columnar(size: int, rng: random.Random):
+    from models import Project
+    from routes.serialization import fast_jsonify, rows_payload
+
+    app = _serialization_app()
+    rows = _project_rows(size)
+
+    def run():
+        with app.app_context():
+            fast_jsonify({'status': 'success', 'data': rows_payload(Project.api_columns, rows, columnar=True)}).get_data()
+
+    return run, None
+
+# 名称 → (setup, 规模)。ORM 实例占内存较多，to_dict 序列化最大到 10⁵；带 sleep 的用例只用小规模
+BENCHMARKS: Dict[str, Any] = {
+    'billing_usage': (setup_billing_usage, SIZES),
+    'allocation_plan': (setup_allocation_plan, SIZES),
+    **{
+        f"rate_limiter_t{threads}": (lambda size, rng, threads=threads: _setup_rate_limiter(size, threads), SIZES)
+        for threads in LIMITER_THREADS
+    },
+    'rate_limiter_throttled': (setup_rate_limiter_throttled, (100, 1000)),
+    'retry_overhead': (setup_retry_overhead, SIZES),
+    'retry_path': (setup_retry_path, (100, 10_000)),
+    'serialize_to_dict': (setup_serialize_to_dict, (100, 10_000, 100_000)),
+    'serialize_rows': (setup_serialize_rows, SIZES),
+    'serialize_columnar': (setup_serialize_columnar, SIZES),
+}
+
+# ==================== 计时 ====================
+
+def _sample(run: Callable[[], None], loops: int) -> float:
+    """执行 loops 次，返回每次耗时（秒）"""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        return (time.perf_counter() - start) / loops
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def measure(run: Callable[[], None], repeat: int) -> Dict[str, Any]:
+    """预热并确定每次采样的循环次数，然后采样 repeat 次"""
+    elapsed = _sample(run, 1)
+    loops = 1
+    while elapsed * loops < MIN_SAMPLE_SECONDS and loops < 10 ** 6:
+        loops *= 10
+    samples = [_sample(run, loops) for _ in range(repeat)]
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples),
+        'loops': loops,
+        'repeat': repeat
+    }
+
+def run_benchmarks(names: List[str], max_size: int, repeat: int, seed: int) -> Dict[str, Any]:
+    results = {}
+    for name in names:
+        setup, sizes = BENCHMARKS[name]
+        for size in sizes:
+            if size > max_size:
+                continue
+            run, extra = setup(size, random.Random(seed))
+            key = f"{name}[{size}]"
+            results[key] = measure(run, repeat)
+            results[key]['per_item_ns'] = round(results[key]['median'] / size * 1e9, 1)
+            if extra is not None:
+                results[key].update(extra())
+            print(f"{key:<36} {results[key]['median'] * 1e3:>12.3f} ms {results[key]['per_item_ns']:>12.1f} ns/项", flush=True)
+            # 释放上一个规模的数据，避免影响下一个用例
+            del run, extra
+            gc.collect()
+    return results
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回相对基线变慢超过 tolerance 且超出基线采样范围的用例说明"""
+    regressions = []
+    for key in sorted(results['benchmarks'].keys() & baseline['benchmarks'].keys()):
+        old, new = baseline['benchmarks'][key], results['benchmarks'][key]
+        if new['median'] > old['median'] * (1 + tolerance) and new['median'] > old['max']:
+            regressions.append(
+                f"{key}: {old['median'] * 1e3:.3f}ms -> {new['median'] * 1e3:.3f}ms "
+                f"(+{(new['median'] - old['median']) / old['median']:.0%})"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='热点函数微基准')
+    parser.add_argument('--benchmarks', default='all', help=f"逗号分隔: {', '.join(BENCHMARKS)}，或 all")
+    parser.add_argument('--max-size', type=float, default=max(SIZES), help='只运行不超过该规模的用例，如 1e4')
+    parser.add_argument('--repeat', type=int, default=7, help='每个用例的采样次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='', help='结果 JSON 路径，默认 data/benchmarks/micro-<时间>.json')
+    parser.add_argument('--baseline', default='', help='与该结果文件比较')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    # 被测函数中的日志调用照常执行，但不输出（输出到终端的耗时与被测代码无关且波动大）
+    logging.disable(logging.CRITICAL)
+
+    names = list(BENCHMARKS) if args.benchmarks == 'all' else [name.strip() for name in args.benchmarks.split(',')]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知用例: {', '.join(unknown)}")
+
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'benchmarks': run_benchmarks(names, int(args.max_size), args.repeat, args.seed)
+    }
+
+    output = args.output or os.path.join('data', 'benchmarks', f"micro-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"结果已保存: {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for field in ('python', 'machine'):
+            if baseline['meta'].get(field) != results['meta'][field]:
+                print(f"注意: 基线的 {field} 为 {baseline['meta'].get(field)}，与当前 {results['meta'][field]} 不同，结果可能不可比")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("发现回归:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("未发现超过阈值的回归")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# gunicorn.conf.py - Web 进程配置，同步任务由 services.sync_worker 单独运行
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8848')}"
+workers = int(os.getenv('WEB_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 8))
+# 手动操作和批量操作提交为后台任务（见 services/jobs.py），请求只做数据库读写，
+# 超时只需覆盖最慢的查询；卡住的 worker 尽快被重启
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """多进程指标目录在启动时清空，避免沿用上次运行的计数"""
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        import shutil
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    """worker 退出后清理其 Gauge 文件"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(worker.pid)
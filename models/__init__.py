@@ -3,7 +3,15 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 
 # 导入模型类
-from .models import ServiceAccount, Project, BillingAccount, BillingOperation
+from .models import (
+    ServiceAccount, Project, BillingAccount, BillingOperation,
+    BillingOperationArchive, BillingOperationDailyRollup, WorkerHeartbeat, AccountLease, AccountLock, LeaderLease,
+    ResyncRequest, Job, IamPolicySnapshot, IamAdminGrant, ApiUsage, ensure_columns, ensure_indexes
+)
 
 # 导出这些类，使它们可以通过 models 包直接访问
-__all__ = ['db', 'ServiceAccount', 'Project', 'BillingAccount', 'BillingOperation']
\ No newline at end of file
+__all__ = [
+    'db', 'ServiceAccount', 'Project', 'BillingAccount', 'BillingOperation',
+    'BillingOperationArchive', 'BillingOperationDailyRollup', 'WorkerHeartbeat', 'AccountLease', 'AccountLock', 'LeaderLease',
+    'ResyncRequest', 'Job', 'IamPolicySnapshot', 'IamAdminGrant', 'ApiUsage', 'ensure_columns', 'ensure_indexes'
+]
\ No newline at end of file
@@ -1,5 +1,10 @@
 # models/models.py
+import json
+import logging
 from datetime import datetime
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn
 from . import db
 
 class ServiceAccount(db.Model):
@@ -20,13 +25,17 @@ class Project(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.String(100), nullable=False)
-    service_account_id = db.Column(db.Integer, db.ForeignKey('service_accounts.id'), nullable=False)
+    service_account_id = db.Column(db.Integer, db.ForeignKey('service_accounts.id'), nullable=False, index=True)
     billing_account_id = db.Column(db.String(100), nullable=True)
     billing_account_name = db.Column(db.String(200), nullable=True)
     billing_account_display_name = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # API 列投影查询返回的列，与 to_dict() 的字段一致
+    api_columns = ('id', 'project_id', 'billing_account_id', 'billing_account_name',
+                   'billing_account_display_name', 'service_account_id', 'updated_at')
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -47,10 +56,14 @@ class BillingAccount(db.Model):
     account_id = db.Column(db.String(100), nullable=False)
     is_open = db.Column(db.Boolean, default=True)
     is_used = db.Column(db.Boolean, default=False)
-    service_account_id = db.Column(db.Integer, db.ForeignKey('service_accounts.id'), nullable=False)
+    service_account_id = db.Column(db.Integer, db.ForeignKey('service_accounts.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # API 列投影查询返回的列，与 to_dict() 的字段一致
+    api_columns = ('id', 'name', 'display_name', 'account_id', 'is_open', 'is_used',
+                   'service_account_id', 'updated_at')
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -65,6 +78,10 @@ class BillingAccount(db.Model):
 
 class BillingOperation(db.Model):
     __tablename__ = 'billing_operations'
+    __table_args__ = (
+        # 账号详情页 / 最近操作查询: WHERE service_account_id = ? ORDER BY created_at DESC
+        db.Index('ix_billing_operations_account_created', 'service_account_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     operation_type = db.Column(db.String(50), nullable=False)  # e.g., 'update', 'remove_permission'
@@ -75,7 +92,11 @@ class BillingOperation(db.Model):
     new_value = db.Column(db.String(300), nullable=True)
     status = db.Column(db.String(50), nullable=False)  # 'success', 'failed'
     message = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    # API 列投影查询返回的列，与 to_dict() 的字段一致
+    api_columns = ('id', 'operation_type', 'service_account_id', 'project_id', 'billing_account_id',
+                   'old_value', 'new_value', 'status', 'message', 'created_at')
     
     def to_dict(self):
         return {
@@ -89,4 +110,263 @@ class BillingOperation(db.Model):
             'status': self.status,
             'message': self.message,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class BillingOperationArchive(db.Model):
+    """超过保留期的操作记录归档表，结构与 billing_operations 一致"""
+    __tablename__ = 'billing_operations_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    operation_type = db.Column(db.String(50), nullable=False)
+    service_account_id = db.Column(db.Integer, nullable=False, index=True)
+    project_id = db.Column(db.String(100), nullable=True)
+    billing_account_id = db.Column(db.String(100), nullable=True)
+    old_value = db.Column(db.String(300), nullable=True)
+    new_value = db.Column(db.String(300), nullable=True)
+    status = db.Column(db.String(50), nullable=False)
+    message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=True, index=True)
+
+class BillingOperationDailyRollup(db.Model):
+    """操作记录按天汇总: 每个服务账号、操作类型、状态一行"""
+    __tablename__ = 'billing_operation_daily_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'service_account_id', 'operation_type', 'status',
+                            name='uq_billing_operation_daily_rollup'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    service_account_id = db.Column(db.Integer, nullable=False)
+    operation_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'service_account_id': self.service_account_id,
+            'operation_type': self.operation_type,
+            'status': self.status,
+            'count': self.count
+        }
+
+class WorkerHeartbeat(db.Model):
+    """同步进程心跳 - 心跳超时的进程视为已退出，其服务账号会被重新分配"""
+    __tablename__ = 'worker_heartbeats'
+    
+    worker_id = db.Column(db.String(100), primary_key=True)
+    hostname = db.Column(db.String(200), nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    heartbeat_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class AccountLease(db.Model):
+    """服务账号租约 - 同一时间每个服务账号只由一个同步进程处理"""
+    __tablename__ = 'account_leases'
+    
+    account_name = db.Column(db.String(200), primary_key=True)
+    owner_id = db.Column(db.String(100), nullable=True, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=True)
+
+class AccountLock(db.Model):
+    """服务账号处理锁 - 全量同步、快速轮询和定向重新同步之间跨进程互斥
+    
+    在独立的短事务中获取和释放，不引用 service_accounts（持锁期间不会阻塞子表写入）；
+    expires_at 过期后视为持有者已退出。
+    """
+    __tablename__ = 'account_locks'
+    
+    account_name = db.Column(db.String(200), primary_key=True)
+    owner_id = db.Column(db.String(100), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=True)
+
+class LeaderLease(db.Model):
+    """leader 租约 - 全局单例任务（数据保留、清理）同一时间只由一个同步进程执行
+    
+    每次易主时 epoch 加一，单例任务在自己的事务中校验 epoch（fencing），租约被接管后旧 leader 的写入会失败。
+    """
+    __tablename__ = 'leader_leases'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    owner_id = db.Column(db.String(100), nullable=True)
+    epoch = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=True)
+
+class ResyncRequest(db.Model):
+    """定向重新同步请求 - 由 webhook 写入，同步进程按服务账号领取处理"""
+    __tablename__ = 'resync_requests'
+    __table_args__ = (
+        db.Index('ix_resync_requests_status_id', 'status', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    service_account_name = db.Column(db.String(200), nullable=False)
+    target_type = db.Column(db.String(50), nullable=False)  # 'service_account', 'billing_account', 'project'
+    target = db.Column(db.String(200), nullable=False)
+    source = db.Column(db.String(100), nullable=True)
+    status = db.Column(db.String(50), nullable=False, default='pending')  # 'pending', 'running', 'done', 'failed'
+    coalesced = db.Column(db.Integer, nullable=False, default=0)
+    # 待处理期间为 (服务账号, 目标类型, 目标) 的摘要，领取时清空；唯一索引保证相同目标只有一条待处理请求
+    pending_key = db.Column(db.String(40), nullable=True, unique=True, index=True)
+    message = db.Column(db.Text, nullable=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'service_account_name': self.service_account_name,
+            'target_type': self.target_type,
+            'target': self.target,
+            'source': self.source,
+            'status': self.status,
+            'coalesced': self.coalesced,
+            'message': self.message,
+            'requested_at': self.requested_at.isoformat() if self.requested_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class Job(db.Model):
+    """手动操作的异步任务 - Web 进程内执行，状态写入数据库供任意 Web 进程查询"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.String(36), primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    resource_key = db.Column(db.String(300), nullable=False)
+    # 排队或执行期间等于 resource_key，结束时清空；唯一索引保证同一资源只有一个活动任务（跨进程）
+    active_key = db.Column(db.String(300), nullable=True, unique=True, index=True)
+    service_account_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed'
+    total = db.Column(db.Integer, nullable=False, default=1)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # 执行进程定期刷新（排队期间同样刷新）；超过 task_timeout 未刷新视为执行进程已退出
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'resource_key': self.resource_key,
+            'service_account_id': self.service_account_id,
+            'status': self.status,
+            'total': self.total,
+            'completed': self.completed,
+            'failed': self.failed,
+            'message': self.message,
+            'result': json.loads(self.result) if self.result else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None
+        }
+
+class IamPolicySnapshot(db.Model):
+    """IAM 清单: 每个资源最近一次扫描到的策略 etag"""
+    __tablename__ = 'iam_policy_snapshots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    resource = db.Column(db.String(200), unique=True, nullable=False)  # projects/xxx 或 billingAccounts/xxx
+    resource_type = db.Column(db.String(20), nullable=False)  # 'project', 'billing_account'
+    etag = db.Column(db.String(100), nullable=True)
+    error = db.Column(db.String(300), nullable=True)
+    scanned_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class IamAdminGrant(db.Model):
+    """IAM 清单: 服务账号在资源上仍持有的管理员角色，每个 (服务账号, 资源) 一行"""
+    __tablename__ = 'iam_admin_grants'
+    __table_args__ = (
+        # 按服务账号查询仍有管理员权限的资源
+        db.Index('ix_iam_admin_grants_account_type', 'service_account_id', 'resource_type', 'resource'),
+        db.UniqueConstraint('resource', 'service_account_id', name='uq_iam_admin_grants_resource_account'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    service_account_id = db.Column(db.Integer, nullable=False)
+    resource = db.Column(db.String(200), nullable=False)
+    resource_type = db.Column(db.String(20), nullable=False)
+    roles = db.Column(db.String(300), nullable=False)  # 逗号分隔
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'resource': self.resource,
+            'resource_type': self.resource_type,
+            'roles': self.roles.split(','),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ApiUsage(db.Model):
+    """Google API 调用量台账: 每个服务账号、API 方法、小时一行"""
+    __tablename__ = 'api_usage'
+    __table_args__ = (
+        db.UniqueConstraint('service_account_name', 'method', 'bucket', name='uq_api_usage_account_method_bucket'),
+        # 按时间汇总所有服务账号当天的调用量
+        db.Index('ix_api_usage_bucket', 'bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    service_account_name = db.Column(db.String(200), nullable=False)
+    method = db.Column(db.String(150), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)  # 小时起点 (UTC)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    retries = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'service_account_name': self.service_account_name,
+            'method': self.method,
+            'bucket': self.bucket.isoformat(),
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries
+        }
+
+def ensure_columns():
+    """为已存在的表补建新增的可空列 (db.create_all 不会修改旧表)"""
+    inspector = inspect(db.engine)
+    for table in db.Model.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=db.engine.dialect)}"
+            try:
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql(ddl)
+                logging.info(f"已为表 {table.name} 添加列 {column.name}")
+            except (OperationalError, ProgrammingError):
+                # 其他进程已先添加该列 (MySQL 1060 Duplicate column name)；确认存在后忽略
+                if column.name not in {item['name'] for item in inspect(db.engine).get_columns(table.name)}:
+                    raise
+
+def ensure_indexes():
+    """为已存在的表补建索引 (db.create_all 不会给旧表添加新索引)"""
+    inspector = inspect(db.engine)
+    for table in db.Model.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(bind=db.engine)
+                except (OperationalError, ProgrammingError):
+                    # 多个进程（gunicorn worker、同步 worker、进程池子进程）同时启动时，
+                    # 其他进程可能已先建好该索引 (MySQL 1061 Duplicate key name)；确认存在后忽略
+                    if index.name not in {item['name'] for item in inspect(db.engine).get_indexes(table.name)}:
+                        raise
+                    logging.info(f"索引 {index.name} 已由其他进程创建")
@@ -1,40 +1,138 @@
 # routes/api.py
+from threading import Lock
+from cachetools import TTLCache
 from flask import Blueprint, jsonify, request, current_app
-from models import db, ServiceAccount, Project, BillingAccount, BillingOperation
-from services.billing_service import delete_billing_account_record, remove_billing_admin_rights, unbind_project_billing
+from models import db, ServiceAccount, Project, BillingAccount, BillingOperation, ResyncRequest
+from services.billing_service import CONFIG, delete_billing_account_record, get_iam_stats, get_pool_stats, log_operation, remove_billing_admin_rights, unbind_project_billing
+from services.http_transport import get_transport_stats
+from services.token_manager import get_token_stats
+from services.tracing import get_trace_stats
+from routes.serialization import fast_jsonify, query_columns, rows_payload, wants_columnar
+import hashlib
+import hmac
 import logging
+import os
+import time
 
 api_bp = Blueprint('api', __name__)
 
+# 账号详情聚合接口可选择的数据块
+OVERVIEW_FIELDS = ('projects', 'active_billing_accounts', 'inactive_billing_accounts', 'recent_operations')
+
+# 账号详情聚合结果缓存: (account_id, fields, operations_limit, columnar) -> (响应体, ETag)
+_overview_cache = TTLCache(maxsize=256, ttl=CONFIG.overview_cache_ttl)
+_overview_cache_lock = Lock()
+
+def invalidate_account_overview(account_id):
+    """账号下的数据发生变化后清除对应的聚合缓存"""
+    account_id = int(account_id)
+    with _overview_cache_lock:
+        for key in [key for key in _overview_cache.keys() if key[0] == account_id]:
+            _overview_cache.pop(key, None)
+
+def _job_accepted(job, coalesced, message):
+    """异步任务已提交: 返回 202 和任务查询地址"""
+    response = jsonify({
+        'status': 'success',
+        'message': '已有相同的任务在执行，返回该任务' if coalesced else message,
+        'data': dict(job, coalesced=coalesced)
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+def _build_account_overview(account_id, fields, operations_limit, columnar=False):
+    """按需查询账号详情页所需的全部数据，每类数据只查询一次"""
+    account = ServiceAccount.query.get(account_id)
+    if not account:
+        return None
+    
+    data = {
+        'account': {
+            'id': account.id,
+            'name': account.name,
+            'email': account.email
+        }
+    }
+    
+    if 'projects' in fields:
+        names, rows = query_columns(Project, Project.service_account_id == account_id)
+        data['projects'] = rows_payload(names, rows, columnar)
+        project_count = len(rows)
+    else:
+        project_count = Project.query.filter_by(service_account_id=account_id).count()
+    
+    # 活跃/失效账单共用一次查询，在内存中按 is_open 拆分
+    if 'active_billing_accounts' in fields or 'inactive_billing_accounts' in fields:
+        names, rows = query_columns(BillingAccount, BillingAccount.service_account_id == account_id)
+        is_open_index = names.index('is_open')
+        active_billing = [row for row in rows if row[is_open_index]]
+        inactive_billing = [row for row in rows if not row[is_open_index]]
+        if 'active_billing_accounts' in fields:
+            data['active_billing_accounts'] = rows_payload(names, active_billing, columnar)
+        if 'inactive_billing_accounts' in fields:
+            data['inactive_billing_accounts'] = rows_payload(names, inactive_billing, columnar)
+        active_billing_count = len(active_billing)
+        inactive_billing_count = len(inactive_billing)
+    else:
+        billing_counts = dict(
+            db.session.query(BillingAccount.is_open, db.func.count(BillingAccount.id))
+            .filter(BillingAccount.service_account_id == account_id)
+            .group_by(BillingAccount.is_open)
+            .all()
+        )
+        active_billing_count = billing_counts.get(True, 0)
+        inactive_billing_count = billing_counts.get(False, 0)
+    
+    if 'recent_operations' in fields:
+        names, rows = query_columns(
+            BillingOperation,
+            BillingOperation.service_account_id == account_id,
+            order_by=BillingOperation.created_at.desc(),
+            limit=operations_limit
+        )
+        data['recent_operations'] = rows_payload(names, rows, columnar)
+    
+    data['counts'] = {
+        'projects': project_count,
+        'active_billing_accounts': active_billing_count,
+        'inactive_billing_accounts': inactive_billing_count
+    }
+    return data
+
 @api_bp.route('/service-accounts', methods=['GET'])
 def get_service_accounts():
     """获取所有服务账号信息"""
     try:
-        accounts = ServiceAccount.query.all()
-        result = []
-        
-        for account in accounts:
-            # 统计账号下的项目和账单信息
-            projects = Project.query.filter_by(service_account_id=account.id).all()
-            inactive_billing_accounts = BillingAccount.query.filter_by(
-                service_account_id=account.id, 
-                is_open=False
-            ).all()
-            active_billing_accounts = BillingAccount.query.filter_by(
-                service_account_id=account.id, 
-                is_open=True
-            ).all()
-            
-            result.append({
-                'id': account.id,
-                'name': account.name,
-                'email': account.email,
-                'project_count': len(projects),
-                'inactive_billing_count': len(inactive_billing_accounts),
-                'active_billing_count': len(active_billing_accounts)
-            })
+        accounts = db.session.query(ServiceAccount.id, ServiceAccount.name, ServiceAccount.email).all()
         
-        return jsonify({
+        # 统计账号下的项目和账单信息 - 每张表一次分组聚合，而不是逐账号加载全部行
+        project_counts = dict(
+            db.session.query(Project.service_account_id, db.func.count(Project.id))
+            .group_by(Project.service_account_id)
+            .all()
+        )
+        billing_counts = {}
+        for service_account_id, is_open, count in (
+            db.session.query(BillingAccount.service_account_id, BillingAccount.is_open, db.func.count(BillingAccount.id))
+            .group_by(BillingAccount.service_account_id, BillingAccount.is_open)
+            .all()
+        ):
+            billing_counts[(service_account_id, bool(is_open))] = count
+        
+        result = [
+            {
+                'id': account_id,
+                'name': name,
+                'email': email,
+                'project_count': project_counts.get(account_id, 0),
+                'inactive_billing_count': billing_counts.get((account_id, False), 0),
+                'active_billing_count': billing_counts.get((account_id, True), 0)
+            }
+            for account_id, name, email in accounts
+        ]
+        
+        return fast_jsonify({
             'status': 'success',
             'data': result
         })
@@ -57,28 +155,26 @@ def get_service_account_details(account_id):
                 'message': '服务账号未找到'
             }), 404
         
-        projects = Project.query.filter_by(service_account_id=account_id).all()
-        projects_data = [project.to_dict() for project in projects]
+        columnar = wants_columnar(request)
         
-        active_billing_accounts = BillingAccount.query.filter_by(
-            service_account_id=account_id, 
-            is_open=True
-        ).all()
-        active_billing_data = [account.to_dict() for account in active_billing_accounts]
+        names, rows = query_columns(Project, Project.service_account_id == account_id)
+        projects_data = rows_payload(names, rows, columnar)
         
-        inactive_billing_accounts = BillingAccount.query.filter_by(
-            service_account_id=account_id, 
-            is_open=False
-        ).all()
-        inactive_billing_data = [account.to_dict() for account in inactive_billing_accounts]
+        names, rows = query_columns(BillingAccount, BillingAccount.service_account_id == account_id)
+        is_open_index = names.index('is_open')
+        active_billing_data = rows_payload(names, [row for row in rows if row[is_open_index]], columnar)
+        inactive_billing_data = rows_payload(names, [row for row in rows if not row[is_open_index]], columnar)
         
         # 获取最近操作记录
-        operations = BillingOperation.query.filter_by(
-            service_account_id=account_id
-        ).order_by(BillingOperation.created_at.desc()).limit(20).all()
-        operations_data = [op.to_dict() for op in operations]
+        names, rows = query_columns(
+            BillingOperation,
+            BillingOperation.service_account_id == account_id,
+            order_by=BillingOperation.created_at.desc(),
+            limit=20
+        )
+        operations_data = rows_payload(names, rows, columnar)
         
-        return jsonify({
+        return fast_jsonify({
             'status': 'success',
             'data': {
                 'account': {
@@ -100,19 +196,169 @@ def get_service_account_details(account_id):
             'message': str(e)
         }), 500
 
+@api_bp.route('/service-accounts/<int:account_id>/overview', methods=['GET'])
+def get_service_account_overview(account_id):
+    """账号详情页聚合接口 - 一次请求返回账号、项目、账单和最近操作
+    
+    可选参数:
+        fields: 逗号分隔的数据块，默认全部返回
+        operations_limit: 最近操作记录条数，默认20
+    """
+    try:
+        fields_param = request.args.get('fields')
+        if fields_param:
+            fields = tuple(sorted({field.strip() for field in fields_param.split(',') if field.strip()}))
+            unknown_fields = [field for field in fields if field not in OVERVIEW_FIELDS]
+            if unknown_fields:
+                return jsonify({
+                    'status': 'error',
+                    'message': f"未知的字段: {', '.join(unknown_fields)}"
+                }), 400
+        else:
+            fields = OVERVIEW_FIELDS
+        
+        operations_limit = min(max(request.args.get('operations_limit', 20, type=int), 1), 200)
+        columnar = wants_columnar(request)
+        cache_key = (account_id, fields, operations_limit, columnar)
+        
+        with _overview_cache_lock:
+            cached = _overview_cache.get(cache_key)
+        
+        if cached is None:
+            data = _build_account_overview(account_id, fields, operations_limit, columnar)
+            if data is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': '服务账号未找到'
+                }), 404
+            
+            response = fast_jsonify({
+                'status': 'success',
+                'data': data
+            })
+            body = response.get_data()
+            cached = (body, hashlib.md5(body).hexdigest())
+            with _overview_cache_lock:
+                _overview_cache[cache_key] = cached
+        
+        body, etag = cached
+        response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # 允许浏览器缓存，但每次都要用 ETag 重新校验
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    
+    except Exception as e:
+        logging.error(f"获取服务账号聚合详情失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/service-accounts/<int:account_id>/admin-resources', methods=['GET'])
+def get_service_account_admin_resources(account_id):
+    """服务账号仍持有管理员角色的项目和账单账户（来自后台 IAM 清单扫描）
+    
+    可选参数:
+        type: project | billing_account
+    """
+    try:
+        from services.iam_inventory import admin_resources
+        
+        if not ServiceAccount.query.get(account_id):
+            return jsonify({
+                'status': 'error',
+                'message': '服务账号未找到'
+            }), 404
+        
+        resource_type = request.args.get('type')
+        if resource_type not in (None, 'project', 'billing_account'):
+            return jsonify({
+                'status': 'error',
+                'message': 'type 必须是 project 或 billing_account'
+            }), 400
+        
+        return jsonify({
+            'status': 'success',
+            'data': admin_resources(account_id, resource_type)
+        })
+    
+    except Exception as e:
+        logging.error(f"获取服务账号管理员资源失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/service-accounts/<int:account_id>/quota-usage', methods=['GET'])
+def get_service_account_quota_usage(account_id):
+    """服务账号按天、API 方法汇总的调用量，以及当前分钟/当天用量和预算
+    
+    可选参数:
+        days: 最近几天（默认 1，最多 31）
+    """
+    try:
+        from services.quota import account_usage
+        
+        service_account = ServiceAccount.query.get(account_id)
+        if not service_account:
+            return jsonify({
+                'status': 'error',
+                'message': '服务账号未找到'
+            }), 404
+        
+        days = request.args.get('days', 1, type=int)
+        if not 1 <= days <= 31:
+            return jsonify({
+                'status': 'error',
+                'message': 'days 必须在 1-31 之间'
+            }), 400
+        
+        return jsonify({
+            'status': 'success',
+            'data': account_usage(service_account.name, days)
+        })
+    
+    except Exception as e:
+        logging.error(f"获取服务账号 API 调用量失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/quota-usage', methods=['GET'])
+def get_quota_usage():
+    """所有服务账号当天（UTC）的 API 调用量"""
+    try:
+        from services.quota import get_quota_stats, usage_summary
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'accounts': usage_summary(),
+                'ledger': get_quota_stats()
+            }
+        })
+    
+    except Exception as e:
+        logging.error(f"获取 API 调用量失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
 @api_bp.route('/projects', methods=['GET'])
 def get_projects():
     """获取所有项目信息"""
     try:
         account_id = request.args.get('account_id')
-        if account_id:
-            projects = Project.query.filter_by(service_account_id=account_id).all()
-        else:
-            projects = Project.query.all()
+        criteria = [Project.service_account_id == account_id] if account_id else []
+        names, rows = query_columns(Project, *criteria)
         
-        return jsonify({
+        return fast_jsonify({
             'status': 'success',
-            'data': [project.to_dict() for project in projects]
+            'data': rows_payload(names, rows, wants_columnar(request))
         })
     
     except Exception as e:
@@ -157,33 +403,27 @@ def delete_project(project_id):
                 'message': '找不到指定的服务账号'
             }), 404
             
-        # 检查最近是否已经解除了权限
-        recent_permission_removal = BillingOperation.query.filter_by(
-            operation_type='remove_project_permission',
-            service_account_id=service_account_id,
-            project_id=project_id,
-            status='success'
-        ).order_by(BillingOperation.created_at.desc()).first()
-        
-        if not recent_permission_removal:
+        # 优先按 IAM 清单判断；项目尚未扫描时退回检查最近是否已经解除了权限
+        from services.iam_inventory import released_projects
+        if project_id not in released_projects(service_account_id, [project_id]):
             return jsonify({
                 'status': 'error',
                 'message': '删除前必须先解除服务账号对该项目的管理员权限'
             }), 400
         
+        # 删除项目记录
+        db.session.delete(project)
+        db.session.commit()
+        invalidate_account_overview(service_account_id)
+        
         # 记录操作
-        operation = BillingOperation(
+        log_operation(
             operation_type='delete_project',
             service_account_id=service_account_id,
             project_id=project_id,
             status='success',
             message='从系统中删除项目记录'
         )
-        db.session.add(operation)
-        
-        # 删除项目记录
-        db.session.delete(project)
-        db.session.commit()
         
         return jsonify({
             'status': 'success',
@@ -210,19 +450,18 @@ def remove_project_admin_rights_api(project_id):
             }), 400
         
         from services.billing_service import remove_project_admin_rights
+        from services.jobs import submit_job
         
-        success, message = remove_project_admin_rights(project_id, service_account_id)
-        
-        if success:
-            return jsonify({
-                'status': 'success',
-                'message': message
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': message
-            }), 400
+        service_account_id = int(service_account_id)
+        job, coalesced = submit_job(
+            'remove_project_admin',
+            f"project-admin:{service_account_id}:{project_id}",
+            remove_project_admin_rights,
+            args=(project_id, service_account_id),
+            service_account_id=service_account_id,
+            on_done=lambda: invalidate_account_overview(service_account_id)
+        )
+        return _job_accepted(job, coalesced, '解除项目管理员权限任务已提交')
     
     except Exception as e:
         logging.error(f"解除项目管理员权限失败: {str(e)}")
@@ -271,19 +510,18 @@ def unbind_project_billing_api(project_id):
                 'message': '找不到指定的服务账号'
             }), 404
         
-        # 调用解绑账单服务
-        success, message = unbind_project_billing(project_id, service_account_id)
+        # 解绑账单会调用 Google API，提交为异步任务
+        from services.jobs import submit_job
         
-        if success:
-            return jsonify({
-                'status': 'success',
-                'message': message
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': message
-            }), 400
+        job, coalesced = submit_job(
+            'unbind_project_billing',
+            f"project-billing:{service_account_id}:{project_id}",
+            unbind_project_billing,
+            args=(project_id, service_account_id),
+            service_account_id=service_account_id,
+            on_done=lambda: invalidate_account_overview(service_account_id)
+        )
+        return _job_accepted(job, coalesced, '解绑项目账单任务已提交')
     
     except Exception as e:
         logging.error(f"解绑项目账单失败: {str(e)}")
@@ -299,20 +537,20 @@ def get_billing_accounts():
         account_id = request.args.get('account_id')
         is_open = request.args.get('is_open')
         
-        query = BillingAccount.query
+        criteria = []
         
         if account_id:
-            query = query.filter_by(service_account_id=account_id)
+            criteria.append(BillingAccount.service_account_id == account_id)
         
         if is_open is not None:
             is_open_bool = is_open.lower() == 'true'
-            query = query.filter_by(is_open=is_open_bool)
+            criteria.append(BillingAccount.is_open == is_open_bool)
         
-        billing_accounts = query.all()
+        names, rows = query_columns(BillingAccount, *criteria)
         
-        return jsonify({
+        return fast_jsonify({
             'status': 'success',
-            'data': [account.to_dict() for account in billing_accounts]
+            'data': rows_payload(names, rows, wants_columnar(request))
         })
     
     except Exception as e:
@@ -359,19 +597,19 @@ def delete_billing_account(billing_id):
                 'message': f'有 {len(projects_using_billing)} 个项目正在使用此账单，无法删除'
             }), 400
         
+        # 删除账单记录
+        db.session.delete(billing_account)
+        db.session.commit()
+        invalidate_account_overview(service_account_id)
+        
         # 记录操作
-        operation = BillingOperation(
+        log_operation(
             operation_type='delete_billing',
             service_account_id=service_account_id,
             billing_account_id=billing_id,
             status='success',
             message='从系统中删除账单记录'
         )
-        db.session.add(operation)
-        
-        # 删除账单记录
-        db.session.delete(billing_account)
-        db.session.commit()
         
         return jsonify({
             'status': 'success',
@@ -397,21 +635,21 @@ def remove_admin_rights(billing_id):
                 'message': '缺少必要参数 service_account_id'
             }), 400
         
+        from services.jobs import submit_job
+        
         # 构建账单账户全名
         billing_account_name = f"billingAccounts/{billing_id}"
+        service_account_id = int(service_account_id)
         
-        success, message = remove_billing_admin_rights(billing_account_name, service_account_id)
-        
-        if success:
-            return jsonify({
-                'status': 'success',
-                'message': message
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': message
-            }), 400
+        job, coalesced = submit_job(
+            'remove_billing_admin',
+            f"billing-admin:{service_account_id}:{billing_account_name}",
+            remove_billing_admin_rights,
+            args=(billing_account_name, service_account_id),
+            service_account_id=service_account_id,
+            on_done=lambda: invalidate_account_overview(service_account_id)
+        )
+        return _job_accepted(job, coalesced, '解除Billing Admin权限任务已提交')
     
     except Exception as e:
         logging.error(f"解除Billing Admin权限失败: {str(e)}")
@@ -427,24 +665,26 @@ def get_operations():
         account_id = request.args.get('account_id')
         operation_type = request.args.get('type')
         
-        query = BillingOperation.query
+        criteria = []
         
         if account_id:
-            query = query.filter_by(service_account_id=account_id)
+            criteria.append(BillingOperation.service_account_id == account_id)
         
         if operation_type:
-            query = query.filter_by(operation_type=operation_type)
-        
-        # 按时间倒序排列
-        query = query.order_by(BillingOperation.created_at.desc())
+            criteria.append(BillingOperation.operation_type == operation_type)
         
-        # 限制返回数量
+        # 按时间倒序排列，限制返回数量
         limit = request.args.get('limit', 50, type=int)
-        operations = query.limit(limit).all()
+        names, rows = query_columns(
+            BillingOperation,
+            *criteria,
+            order_by=BillingOperation.created_at.desc(),
+            limit=limit
+        )
         
-        return jsonify({
+        return fast_jsonify({
             'status': 'success',
-            'data': [op.to_dict() for op in operations]
+            'data': rows_payload(names, rows, wants_columnar(request))
         })
     
     except Exception as e:
@@ -454,6 +694,455 @@ def get_operations():
             'message': str(e)
         }), 500
 
+@api_bp.route('/operations/daily-stats', methods=['GET'])
+def get_operation_daily_stats():
+    """获取按天汇总的操作统计"""
+    try:
+        from services.retention import get_daily_stats
+        
+        account_id = request.args.get('account_id', type=int)
+        days = min(max(request.args.get('days', 30, type=int), 1), 3650)
+        
+        return fast_jsonify({
+            'status': 'success',
+            'data': get_daily_stats(days, account_id)
+        })
+    
+    except Exception as e:
+        logging.error(f"获取操作统计失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def _bulk_request_params(id_field):
+    """解析批量操作请求体: service_account_id、action，以及 ID 列表或 filter 之一"""
+    payload = request.get_json(silent=True) or {}
+    service_account_id = payload.get('service_account_id')
+    ids = payload.get(id_field)
+    filters = payload.get('filter')
+    
+    if not service_account_id:
+        return None, '缺少必要参数 service_account_id'
+    try:
+        service_account_id = int(service_account_id)
+    except (TypeError, ValueError):
+        return None, 'service_account_id 必须是整数'
+    if ids is None and not isinstance(filters, dict):
+        return None, f'必须提供 {id_field} 或 filter'
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(item, str) for item in ids)):
+        return None, f'{id_field} 必须是字符串列表'
+    
+    return {
+        'service_account_id': service_account_id,
+        'action': payload.get('action'),
+        'ids': ids,
+        'filter': filters
+    }, None
+
+@api_bp.route('/bulk/projects', methods=['POST'])
+def bulk_project_action():
+    """批量项目操作: unbind / remove_admin / delete_record / retire（解除权限后删除记录）
+    
+    请求体: {"service_account_id": 1, "action": "retire", "project_ids": [...]}
+    或用 "filter": {"billing_account_id": "...", "unbound": true/false} 代替 project_ids（空 filter 表示全部项目）。
+    """
+    try:
+        from services.bulk_ops import PROJECT_ACTIONS, run_bulk_project_action, select_project_ids
+        from services.jobs import submit_job
+        
+        params, error = _bulk_request_params('project_ids')
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        if params['action'] not in PROJECT_ACTIONS:
+            return jsonify({
+                'status': 'error',
+                'message': f"action 必须是 {', '.join(PROJECT_ACTIONS)} 之一"
+            }), 400
+        
+        service_account_id = params['service_account_id']
+        if not ServiceAccount.query.get(service_account_id):
+            return jsonify({'status': 'error', 'message': '找不到指定的服务账号'}), 404
+        
+        if params['ids'] is not None:
+            # 显式指定的 ID 全部提交，数据库中不存在的项目在结果中逐项报告
+            project_ids = sorted(set(params['ids']))
+        else:
+            project_ids = select_project_ids(service_account_id, None, params['filter'])
+        if not project_ids:
+            return jsonify({'status': 'success', 'message': '没有匹配的项目', 'data': {'total': 0}})
+        
+        if len(project_ids) > CONFIG.bulk_max_items:
+            return jsonify({
+                'status': 'error',
+                'message': f"一次最多处理 {CONFIG.bulk_max_items} 个项目，当前 {len(project_ids)} 个，请分批提交"
+            }), 400
+        
+        digest = hashlib.sha1(','.join(project_ids).encode('utf-8')).hexdigest()
+        job, coalesced = submit_job(
+            f"bulk_project_{params['action']}",
+            f"bulk-projects:{service_account_id}:{params['action']}:{digest}",
+            run_bulk_project_action,
+            args=(service_account_id, params['action'], project_ids),
+            service_account_id=service_account_id,
+            on_done=lambda: invalidate_account_overview(service_account_id),
+            total=len(project_ids)
+        )
+        return _job_accepted(job, coalesced, f"批量项目操作已提交: {len(project_ids)} 个项目")
+    
+    except Exception as e:
+        logging.error(f"提交批量项目操作失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/bulk/billing-accounts', methods=['POST'])
+def bulk_billing_action():
+    """批量账单账户操作: remove_admin / delete_record
+    
+    请求体: {"service_account_id": 1, "action": "remove_admin", "billing_ids": [...]}
+    或用 "filter": {"is_open": false, "is_used": false} 代替 billing_ids。
+    """
+    try:
+        from services.bulk_ops import BILLING_ACTIONS, run_bulk_billing_action, select_billing_ids
+        from services.jobs import submit_job
+        
+        params, error = _bulk_request_params('billing_ids')
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        if params['action'] not in BILLING_ACTIONS:
+            return jsonify({
+                'status': 'error',
+                'message': f"action 必须是 {', '.join(BILLING_ACTIONS)} 之一"
+            }), 400
+        
+        service_account_id = params['service_account_id']
+        if not ServiceAccount.query.get(service_account_id):
+            return jsonify({'status': 'error', 'message': '找不到指定的服务账号'}), 404
+        
+        if params['ids'] is not None:
+            billing_ids = sorted(set(params['ids']))
+        else:
+            billing_ids = select_billing_ids(service_account_id, None, params['filter'])
+        if not billing_ids:
+            return jsonify({'status': 'success', 'message': '没有匹配的账单账户', 'data': {'total': 0}})
+        
+        if len(billing_ids) > CONFIG.bulk_max_items:
+            return jsonify({
+                'status': 'error',
+                'message': f"一次最多处理 {CONFIG.bulk_max_items} 个账单账户，当前 {len(billing_ids)} 个，请分批提交"
+            }), 400
+        
+        digest = hashlib.sha1(','.join(billing_ids).encode('utf-8')).hexdigest()
+        job, coalesced = submit_job(
+            f"bulk_billing_{params['action']}",
+            f"bulk-billing:{service_account_id}:{params['action']}:{digest}",
+            run_bulk_billing_action,
+            args=(service_account_id, params['action'], billing_ids),
+            service_account_id=service_account_id,
+            on_done=lambda: invalidate_account_overview(service_account_id),
+            total=len(billing_ids)
+        )
+        return _job_accepted(job, coalesced, f"批量账单操作已提交: {len(billing_ids)} 个账单账户")
+    
+    except Exception as e:
+        logging.error(f"提交批量账单操作失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """查询异步任务状态"""
+    try:
+        from services.jobs import get_job
+        
+        job = get_job(job_id)
+        if not job:
+            return jsonify({
+                'status': 'error',
+                'message': '找不到指定的任务'
+            }), 404
+        
+        return jsonify({
+            'status': 'success',
+            'data': job
+        })
+    
+    except Exception as e:
+        logging.error(f"查询任务状态失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def _bearer_token():
+    """Authorization: Bearer 头中的令牌；不接受 URL 参数，避免令牌出现在访问日志和代理日志中"""
+    auth_header = request.headers.get('Authorization', '')
+    return auth_header[7:] if auth_header.startswith('Bearer ') else ''
+
+def _admin_auth_error():
+    """校验管理接口令牌（只接受 Authorization: Bearer 头），失败时返回错误响应"""
+    if not CONFIG.admin_token:
+        return jsonify({
+            'status': 'error',
+            'message': '未配置 ADMIN_TOKEN，管理接口未启用'
+        }), 503
+    if not hmac.compare_digest(_bearer_token().encode('utf-8'), CONFIG.admin_token.encode('utf-8')):
+        return jsonify({
+            'status': 'error',
+            'message': '认证失败'
+        }), 401
+    if not CONFIG.profiling_enabled:
+        return jsonify({
+            'status': 'error',
+            'message': '性能剖析未启用 (PROFILING_ENABLED=false)'
+        }), 503
+    return None
+
+@api_bp.route('/webhooks/resync', methods=['POST'])
+def resync_webhook():
+    """接收预算/账单停用通知，对受影响的服务账号、账单账户或项目排队定向重新同步
+    
+    支持 Pub/Sub 推送信封和普通 JSON。令牌只通过 Authorization: Bearer 传递:
+    WEBHOOK_TOKEN，或 Pub/Sub 推送订阅附带的 OIDC 令牌（需配置 WEBHOOK_OIDC_AUDIENCE）。
+    """
+    try:
+        from services.resync import enqueue_resync, parse_notification, verify_pubsub_token
+        
+        if not CONFIG.webhook_token and not CONFIG.webhook_oidc_audience:
+            return jsonify({
+                'status': 'error',
+                'message': '未配置 WEBHOOK_TOKEN 或 WEBHOOK_OIDC_AUDIENCE，webhook 未启用'
+            }), 503
+        
+        token = _bearer_token()
+        authorized = bool(token) and (
+            (CONFIG.webhook_token and hmac.compare_digest(token.encode('utf-8'), CONFIG.webhook_token.encode('utf-8')))
+            or verify_pubsub_token(token)
+        )
+        if not authorized:
+            return jsonify({
+                'status': 'error',
+                'message': '认证失败'
+            }), 401
+        
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({
+                'status': 'error',
+                'message': '请求体必须是 JSON 对象'
+            }), 400
+        
+        targets = parse_notification(payload)
+        if not targets:
+            # Pub/Sub 对非 2xx 响应会反复重投，无法识别的通知直接确认
+            return jsonify({
+                'status': 'success',
+                'message': '通知中没有可识别的目标，已忽略',
+                'data': {'queued': [], 'coalesced': [], 'unknown': []}
+            })
+        
+        source = 'pubsub' if isinstance(payload.get('message'), dict) else request.args.get('source', 'webhook')
+        result = enqueue_resync(targets, source=source)
+        
+        return jsonify({
+            'status': 'success',
+            'message': f"已排队 {len(result['queued'])} 个定向重新同步请求，合并 {len(result['coalesced'])} 个",
+            'data': result
+        }), 202
+    
+    except Exception as e:
+        logging.error(f"处理重新同步通知失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/webhooks/resync/<int:request_id>', methods=['GET'])
+def get_resync_request(request_id):
+    """查询定向重新同步请求的处理状态"""
+    resync_request = ResyncRequest.query.get(request_id)
+    if not resync_request:
+        return jsonify({
+            'status': 'error',
+            'message': '找不到指定的请求'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'data': resync_request.to_dict()
+    })
+
+@api_bp.route('/admin/profiling', methods=['GET'])
+def get_profiling_status():
+    """查询性能剖析状态和已生成的结果文件"""
+    auth_error = _admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    from services.profiling import get_profiler, list_profiles
+    return jsonify({
+        'status': 'success',
+        'data': dict(get_profiler().get_status(), files=list_profiles())
+    })
+
+@api_bp.route('/admin/profiling/cycles', methods=['POST'])
+def profile_sync_cycles():
+    """剖析接下来的 N 轮同步
+    
+    请求体: {"cycles": 1, "mode": "cprofile" | "sampling"}
+    同步进程在 PROFILE_DIR 中读取触发文件，结果写入同一目录。
+    """
+    auth_error = _admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    try:
+        from services.profiling import CYCLES_TRIGGER, PROFILE_MODES, write_trigger
+        
+        data = request.get_json(silent=True) or {}
+        cycles = int(data.get('cycles', 1))
+        mode = data.get('mode', 'cprofile')
+        if not 1 <= cycles <= 10 or mode not in PROFILE_MODES:
+            return jsonify({
+                'status': 'error',
+                'message': f"cycles 必须在 1-10 之间，mode 必须是 {', '.join(PROFILE_MODES)} 之一"
+            }), 400
+        
+        write_trigger(CYCLES_TRIGGER, {'cycles': cycles, 'mode': mode})
+        return jsonify({
+            'status': 'success',
+            'message': f"同步进程将剖析接下来 {cycles} 轮 ({mode})",
+            'data': {'cycles': cycles, 'mode': mode}
+        }), 202
+    
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'cycles 必须是整数'
+        }), 400
+    except Exception as e:
+        logging.error(f"提交同步剖析请求失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/admin/profiling/requests', methods=['POST'])
+def profile_api_requests():
+    """在一段时间内按比例剖析 API 请求
+    
+    请求体: {"sample_rate": 0.1, "duration": 300}，sample_rate 为 0 时停止。
+    所有 Web worker 通过触发文件读取配置，每个被抽中的请求生成一个 .pstats。
+    """
+    auth_error = _admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    try:
+        from services.profiling import REQUESTS_TRIGGER, get_profiler, write_trigger
+        
+        data = request.get_json(silent=True) or {}
+        sample_rate = float(data.get('sample_rate', 0.1))
+        duration = int(data.get('duration', 300))
+        if not 0 <= sample_rate <= 1 or not 0 < duration <= 3600:
+            return jsonify({
+                'status': 'error',
+                'message': 'sample_rate 必须在 0-1 之间，duration 必须在 1-3600 秒之间'
+            }), 400
+        
+        expires_at = time.time() + duration
+        write_trigger(REQUESTS_TRIGGER, {'sample_rate': sample_rate, 'expires_at': expires_at})
+        get_profiler().configure_requests(sample_rate, expires_at)
+        return jsonify({
+            'status': 'success',
+            'message': f"将在 {duration} 秒内剖析 {sample_rate:.0%} 的请求" if sample_rate else '已停止请求剖析',
+            'data': {'sample_rate': sample_rate, 'duration': duration}
+        })
+    
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'sample_rate 和 duration 必须是数字'
+        }), 400
+    except Exception as e:
+        logging.error(f"提交请求剖析配置失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/admin/profiling/memory', methods=['POST'])
+def take_memory_snapshot():
+    """保存 tracemalloc 内存快照
+    
+    请求体: {"target": "web" | "sync"}。web 为处理本请求的 worker；sync 由同步进程异步处理。
+    首次调用只开始追踪，之后每次快照附带与上一次的差异。
+    """
+    auth_error = _admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    try:
+        from services.profiling import SYNC_MEMORY_TRIGGER, get_profiler, write_trigger
+        
+        data = request.get_json(silent=True) or {}
+        target = data.get('target', 'web')
+        if target == 'sync':
+            write_trigger(SYNC_MEMORY_TRIGGER, {'requested_at': time.time()})
+            return jsonify({
+                'status': 'success',
+                'message': '同步进程将在下次检查触发文件时保存内存快照',
+                'data': {'target': target}
+            }), 202
+        if target != 'web':
+            return jsonify({
+                'status': 'error',
+                'message': 'target 必须是 web 或 sync'
+            }), 400
+        
+        if data.get('stop'):
+            get_profiler().stop_memory_tracing()
+            return jsonify({
+                'status': 'success',
+                'message': '已停止内存追踪',
+                'data': {'target': target, 'pid': os.getpid()}
+            })
+        
+        result = get_profiler().memory_snapshot('web')
+        return jsonify({
+            'status': 'success',
+            'message': '已开始内存追踪，再次调用保存快照' if result['started'] else '内存快照已保存',
+            'data': dict(result, target=target, pid=os.getpid())
+        })
+    
+    except Exception as e:
+        logging.error(f"保存内存快照失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api_bp.route('/admin/profiling/files/<string:name>', methods=['GET'])
+def download_profile(name):
+    """下载剖析结果文件（.pstats / .folded / .tracemalloc / .txt）"""
+    auth_error = _admin_auth_error()
+    if auth_error:
+        return auth_error
+    
+    from flask import send_from_directory
+    
+    if name.startswith('trigger-') or not os.path.isfile(os.path.join(CONFIG.profile_dir, name)):
+        return jsonify({
+            'status': 'error',
+            'message': '找不到指定的文件'
+        }), 404
+    # send_from_directory 会拒绝目录之外的路径
+    return send_from_directory(os.path.abspath(CONFIG.profile_dir), name, as_attachment=True)
+
 @api_bp.route('/status', methods=['GET'])
 def get_status():
     """获取系统状态概览"""
@@ -465,11 +1154,13 @@ def get_status():
         inactive_billing_count = BillingAccount.query.filter_by(is_open=False).count()
         
         # 最近操作
-        recent_operations = BillingOperation.query.order_by(
-            BillingOperation.created_at.desc()
-        ).limit(5).all()
+        names, rows = query_columns(
+            BillingOperation,
+            order_by=BillingOperation.created_at.desc(),
+            limit=5
+        )
         
-        return jsonify({
+        return fast_jsonify({
             'status': 'success',
             'data': {
                 'counts': {
@@ -478,7 +1169,12 @@ def get_status():
                     'active_billing_accounts': active_billing_count,
                     'inactive_billing_accounts': inactive_billing_count
                 },
-                'recent_operations': [op.to_dict() for op in recent_operations]
+                'recent_operations': rows_payload(names, rows),
+                'db_pool': get_pool_stats(),
+                'http_transport': get_transport_stats(),
+                'tokens': get_token_stats(),
+                'iam': get_iam_stats(),
+                'tracing': get_trace_stats()
             }
         })
     
@@ -0,0 +1,54 @@
+# routes/serialization.py
+import json
+from datetime import date, datetime
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:  # orjson 不可用时退回标准库
+    orjson = None
+
+from models import db
+
+def _default(obj):
+    """标准库 json 的兜底编码，与 orjson 的 datetime 输出保持一致"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj) -> bytes:
+    """将对象编码为 JSON 字节串，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def fast_jsonify(payload, status: int = 200):
+    """jsonify 的快速版本 - 直接把编码好的字节串写入响应"""
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+def query_columns(model, *criteria, order_by=None, limit=None):
+    """只查询模型 api_columns 中声明的列，返回 (列名, 行元组列表)，不构造ORM实例"""
+    columns = [getattr(model, name) for name in model.api_columns]
+    query = db.session.query(*columns)
+    if criteria:
+        query = query.filter(*criteria)
+    if order_by is not None:
+        query = query.order_by(order_by)
+    if limit is not None:
+        query = query.limit(limit)
+    return model.api_columns, query.all()
+
+def rows_payload(names, rows, columnar: bool = False):
+    """把行元组转换为响应数据
+
+    columnar=False 时返回与 to_dict() 相同结构的对象列表；
+    columnar=True 时返回 {'columns': [...], 'rows': [[...], ...]} 的紧凑列式结构。
+    """
+    if columnar:
+        return {'columns': list(names), 'rows': [tuple(row) for row in rows]}
+    return [dict(zip(names, row)) for row in rows]
+
+def wants_columnar(request) -> bool:
+    """客户端是否请求列式响应 (?format=columnar)"""
+    return request.args.get('format') == 'columnar'
@@ -1,5 +1,5 @@
 # routes/web.py
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, render_template
 
 web_bp = Blueprint('web', __name__)
 
@@ -11,4 +11,11 @@ def index():
 @web_bp.route('/accounts/<int:account_id>')
 def account_details(account_id):
     """服务账号详情页面"""
-    return render_template('account_details.html', account_id=account_id)
\ No newline at end of file
+    return render_template('account_details.html', account_id=account_id)
+
+@web_bp.route('/metrics')
+def metrics():
+    """Prometheus 指标"""
+    from services.metrics import render_metrics
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
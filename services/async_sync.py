@@ -0,0 +1,410 @@
+# services/async_sync.py - asyncio 同步引擎
+#
+# 与 process_account 的处理流程一致（收集 → 解绑失效账单 → 分配无账单项目 → 复查 → 落库），
+# 但 Resource Manager / Billing REST 调用通过共享的 aiohttp 连接池在单个事件循环上并发执行，
+# 并发度由每个服务账号的异步 QPS 限速器和信号量控制，而不是线程数。
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:  # 未安装 aiohttp 时回退到线程模式
+    aiohttp = None
+
+import google.auth.transport.requests
+
+from services.billing_service import (
+    CONFIG, RETRYABLE_STATUS_CODES, billing_account_of, compute_retry_delay, create_db_session,
+    get_account_lock, get_billing_allocation_plan, get_current_billing_usage, get_or_create_service_account,
+    get_service_account_email, log_operation, save_billing_accounts, save_project_states
+)
+from services import metrics, quota, tracing
+from services.token_manager import get_credentials
+
+# 各 API 的根地址
+GOOGLE_API_ROOTS = {
+    'cloudresourcemanager': 'https://cloudresourcemanager.googleapis.com',
+    'cloudbilling': 'https://cloudbilling.googleapis.com'
+}
+
+async def _read_json(response) -> Any:
+    """读取 JSON 响应体；网关返回的 HTML/纯文本错误页等非 JSON 响应体按空响应处理，保留状态码"""
+    try:
+        return await response.json(content_type=None)
+    except ValueError:
+        logging.warning(f"响应体不是 JSON (HTTP {response.status})，按空响应处理")
+        return {}
+
+class AsyncApiError(Exception):
+    """异步 REST 调用返回的错误"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+class AsyncRateLimiter:
+    """异步QPS限速器 - 令牌桶算法，等待时让出事件循环"""
+
+    def __init__(self, max_qps: int):
+        self.max_qps = max_qps
+        self.tokens = max_qps
+        self.last_update = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, timeout: float = 30.0) -> bool:
+        """获取令牌，如果没有令牌则等待到下一个令牌产生"""
+        deadline = time.monotonic() + timeout
+
+        while True:
+            async with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.max_qps, self.tokens + (now - self.last_update) * self.max_qps)
+                self.last_update = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+
+                wait = (1 - self.tokens) / self.max_qps
+
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+class AsyncGoogleClient:
+    """单个服务账号的异步 REST 客户端"""
+
+    def __init__(self, http, credentials, service_account_name: str):
+        self.http = http
+        self.credentials = credentials
+        self.service_account_name = service_account_name
+        self.rate_limiter = AsyncRateLimiter(CONFIG.max_qps_per_account)
+        self.semaphore = asyncio.Semaphore(CONFIG.async_concurrency_per_account)
+        self._token_lock = asyncio.Lock()
+
+    async def _authorization(self) -> str:
+        """获取访问令牌，过期时在线程池中刷新，避免阻塞事件循环"""
+        if not self.credentials.valid:
+            async with self._token_lock:
+                if not self.credentials.valid:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(
+                        None, self.credentials.refresh, google.auth.transport.requests.Request()
+                    )
+        return f"Bearer {self.credentials.token}"
+
+    async def request(
+        self,
+        method: str,
+        api: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """发送请求，带QPS限速和与同步版本相同的指数退避重试"""
+        url = f"{CONFIG.gcp_api_endpoint.rstrip('/') or GOOGLE_API_ROOTS[api]}/{path}"
+
+        for attempt in range(CONFIG.max_retries):
+            wait_start = time.perf_counter()
+            acquired = await self.rate_limiter.acquire()
+            metrics.RATE_LIMIT_WAIT_SECONDS.labels(self.service_account_name).observe(time.perf_counter() - wait_start)
+            if not acquired:
+                raise AsyncApiError(429, f"QPS限速超时: {self.service_account_name}")
+
+            try:
+                async with self.semaphore:
+                    call_start = time.perf_counter()
+                    with tracing.span(f"{api}.{method}", path=path, service_account=self.service_account_name) as call_span:
+                        headers = {'Authorization': await self._authorization()}
+                        async with self.http.request(method, url, params=params, json=body, headers=headers) as response:
+                            status = response.status
+                            data = await _read_json(response) if status != 204 else {}
+                        call_span.set_attribute('http.status_code', status)
+                        if status >= 400:
+                            call_span.set_error(f"HTTP {status}")
+                    metrics.API_REQUEST_SECONDS.labels(f"{api}.{method}", str(status)).observe(time.perf_counter() - call_start)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, data = 503, {'error': {'message': str(e) or type(e).__name__}}
+                metrics.API_REQUEST_SECONDS.labels(f"{api}.{method}", 'error').observe(time.perf_counter() - call_start)
+            quota.record_call(self.service_account_name, f"{api}.{method}", failed=status >= 400)
+
+            if status < 400:
+                return data or {}
+
+            message = (data or {}).get('error', {}).get('message', '') if isinstance(data, dict) else str(data)
+            if status not in RETRYABLE_STATUS_CODES or attempt == CONFIG.max_retries - 1:
+                raise AsyncApiError(status, message)
+
+            delay = compute_retry_delay(attempt, status)
+            logging.warning(f"API调用失败 {status} (尝试 {attempt + 1}/{CONFIG.max_retries}), 等待 {delay:.2f}s")
+            metrics.record_retry(status, delay)
+            quota.record_retry()
+            tracing.add_event('retry', attempt=attempt + 1, status=status, path=path, delay=round(delay, 3))
+            await asyncio.sleep(delay)
+
+        raise AsyncApiError(500, "达到最大重试次数")
+
+    async def _paginate(self, api: str, path: str, key: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        items = []
+        params = dict(params)
+        while True:
+            response = await self.request('GET', api, path, params=params)
+            items.extend(response.get(key, []))
+            next_page_token = response.get('nextPageToken')
+            if not next_page_token:
+                return items
+            params['pageToken'] = next_page_token
+
+    async def list_projects(self) -> List[str]:
+        """获取项目列表 - v3 search，失败时回退到 v1 list"""
+        try:
+            projects = await self._paginate(
+                'cloudresourcemanager', 'v3/projects:search', 'projects',
+                {'query': 'state:ACTIVE', 'pageSize': CONFIG.batch_size * 10}
+            )
+        except AsyncApiError as e:
+            logging.error(f"v3 API获取项目列表失败: {e}")
+            logging.info("回退到v1 API获取项目列表")
+            try:
+                projects = await self._paginate('cloudresourcemanager', 'v1/projects', 'projects', {})
+            except AsyncApiError as e:
+                logging.error(f"v1 API获取项目列表也失败: {e}")
+                return []
+        return [project['projectId'] for project in projects]
+
+    async def list_billing_accounts(self) -> List[Dict[str, Any]]:
+        """获取账单账户列表"""
+        try:
+            accounts = await self._paginate('cloudbilling', 'v1/billingAccounts', 'billingAccounts', {})
+        except AsyncApiError as e:
+            logging.error(f"获取账单账户列表失败: {e}")
+            return []
+        return [
+            {'name': account['name'], 'displayName': account['displayName'], 'open': account['open']}
+            for account in accounts
+        ]
+
+    async def get_billing_info(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """获取项目账单信息，失败时返回 None"""
+        try:
+            return await self.request('GET', 'cloudbilling', f'v1/projects/{project_id}/billingInfo')
+        except AsyncApiError as e:
+            if e.status == 403:
+                logging.warning(f"无权限访问项目 {project_id} 的账单信息")
+            else:
+                logging.error(f"获取项目 {project_id} 账单信息失败: {e}")
+            return None
+
+    async def update_billing_info(self, project_id: str, billing_account_name: str) -> Dict[str, Any]:
+        """更新项目账单信息"""
+        result = await self.request(
+            'PUT', 'cloudbilling', f'v1/projects/{project_id}/billingInfo',
+            body={'billingAccountName': billing_account_name}
+        )
+        logging.info(f"更新项目 {project_id} 账单为 {billing_account_name}")
+        return result
+
+async def _bind_by_plan(
+    client: AsyncGoogleClient,
+    unbound_projects: List[str],
+    allocation_plan: List[Tuple[str, int]],
+    operations: List[Dict[str, Any]]
+) -> List[str]:
+    """按分配计划并发绑定，失败的名额由后续项目补上，返回未能分配的项目"""
+    project_index = 0
+    failed_projects = []
+
+    for target_billing, allocate_count in allocation_plan:
+        successful_count = 0
+
+        while successful_count < allocate_count and project_index < len(unbound_projects):
+            batch = unbound_projects[project_index:project_index + (allocate_count - successful_count)]
+            project_index += len(batch)
+
+            results = await asyncio.gather(
+                *(client.update_billing_info(project_id, target_billing) for project_id in batch),
+                return_exceptions=True
+            )
+
+            for project_id, result in zip(batch, results):
+                failed = isinstance(result, Exception)
+                operations.append({
+                    'operation_type': 'auto_bind',
+                    'project_id': project_id,
+                    'billing_account_id': target_billing.split('/')[-1],
+                    'old_value': 'None',
+                    'new_value': target_billing,
+                    'status': 'failed' if failed else 'success',
+                    'message': str(result) if failed else "智能分配到账单 (负载均衡)"
+                })
+                if failed:
+                    failed_projects.append(project_id)
+                    logging.error(f"绑定项目 {project_id} 到账单 {target_billing} 失败: {result}")
+                else:
+                    successful_count += 1
+
+    failed_projects.extend(unbound_projects[project_index:])
+    return failed_projects
+
+def _persist_account(
+    app,
+    gcp_account: Dict[str, str],
+    email: Optional[str],
+    projects: List[str],
+    billing_accounts: List[Dict[str, Any]],
+    projects_billing_info: Dict[str, str],
+    operations: List[Dict[str, Any]]
+):
+    """在线程池中执行的落库步骤，复用同步引擎的写入逻辑"""
+    with app.app_context():
+        with create_db_session() as session:
+            sa_obj = get_or_create_service_account(session, gcp_account, email)
+            billing_accounts_dict = {account['name']: account for account in billing_accounts}
+
+            save_billing_accounts(session, sa_obj.id, billing_accounts)
+            save_project_states(session, sa_obj.id, projects, projects_billing_info, billing_accounts_dict)
+
+            for operation in operations:
+                log_operation(service_account_id=sa_obj.id, session=session, **operation)
+
+async def process_account_async(app, gcp_account: Dict[str, str], http, billing_cache=None) -> bool:
+    """异步处理单个GCP服务账号 - 结果与 process_account 一致"""
+    loop = asyncio.get_running_loop()
+
+    # 与快速账单轮询互斥；非阻塞轮询获取，避免阻塞事件循环
+    account_lock = get_account_lock(gcp_account['name'])
+    while not account_lock.acquire(blocking=False):
+        await asyncio.sleep(0.1)
+
+    try:
+        credentials_file = gcp_account['credentials_file']
+        credentials = await loop.run_in_executor(None, get_credentials, credentials_file, gcp_account['name'])
+        client = AsyncGoogleClient(http, credentials, gcp_account['name'])
+        service_account_email = get_service_account_email(credentials_file)
+
+        with metrics.phase(gcp_account['name'], 'list_projects'), tracing.span('list_projects'):
+            projects, billing_accounts = await asyncio.gather(client.list_projects(), client.list_billing_accounts())
+        if billing_cache is not None:
+            # 与线程模式共用本轮统一的账单账户状态
+            billing_accounts = billing_cache.merge(gcp_account['name'], billing_accounts)
+        active_billing_accounts = [account['name'] for account in billing_accounts if account['open']]
+        operations: List[Dict[str, Any]] = []
+
+        logging.info(f"开始处理服务账号 {gcp_account['name']} 的 {len(projects)} 个项目")
+
+        # 第一阶段：并发收集项目状态
+        projects_billing_info = {}
+        failed_projects = []
+        unbound_projects = []
+
+        with metrics.phase(gcp_account['name'], 'project_billing_info'), tracing.span('project_billing_info'):
+            billing_infos = await asyncio.gather(*(client.get_billing_info(project_id) for project_id in projects))
+        for project_id, billing_info in zip(projects, billing_infos):
+            if billing_info:
+                current_billing_account = billing_account_of(billing_info)
+                projects_billing_info[project_id] = current_billing_account
+
+                if current_billing_account == 'None':
+                    unbound_projects.append(project_id)
+                elif current_billing_account not in active_billing_accounts:
+                    failed_projects.append((project_id, current_billing_account))
+                    logging.info(f"发现失效账单项目: {project_id} -> {current_billing_account}")
+            else:
+                projects_billing_info[project_id] = 'None'
+                unbound_projects.append(project_id)
+
+        # 第二阶段：并发解绑失效账单项目
+        if failed_projects:
+            logging.info(f"开始解绑 {len(failed_projects)} 个失效账单项目")
+            with metrics.phase(gcp_account['name'], 'unbind'), tracing.span('unbind'):
+                results = await asyncio.gather(
+                    *(client.update_billing_info(project_id, '') for project_id, _ in failed_projects),
+                    return_exceptions=True
+                )
+            for (project_id, old_billing), result in zip(failed_projects, results):
+                failed = isinstance(result, Exception)
+                if not failed:
+                    unbound_projects.append(project_id)
+                    projects_billing_info[project_id] = 'None'
+                operations.append({
+                    'operation_type': 'unbind',
+                    'project_id': project_id,
+                    'billing_account_id': old_billing.split('/')[-1],
+                    'old_value': old_billing,
+                    'new_value': 'None',
+                    'status': 'failed' if failed else 'success',
+                    'message': str(result) if failed else "失效账单自动解绑"
+                })
+
+        # 第三阶段：统一分配无账单项目
+        if unbound_projects and active_billing_accounts and CONFIG.enable_auto_switch:
+            current_usage = get_current_billing_usage(projects_billing_info)
+            allocation_plan = get_billing_allocation_plan(unbound_projects, active_billing_accounts, current_usage)
+
+            if allocation_plan:
+                with metrics.phase(gcp_account['name'], 'rebind'), tracing.span('rebind'):
+                    failed_redistribute_projects = await _bind_by_plan(client, unbound_projects, allocation_plan, operations)
+                if failed_redistribute_projects:
+                    logging.warning(f"有 {len(failed_redistribute_projects)} 个项目分配失败，将在下次运行时重试")
+
+            # 重新获取项目账单信息
+            billing_infos = await asyncio.gather(*(client.get_billing_info(project_id) for project_id in unbound_projects))
+            for project_id, billing_info in zip(unbound_projects, billing_infos):
+                if billing_info:
+                    projects_billing_info[project_id] = billing_account_of(billing_info)
+
+        # 第四阶段：在线程池中更新数据库记录
+        with metrics.phase(gcp_account['name'], 'save'), tracing.span('save'):
+            await loop.run_in_executor(
+                None, _persist_account,
+                app, gcp_account, service_account_email, projects, billing_accounts, projects_billing_info, operations
+            )
+
+        logging.info(f"成功处理服务账号 {gcp_account['name']}")
+        return True
+
+    except Exception as e:
+        logging.error(f"处理服务账号 {gcp_account['name']} 时发生错误: {str(e)}", exc_info=True)
+        return False
+    finally:
+        account_lock.release()
+
+async def _process_account_traced(app, gcp_account: Dict[str, str], http, billing_cache=None) -> bool:
+    # 在各自的任务上下文中打开服务账号 span，阶段和 API 调用的 span 挂在它下面
+    with tracing.span('process_account', service_account=gcp_account['name']):
+        return await process_account_async(app, gcp_account, http, billing_cache)
+
+async def _run_accounts(app, gcp_accounts: List[Dict[str, str]], billing_cache=None) -> Tuple[int, int]:
+    connector = aiohttp.TCPConnector(limit=CONFIG.async_max_connections, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        results = await asyncio.gather(
+            *(asyncio.wait_for(_process_account_traced(app, account, http, billing_cache), CONFIG.task_timeout) for account in gcp_accounts),
+            return_exceptions=True
+        )
+
+    success_count = 0
+    failed_count = 0
+    for account, result in zip(gcp_accounts, results):
+        if result is True:
+            success_count += 1
+        else:
+            failed_count += 1
+            if isinstance(result, asyncio.TimeoutError):
+                logging.error(f"处理服务账号 {account['name']} 超时 ({CONFIG.task_timeout}s)")
+            elif isinstance(result, Exception):
+                logging.error(f"处理服务账号 {account['name']} 时发生异常: {result}")
+    return success_count, failed_count
+
+def run_accounts_async(app, gcp_accounts: List[Dict[str, str]], billing_cache=None) -> Tuple[int, int]:
+    """在单个事件循环上并发处理全部服务账号，返回 (成功数, 失败数)"""
+    if aiohttp is None:
+        from services.billing_service import run_accounts_in_threads
+        logging.error("未安装 aiohttp，异步模式不可用，回退到线程模式")
+        return run_accounts_in_threads(app, gcp_accounts, billing_cache)
+
+    return asyncio.run(_run_accounts(app, gcp_accounts, billing_cache))
@@ -0,0 +1,347 @@
+# services/audit_log.py - BillingOperation 审计日志异步批量写入
+import atexit
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from models import db, BillingOperation
+from services import metrics
+
+class _FlushRequest:
+    """放入队列的刷新请求，写入线程处理完当前批次后通知调用者"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+class AuditLogWriter:
+    """审计日志后台写入器
+
+    调用方只把记录放入有界队列，后台线程按数量或时间批量执行多行 INSERT。
+    MySQL 不可用或队列已满时，记录追加到本地 JSONL 文件，恢复后自动回放。
+    同一台机器上的多个进程（gunicorn worker）共享溢出文件，追加和回放都用文件锁 (fcntl) 互斥。
+    """
+
+    def __init__(
+        self,
+        app,
+        max_queue_size: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        spill_path: str = 'data/audit_spill.jsonl'
+    ):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._spill_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.spilled = 0
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+        self._thread.start()
+        logging.info("审计日志写入线程已启动")
+
+    def submit(self, record: Dict[str, Any]):
+        """提交一条审计记录，不阻塞调用方"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            logging.warning("审计日志队列已满，记录写入本地溢出文件")
+            self._spill([record])
+        metrics.AUDIT_QUEUE_DEPTH.set(self.queue.qsize())
+
+    def qsize(self) -> int:
+        """当前队列深度"""
+        return self.queue.qsize()
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """等待队列中已有的记录全部写出"""
+        if not self._thread or not self._thread.is_alive():
+            self._drain_inline()
+            return True
+
+        request = _FlushRequest()
+        self.queue.put(request)
+        return request.done.wait(timeout)
+
+    def stop(self, timeout: float = 30.0):
+        """停止写入线程，退出前写出全部剩余记录"""
+        if not self._thread or not self._thread.is_alive():
+            self._drain_inline()
+            return
+
+        self.flush(timeout)
+        self._stop_event.set()
+        self._thread.join(timeout)
+        # 线程结束后仍残留的记录直接写入或溢出到磁盘
+        self._drain_inline()
+        logging.info(f"审计日志写入线程已停止: 共写入 {self.written} 条, 溢出 {self.spilled} 条")
+
+    def _run(self):
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while not self._stop_event.is_set():
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _FlushRequest):
+                self._write(batch)
+                batch = []
+                item.done.set()
+            elif item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+        self._write(batch)
+
+    def _drain_inline(self):
+        """在当前线程中写出队列中的剩余记录"""
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+            else:
+                batch.append(item)
+        self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        """多行 INSERT 写入一批记录，失败时溢出到磁盘"""
+        metrics.AUDIT_QUEUE_DEPTH.set(self.queue.qsize())
+        if batch:
+            try:
+                self._insert(batch)
+                self.written += len(batch)
+            except Exception as e:
+                logging.error(f"审计日志批量写入失败，{len(batch)} 条记录写入本地溢出文件: {e}")
+                self._spill(batch)
+                return
+
+        # 数据库可用时回放之前溢出的记录（包括上次中断的回放）
+        if os.path.exists(self.spill_path) or os.path.exists(self.spill_path + '.replay'):
+            self._replay_spill()
+
+    def _insert(self, batch: List[Dict[str, Any]]):
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(BillingOperation.__table__.insert(), batch)
+
+    def _spill(self, records: List[Dict[str, Any]]):
+        """把记录追加到本地 JSONL 文件并 fsync，保证进程崩溃后不丢失"""
+        with self._spill_lock:
+            try:
+                spill_dir = os.path.dirname(self.spill_path)
+                if spill_dir:
+                    os.makedirs(spill_dir, exist_ok=True)
+                with _file_lock(self.spill_path + '.lock'), open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(_encode_record(record), ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.spilled += len(records)
+            except Exception as e:
+                logging.critical(f"审计日志写入溢出文件失败，丢失 {len(records)} 条记录: {e}")
+
+    def _replay_spill(self):
+        """回放溢出文件中的记录
+
+        溢出文件先改名为 .replay 再逐批插入，每批成功后把已回放到的字节位置写入 .replay.offset，
+        中断后从该位置继续，不会重复插入已写入的批次。同一时刻只有一个进程回放（.replay.lock）。
+        单条插入仍失败的记录（如引用的服务账号已不存在）移到 .dead 文件，不阻塞后续回放。
+        """
+        replay_path = self.spill_path + '.replay'
+        offset_path = replay_path + '.offset'
+
+        with _file_lock(self.spill_path + '.replay.lock', blocking=False) as acquired:
+            if not acquired:
+                return
+
+            with self._spill_lock, _file_lock(self.spill_path + '.lock'):
+                try:
+                    # 已存在的 .replay 文件说明上次回放中断，先处理完再接手新的溢出文件
+                    if not os.path.exists(replay_path):
+                        if not os.path.exists(self.spill_path):
+                            return
+                        os.replace(self.spill_path, replay_path)
+                except OSError as e:
+                    logging.error(f"读取审计日志溢出文件失败: {e}")
+                    return
+
+            offset = _read_offset(offset_path)
+            replayed = dead = 0
+            with open(replay_path, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    lines = [line for line in (f.readline() for _ in range(self.batch_size)) if line]
+                    if not lines:
+                        break
+
+                    records, invalid = [], []
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        try:
+                            records.append(_decode_record(json.loads(line)))
+                        except ValueError:
+                            invalid.append(line.decode('utf-8', errors='replace').rstrip('\n'))
+                    if invalid:
+                        self._dead_letter(invalid)
+                        dead += len(invalid)
+
+                    try:
+                        inserted, rejected = self._insert_or_quarantine(records)
+                    except Exception as e:
+                        logging.error(f"回放审计日志溢出文件失败，已回放 {replayed} 条，稍后从中断处继续: {e}")
+                        self.written += replayed
+                        return
+                    replayed += inserted
+                    dead += rejected
+                    _write_offset(offset_path, f.tell())
+
+            os.remove(replay_path)
+            if os.path.exists(offset_path):
+                os.remove(offset_path)
+
+        self.written += replayed
+        logging.info(f"已回放 {replayed} 条溢出的审计日志" + (f"，{dead} 条无法写入的记录移到死信文件" if dead else ''))
+
+    def _insert_or_quarantine(self, records: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """插入一批回放记录，返回 (写入条数, 移到死信文件的条数)
+
+        整批失败时逐条插入找出有问题的记录；数据库连接类错误直接抛出，由调用方稍后重试。
+        """
+        if not records:
+            return 0, 0
+        try:
+            self._insert(records)
+            return len(records), 0
+        except Exception as e:
+            if _is_connection_error(e):
+                raise
+
+        inserted, rejected = 0, []
+        for record in records:
+            try:
+                self._insert([record])
+                inserted += 1
+            except Exception as e:
+                if _is_connection_error(e):
+                    raise
+                logging.error(f"审计日志记录无法写入，移到死信文件: {e}")
+                rejected.append(json.dumps(_encode_record(record), ensure_ascii=False))
+        if rejected:
+            self._dead_letter(rejected)
+        return inserted, len(rejected)
+
+    def _dead_letter(self, lines: List[str]):
+        with _file_lock(self.spill_path + '.lock'), open(self.spill_path + '.dead', 'a', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+@contextlib.contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    """跨进程文件锁，blocking=False 时拿不到锁返回 False"""
+    lock_dir = os.path.dirname(path)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _is_connection_error(error: Exception) -> bool:
+    """数据库不可用（而不是记录本身有问题）"""
+    return isinstance(error, OperationalError) or (isinstance(error, DBAPIError) and error.connection_invalidated)
+
+def _read_offset(path: str) -> int:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def _write_offset(path: str, offset: int):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _encode_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = dict(record)
+    if isinstance(encoded.get('created_at'), datetime):
+        encoded['created_at'] = encoded['created_at'].isoformat()
+    return encoded
+
+def _decode_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    if record.get('created_at'):
+        record['created_at'] = datetime.fromisoformat(record['created_at'])
+    return record
+
+# 全局写入器实例
+_writer: Optional[AuditLogWriter] = None
+
+def init_audit_writer(app) -> Optional[AuditLogWriter]:
+    """根据配置创建并启动审计日志写入器，并注册退出时刷新"""
+    global _writer
+    from services.billing_service import CONFIG
+
+    if not CONFIG.audit_async:
+        return None
+
+    if _writer is None:
+        _writer = AuditLogWriter(
+            app,
+            max_queue_size=CONFIG.audit_queue_size,
+            batch_size=CONFIG.audit_batch_size,
+            flush_interval=CONFIG.audit_flush_interval,
+            spill_path=CONFIG.audit_spill_path
+        )
+        atexit.register(shutdown_audit_writer)
+    _writer.start()
+    return _writer
+
+def get_audit_writer() -> Optional[AuditLogWriter]:
+    """获取全局审计日志写入器，未启用时返回 None"""
+    return _writer
+
+def shutdown_audit_writer():
+    """进程退出前写出全部审计日志"""
+    if _writer is not None:
+        _writer.stop()
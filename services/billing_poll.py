@@ -0,0 +1,169 @@
+# services/billing_poll.py - 快速账单状态轮询
+#
+# 全量同步（项目发现 + 每个项目的账单检查）按 UPDATE_INTERVAL 执行，代价高且新项目很少；
+# 这里按 FAST_POLL_INTERVAL 只列出各服务账号的账单账户 open 状态，与数据库比较，
+# 发现新关闭的账单时按数据库中的项目→账单映射直接解绑并重新分配受影响的项目。
+# 同一轮中多个服务账号可见的账单账户只列出一次（见 BillingAccountStatusCache）。
+# 与全量同步（可能在多进程模式的子进程中执行）的互斥依靠 account_locks 处理锁（见 acquire_account_lock）；
+# 轮询属于低优先级任务，服务账号的 API 预算接近用完时跳过，也不为没有绑定项目的服务账号列出账单。
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from models import ServiceAccount, Project, BillingAccount
+from services import quota, tracing
+from services.billing_service import (
+    CONFIG, BillingAccountStatusCache, GoogleAPIClient, acquire_account_lock, create_db_session, fetch_billing_accounts,
+    get_account_lock, rebind_projects, release_account_lock, save_billing_accounts, save_project_states, unbind_projects
+)
+
+def poll_account(app, gcp_account: Dict[str, str], billing_cache: BillingAccountStatusCache) -> int:
+    """检查单个服务账号的账单状态并处理新关闭的账单，返回解绑的项目数"""
+    account_lock = get_account_lock(gcp_account['name'])
+    # 全量同步正在处理该账号时跳过，全量同步本身会处理关闭的账单
+    if not account_lock.acquire(blocking=False):
+        return 0
+    if not quota.allows(gcp_account['name'], quota.PRIORITY_LOW):
+        account_lock.release()
+        return 0
+
+    api_client = None
+    try:
+        with app.app_context():
+            # 进程内的锁只能排除本进程的全量同步；其他进程（多进程模式的子进程）正在处理时同样跳过
+            lock_owner = acquire_account_lock(gcp_account['name'])
+            if lock_owner is None:
+                return 0
+            try:
+                with create_db_session() as session:
+                    sa_obj = session.query(ServiceAccount).filter_by(name=gcp_account['name']).first()
+                    if sa_obj is None:
+                        # 尚未经过全量同步的服务账号没有项目映射
+                        return 0
+
+                    bound_projects = session.query(func.count(Project.id)).filter(
+                        Project.service_account_id == sa_obj.id,
+                        Project.billing_account_name.isnot(None),
+                        Project.billing_account_name != 'None'
+                    ).scalar()
+                    if not bound_projects:
+                        # 没有绑定账单的项目时，账单关闭不影响任何项目，由全量同步更新账单状态
+                        return 0
+
+                    from services.token_manager import get_credentials
+                    credentials = get_credentials(gcp_account['credentials_file'], gcp_account['name'])
+                    api_client = GoogleAPIClient(credentials, gcp_account['name'])
+
+                    billing_accounts = fetch_billing_accounts(api_client, session, sa_obj.id, billing_cache)
+                    if not billing_accounts:
+                        return 0
+
+                    was_open = {
+                        name: is_open
+                        for name, is_open in session.query(BillingAccount.name, BillingAccount.is_open).filter_by(
+                            service_account_id=sa_obj.id
+                        ).all()
+                    }
+                    newly_closed = {
+                        account['name'] for account in billing_accounts
+                        if not account['open'] and was_open.get(account['name'])
+                    }
+                    save_billing_accounts(session, sa_obj.id, billing_accounts)
+
+                    if not newly_closed:
+                        return 0
+
+                    logging.info(f"快速轮询发现服务账号 {gcp_account['name']} 的账单已关闭: {sorted(newly_closed)}")
+
+                    projects_billing_info = {
+                        project_id: billing_account_name or 'None'
+                        for project_id, billing_account_name in session.query(
+                            Project.project_id, Project.billing_account_name
+                        ).filter_by(service_account_id=sa_obj.id).all()
+                    }
+                    failed_projects = [
+                        (project_id, billing_account_name)
+                        for project_id, billing_account_name in projects_billing_info.items()
+                        if billing_account_name in newly_closed
+                    ]
+                    unbound_projects = unbind_projects(
+                        api_client, session, sa_obj.id, failed_projects, projects_billing_info,
+                        message="账单关闭，快速轮询自动解绑"
+                    )
+
+                    active_billing_accounts = [account['name'] for account in billing_accounts if account['open']]
+                    if unbound_projects and active_billing_accounts and CONFIG.enable_auto_switch:
+                        rebind_projects(api_client, session, sa_obj.id, unbound_projects, active_billing_accounts, projects_billing_info)
+
+                    billing_accounts_dict = {account['name']: account for account in billing_accounts}
+                    save_project_states(session, sa_obj.id, list(projects_billing_info), projects_billing_info, billing_accounts_dict)
+                    return len(unbound_projects)
+            finally:
+                release_account_lock(gcp_account['name'], lock_owner)
+
+    except Exception as e:
+        logging.error(f"快速轮询服务账号 {gcp_account['name']} 时发生错误: {e}", exc_info=True)
+        return 0
+    finally:
+        account_lock.release()
+        if api_client:
+            api_client.close()
+
+def poll_once(app, gcp_accounts: List[Dict[str, str]], round_index: int = 0) -> int:
+    """执行一轮快速轮询，返回解绑的项目数"""
+    full_list_every = max(1, CONFIG.billing_full_list_every)
+    billing_cache = BillingAccountStatusCache(allow_skip_list=round_index % full_list_every != 0)
+
+    max_workers = min(CONFIG.max_workers, max(1, len(gcp_accounts)))
+    with tracing.start_trace('fast_poll', round=round_index, accounts=len(gcp_accounts)) as poll_span:
+        poll = tracing.wrap(poll_account)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            unbound = sum(executor.map(lambda account: poll(app, account, billing_cache), gcp_accounts))
+        poll_span.set_attribute('unbound_projects', unbound)
+
+    logging.debug(
+        f"快速账单轮询完成: 列表调用 {billing_cache.list_calls} 次, 复用 {billing_cache.list_skipped} 次, 解绑 {unbound} 个项目"
+    )
+    return unbound
+
+def run_fast_poll_loop(app):
+    """快速轮询循环，多副本部署时只轮询本进程持有租约的服务账号"""
+    from services.coordination import get_coordinator
+
+    round_index = 0
+    while True:
+        start_time = time.time()
+        try:
+            gcp_accounts = [account for account in app.config['GCP_ACCOUNTS'] if account.get('name')]
+            coordinator = get_coordinator()
+            if coordinator is not None:
+                gcp_accounts = [account for account in gcp_accounts if coordinator.owns(account['name'])]
+
+            if gcp_accounts:
+                unbound = poll_once(app, gcp_accounts, round_index)
+                if unbound:
+                    logging.info(f"快速账单轮询解绑并重新分配了 {unbound} 个项目，耗时 {time.time() - start_time:.2f} 秒")
+            round_index += 1
+        except Exception as e:
+            logging.error(f"快速账单轮询失败: {e}", exc_info=True)
+
+        time.sleep(max(1, CONFIG.fast_poll_interval - (time.time() - start_time)))
+
+_poll_thread: Optional[threading.Thread] = None
+
+def start_fast_poll_thread(app) -> Optional[threading.Thread]:
+    """启动快速轮询线程，未启用时返回 None"""
+    global _poll_thread
+
+    if not CONFIG.fast_poll_enabled:
+        return None
+
+    if _poll_thread is None:
+        _poll_thread = threading.Thread(target=run_fast_poll_loop, args=(app,), name='billing-fast-poll', daemon=True)
+        _poll_thread.start()
+        logging.info(f"快速账单轮询已启动: 每 {CONFIG.fast_poll_interval} 秒检查一次账单状态")
+    return _poll_thread
@@ -4,16 +4,20 @@ import time
 import math
 import os
 import random
+import re
 import json
 import threading
 import inspect
-from datetime import datetime
+import socket
+import uuid
+from datetime import datetime, timedelta
 from collections import defaultdict
 from contextlib import contextmanager
 from typing import Dict, List, Optional, Tuple, Any, Union
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 
+from cachetools import TTLCache
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -21,9 +25,11 @@ from google.api_core import exceptions as google_exceptions
 from threading import Thread, Semaphore, Lock
 from flask import current_app
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
 
-from models import db, ServiceAccount, Project, BillingAccount, BillingOperation
+from models import db, ServiceAccount, Project, BillingAccount, BillingOperation, AccountLock
+from services import metrics, quota, tracing
 
 # ==================== 配置管理 ====================
 
@@ -41,6 +47,76 @@ class BillingConfig:
     base_retry_delay: float = 1.0
     max_retry_delay: float = 60.0
     enable_jitter: bool = True
+    overview_cache_ttl: int = 5
+    web_threads: int = 8
+    db_pool_size: int = 0  # 0 表示按 max_workers + web_threads 自动计算
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    audit_async: bool = True
+    audit_queue_size: int = 10000
+    audit_batch_size: int = 200
+    audit_flush_interval: float = 1.0
+    audit_spill_path: str = 'data/audit_spill.jsonl'
+    retention_enabled: bool = True
+    retention_days: int = 90
+    archive_retention_days: int = 730
+    retention_batch_size: int = 5000
+    retention_interval: int = 86400
+    rollup_recompute_days: int = 3
+    coordination_enabled: bool = False
+    worker_id: str = ''
+    lease_ttl: int = 90
+    heartbeat_interval: int = 15
+    sync_execution_mode: str = 'thread'  # thread | process | async
+    process_workers: int = 0  # 0 表示使用 CPU 核数
+    process_threads: int = 4
+    async_concurrency_per_account: int = 50
+    async_max_connections: int = 100
+    shared_http_transport: bool = True
+    http_pool_connections: int = 10
+    http_pool_maxsize: int = 32
+    http_timeout: float = 60.0
+    http2_enabled: bool = False
+    token_manager_enabled: bool = True
+    token_refresh_margin: int = 600
+    token_check_interval: int = 30
+    share_billing_status: bool = True
+    billing_full_list_every: int = 10  # 每隔多少轮强制每个服务账号重新列出账单账户
+    fast_poll_enabled: bool = True
+    fast_poll_interval: int = 30
+    webhook_token: str = ''
+    webhook_oidc_audience: str = ''  # Pub/Sub 推送订阅的 OIDC audience，设置后接受 Google 签发的 OIDC 令牌
+    webhook_oidc_email: str = ''  # 推送订阅使用的服务账号邮箱，为空时不校验
+    resync_enabled: bool = True
+    resync_poll_interval: float = 2.0
+    job_workers: int = 4
+    bulk_concurrency: int = 8
+    bulk_max_items: int = 1000  # 单个批量任务最多处理的项目或账单数，更多时分批提交
+    iam_policy_cache_enabled: bool = True
+    iam_policy_ttl: int = 300
+    iam_policy_max_resources: int = 10000  # 进程内最多缓存的资源策略数，超出时淘汰最久未使用的
+    iam_scan_enabled: bool = True
+    iam_scan_qps: int = 2
+    iam_scan_max_age: int = 86400  # 资源策略超过这么久未扫描时重新扫描
+    iam_scan_batch: int = 500  # 每个服务账号每轮最多扫描的资源数
+    iam_scan_interval: int = 300
+    metrics_port: int = 9108  # 同步进程的指标端口，0 表示不启动
+    tracing_enabled: bool = False
+    trace_sample_rate: float = 1.0  # 按同步轮次/任务采样
+    trace_file: str = 'data/traces.jsonl'
+    trace_otlp_endpoint: str = ''  # 设置后 POST 到 Collector，不再写文件
+    admin_token: str = ''  # 管理接口（性能剖析等）的令牌，为空时管理接口不可用
+    profiling_enabled: bool = True
+    profile_dir: str = 'data/profiles'
+    profile_signal_mode: str = 'cprofile'  # SIGUSR1 触发的剖析方式: cprofile / sampling
+    gcp_api_endpoint: str = ''  # 设置后所有 Google API 请求发往该地址（如本地替身 services/fake_gcp.py）
+    quota_ledger_enabled: bool = True
+    quota_flush_interval: int = 60
+    quota_daily_budget: int = 0  # 每个服务账号每天的调用预算，0 表示不限
+    quota_minute_budget: int = 0  # 每个服务账号每分钟的调用预算（单进程），0 表示不限
+    quota_reserve_ratio: float = 0.2  # 预算中保留给常规同步的比例，低优先级任务不使用
 
     @classmethod
     def from_env(cls) -> 'BillingConfig':
@@ -56,7 +132,77 @@ class BillingConfig:
             max_qps_per_account=int(os.getenv('MAX_QPS_PER_ACCOUNT', 10)),
             base_retry_delay=float(os.getenv('BASE_RETRY_DELAY', 1.0)),
             max_retry_delay=float(os.getenv('MAX_RETRY_DELAY', 60.0)),
-            enable_jitter=os.getenv('ENABLE_JITTER', 'true').lower() == 'true'
+            enable_jitter=os.getenv('ENABLE_JITTER', 'true').lower() == 'true',
+            overview_cache_ttl=int(os.getenv('OVERVIEW_CACHE_TTL', 5)),
+            web_threads=int(os.getenv('WEB_THREADS', 8)),
+            db_pool_size=int(os.getenv('DB_POOL_SIZE', 0)),
+            db_max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            db_pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 30)),
+            db_pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            db_pool_pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+            audit_async=os.getenv('AUDIT_ASYNC', 'true').lower() == 'true',
+            audit_queue_size=int(os.getenv('AUDIT_QUEUE_SIZE', 10000)),
+            audit_batch_size=int(os.getenv('AUDIT_BATCH_SIZE', 200)),
+            audit_flush_interval=float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0)),
+            audit_spill_path=os.getenv('AUDIT_SPILL_PATH', 'data/audit_spill.jsonl'),
+            retention_enabled=os.getenv('RETENTION_ENABLED', 'true').lower() == 'true',
+            retention_days=int(os.getenv('RETENTION_DAYS', 90)),
+            archive_retention_days=int(os.getenv('ARCHIVE_RETENTION_DAYS', 730)),
+            retention_batch_size=int(os.getenv('RETENTION_BATCH_SIZE', 5000)),
+            retention_interval=int(os.getenv('RETENTION_INTERVAL', 86400)),
+            rollup_recompute_days=int(os.getenv('ROLLUP_RECOMPUTE_DAYS', 3)),
+            coordination_enabled=os.getenv('COORDINATION_ENABLED', 'false').lower() == 'true',
+            worker_id=os.getenv('WORKER_ID', ''),
+            lease_ttl=int(os.getenv('LEASE_TTL', 90)),
+            heartbeat_interval=int(os.getenv('HEARTBEAT_INTERVAL', 15)),
+            sync_execution_mode=os.getenv('SYNC_EXECUTION_MODE', 'thread').lower(),
+            process_workers=int(os.getenv('PROCESS_WORKERS', 0)),
+            process_threads=int(os.getenv('PROCESS_THREADS', 4)),
+            async_concurrency_per_account=int(os.getenv('ASYNC_CONCURRENCY_PER_ACCOUNT', 50)),
+            async_max_connections=int(os.getenv('ASYNC_MAX_CONNECTIONS', 100)),
+            shared_http_transport=os.getenv('SHARED_HTTP_TRANSPORT', 'true').lower() == 'true',
+            http_pool_connections=int(os.getenv('HTTP_POOL_CONNECTIONS', 10)),
+            http_pool_maxsize=int(os.getenv('HTTP_POOL_MAXSIZE', 32)),
+            http_timeout=float(os.getenv('HTTP_TIMEOUT', 60.0)),
+            http2_enabled=os.getenv('HTTP2_ENABLED', 'false').lower() == 'true',
+            token_manager_enabled=os.getenv('TOKEN_MANAGER_ENABLED', 'true').lower() == 'true',
+            token_refresh_margin=int(os.getenv('TOKEN_REFRESH_MARGIN', 600)),
+            token_check_interval=int(os.getenv('TOKEN_CHECK_INTERVAL', 30)),
+            share_billing_status=os.getenv('SHARE_BILLING_STATUS', 'true').lower() == 'true',
+            billing_full_list_every=int(os.getenv('BILLING_FULL_LIST_EVERY', 10)),
+            fast_poll_enabled=os.getenv('FAST_POLL_ENABLED', 'true').lower() == 'true',
+            fast_poll_interval=int(os.getenv('FAST_POLL_INTERVAL', 30)),
+            webhook_token=os.getenv('WEBHOOK_TOKEN', ''),
+            webhook_oidc_audience=os.getenv('WEBHOOK_OIDC_AUDIENCE', ''),
+            webhook_oidc_email=os.getenv('WEBHOOK_OIDC_EMAIL', ''),
+            resync_enabled=os.getenv('RESYNC_ENABLED', 'true').lower() == 'true',
+            resync_poll_interval=float(os.getenv('RESYNC_POLL_INTERVAL', 2.0)),
+            job_workers=int(os.getenv('JOB_WORKERS', 4)),
+            bulk_concurrency=int(os.getenv('BULK_CONCURRENCY', 8)),
+            bulk_max_items=int(os.getenv('BULK_MAX_ITEMS', 1000)),
+            iam_policy_cache_enabled=os.getenv('IAM_POLICY_CACHE_ENABLED', 'true').lower() == 'true',
+            iam_policy_ttl=int(os.getenv('IAM_POLICY_TTL', 300)),
+            iam_policy_max_resources=int(os.getenv('IAM_POLICY_MAX_RESOURCES', 10000)),
+            iam_scan_enabled=os.getenv('IAM_SCAN_ENABLED', 'true').lower() == 'true',
+            iam_scan_qps=int(os.getenv('IAM_SCAN_QPS', 2)),
+            iam_scan_max_age=int(os.getenv('IAM_SCAN_MAX_AGE', 86400)),
+            iam_scan_batch=int(os.getenv('IAM_SCAN_BATCH', 500)),
+            iam_scan_interval=int(os.getenv('IAM_SCAN_INTERVAL', 300)),
+            metrics_port=int(os.getenv('METRICS_PORT', 9108)),
+            tracing_enabled=os.getenv('TRACING_ENABLED', 'false').lower() == 'true',
+            trace_sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 1.0)),
+            trace_file=os.getenv('TRACE_FILE', 'data/traces.jsonl'),
+            trace_otlp_endpoint=os.getenv('TRACE_OTLP_ENDPOINT', ''),
+            admin_token=os.getenv('ADMIN_TOKEN', ''),
+            profiling_enabled=os.getenv('PROFILING_ENABLED', 'true').lower() == 'true',
+            profile_dir=os.getenv('PROFILE_DIR', 'data/profiles'),
+            profile_signal_mode=os.getenv('PROFILE_SIGNAL_MODE', 'cprofile').lower(),
+            gcp_api_endpoint=os.getenv('GCP_API_ENDPOINT', ''),
+            quota_ledger_enabled=os.getenv('QUOTA_LEDGER_ENABLED', 'true').lower() == 'true',
+            quota_flush_interval=int(os.getenv('QUOTA_FLUSH_INTERVAL', 60)),
+            quota_daily_budget=int(os.getenv('QUOTA_DAILY_BUDGET', 0)),
+            quota_minute_budget=int(os.getenv('QUOTA_MINUTE_BUDGET', 0)),
+            quota_reserve_ratio=float(os.getenv('QUOTA_RESERVE_RATIO', 0.2))
         )
 
 # 全局配置实例
@@ -67,11 +213,12 @@ CONFIG = BillingConfig.from_env()
 class RateLimiter:
     """QPS限速器 - 令牌桶算法"""
     
-    def __init__(self, max_qps: int):
+    def __init__(self, max_qps: int, name: str = ''):
         self.max_qps = max_qps
         self.tokens = max_qps
         self.last_update = time.time()
         self.lock = Lock()
+        self._tokens_gauge = metrics.RATE_LIMIT_TOKENS.labels(name)
     
     def acquire(self, timeout: float = 30.0) -> bool:
         """获取令牌，如果没有令牌则等待"""
@@ -87,6 +234,7 @@ class RateLimiter:
                 
                 if self.tokens >= 1:
                     self.tokens -= 1
+                    self._tokens_gauge.set(self.tokens)
                     return True
             
             # 等待下次尝试
@@ -98,32 +246,253 @@ class RateLimiter:
 _rate_limiters: Dict[str, RateLimiter] = {}
 _limiter_lock = Lock()
 
-def get_rate_limiter(service_account_name: str) -> RateLimiter:
+def get_rate_limiter(service_account_name: str, max_qps: Optional[int] = None) -> RateLimiter:
     """获取指定服务账号的QPS限速器"""
     with _limiter_lock:
         if service_account_name not in _rate_limiters:
-            _rate_limiters[service_account_name] = RateLimiter(CONFIG.max_qps_per_account)
+            _rate_limiters[service_account_name] = RateLimiter(max_qps or CONFIG.max_qps_per_account, service_account_name)
         return _rate_limiters[service_account_name]
 
+def get_read_rate_limiter(service_account_name: str) -> RateLimiter:
+    """后台只读扫描使用的独立限速器，不占用同步和手动操作的 QPS"""
+    return get_rate_limiter(f"{service_account_name}:read", CONFIG.iam_scan_qps)
+
+# 同一服务账号的全量同步与快速账单轮询互斥
+_account_locks: Dict[str, Lock] = {}
+
+def get_account_lock(service_account_name: str) -> Lock:
+    """获取指定服务账号的处理锁"""
+    with _limiter_lock:
+        if service_account_name not in _account_locks:
+            _account_locks[service_account_name] = Lock()
+        return _account_locks[service_account_name]
+
 # ==================== 数据库会话管理 ====================
 
+def get_engine_options(database_uri: str) -> Dict[str, Any]:
+    """构造 SQLALCHEMY_ENGINE_OPTIONS - 连接池按后台线程数 + Web线程数配置"""
+    options = {'pool_pre_ping': CONFIG.db_pool_pre_ping}
+    
+    # SQLite 使用 NullPool/SingletonThreadPool，不支持连接池大小参数；
+    # 本地测试和压测时多个线程同时写入，等待写锁而不是立即报 database is locked
+    if database_uri.startswith('sqlite'):
+        options['connect_args'] = {'timeout': CONFIG.db_pool_timeout}
+        return options
+    
+    options.update({
+        'pool_size': CONFIG.db_pool_size or (CONFIG.max_workers + CONFIG.web_threads),
+        'max_overflow': CONFIG.db_max_overflow,
+        'pool_timeout': CONFIG.db_pool_timeout,
+        # 小于 MySQL wait_timeout，避免使用已被服务端断开的连接
+        'pool_recycle': CONFIG.db_pool_recycle
+    })
+    return options
+
+class PoolStats:
+    """连接池统计 - 记录连接创建、借出、归还以及借出等待和超时"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self._engine = None
+    
+    def install(self, engine):
+        """在引擎的连接池上注册事件监听"""
+        if self._engine is engine:
+            return
+        self._engine = engine
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+    
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+    
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+        metrics.DB_POOL_CHECKOUTS_TOTAL.inc()
+        metrics.DB_POOL_CHECKED_OUT.inc()
+    
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checkins += 1
+        metrics.DB_POOL_CHECKED_OUT.dec()
+    
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+    
+    def record_checkout_wait(self, wait: float):
+        with self.lock:
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+        metrics.DB_POOL_CHECKOUT_WAIT_SECONDS.observe(wait)
+    
+    def record_checkout_timeout(self):
+        with self.lock:
+            self.checkout_timeouts += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """返回统计快照，包含连接池当前状态"""
+        with self.lock:
+            stats = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_wait_total': round(self.checkout_wait_total, 4),
+                'checkout_wait_max': round(self.checkout_wait_max, 4)
+            }
+        
+        pool = self._engine.pool if self._engine is not None else None
+        if pool is not None and hasattr(pool, 'checkedout'):
+            stats.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow()
+            })
+        return stats
+
+# 全局连接池统计
+POOL_STATS = PoolStats()
+
+# 模块级会话工厂，engine 在创建会话时绑定，避免每次调用都构造 sessionmaker
+_session_factory = sessionmaker()
+
+def install_pool_instrumentation(engine):
+    """为应用的数据库引擎注册连接池统计"""
+    POOL_STATS.install(engine)
+
+def get_pool_stats() -> Dict[str, Any]:
+    """获取连接池统计信息"""
+    return POOL_STATS.snapshot()
+
 @contextmanager
 def create_db_session():
     """创建独立的数据库会话，确保线程安全"""
-    Session = sessionmaker(bind=db.engine)
-    session = Session()
+    session = _session_factory(bind=db.engine)
     try:
+        # 立即借出连接，以便统计连接池等待时间
+        checkout_start = time.monotonic()
+        session.connection()
+        POOL_STATS.record_checkout_wait(time.monotonic() - checkout_start)
+        
         yield session
+        commit_start = time.perf_counter()
         session.commit()
+        metrics.DB_COMMIT_SECONDS.observe(time.perf_counter() - commit_start)
     except Exception as e:
+        if isinstance(e, sa_exc.TimeoutError):
+            POOL_STATS.record_checkout_timeout()
         session.rollback()
         logging.error(f"数据库会话错误: {e}")
         raise
     finally:
         session.close()
 
+# ==================== 跨进程的服务账号处理锁 ====================
+
+# 等待处理锁时的轮询间隔（秒）
+ACCOUNT_LOCK_POLL_INTERVAL = 0.5
+
+class AccountBusy(Exception):
+    """服务账号正在被其他线程或进程处理"""
+
+def _try_account_lock(account_name: str, owner_id: str) -> bool:
+    now = datetime.utcnow()
+    with create_db_session() as session:
+        acquired = session.query(AccountLock).filter(
+            AccountLock.account_name == account_name,
+            AccountLock.owner_id.is_(None) | (AccountLock.expires_at < now)
+        ).update({
+            'owner_id': owner_id,
+            'expires_at': now + timedelta(seconds=CONFIG.task_timeout),
+            'acquired_at': now
+        }, synchronize_session=False)
+        if acquired:
+            return True
+        if session.get(AccountLock, account_name) is not None:
+            return False
+        
+        # 锁行不存在时插入，并发插入时主键冲突的一方失败
+        try:
+            with session.begin_nested():
+                session.add(AccountLock(
+                    account_name=account_name,
+                    owner_id=owner_id,
+                    expires_at=now + timedelta(seconds=CONFIG.task_timeout),
+                    acquired_at=now
+                ))
+            return True
+        except sa_exc.IntegrityError:
+            return False
+
+def acquire_account_lock(account_name: str, wait: float = 0.0) -> Optional[str]:
+    """获取服务账号的跨进程处理锁，返回持有者标识；wait 秒内未获取到时返回 None
+    
+    get_account_lock 只在进程内互斥；多进程执行模式的子进程、快速轮询和定向重新同步通过 account_locks 互斥。
+    每次尝试是一个独立的短事务，持锁期间不占用任何数据库行锁；持有者退出未释放时 task_timeout 后过期。
+    需在应用上下文中调用。
+    """
+    owner_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + wait
+    while True:
+        if _try_account_lock(account_name, owner_id):
+            return owner_id
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(ACCOUNT_LOCK_POLL_INTERVAL, remaining))
+
+def release_account_lock(account_name: str, owner_id: Optional[str]):
+    """释放 acquire_account_lock 获取的锁；需在应用上下文中调用"""
+    if owner_id is None:
+        return
+    try:
+        with create_db_session() as session:
+            session.query(AccountLock).filter(
+                AccountLock.account_name == account_name,
+                AccountLock.owner_id == owner_id
+            ).update({'owner_id': None, 'expires_at': datetime.utcnow()}, synchronize_session=False)
+    except Exception as e:
+        logging.error(f"释放服务账号 {account_name} 的处理锁失败，将在过期后自动释放: {e}")
+
 # ==================== 改进的重试机制 ====================
 
+# 可重试的状态码
+RETRYABLE_STATUS_CODES = {403, 409, 412, 429, 500, 502, 503, 504}
+
+def compute_retry_delay(
+    attempt: int,
+    status_code: Optional[int] = None,
+    base_delay: float = CONFIG.base_retry_delay,
+    max_delay: float = CONFIG.max_retry_delay,
+    enable_jitter: bool = CONFIG.enable_jitter
+) -> float:
+    """计算第 attempt 次失败后的等待时间 - 指数退避 + jitter，429 等待加倍"""
+    delay = min(base_delay * (2 ** attempt), max_delay)
+    
+    if enable_jitter:
+        # 添加随机化，避免惊群效应
+        delay = random.uniform(0, delay)
+    
+    # 对429做特殊处理
+    if status_code == 429:
+        delay *= 2  # 速率限制时等待更久
+    
+    return delay
+
 def retry_with_exponential_backoff(
     func,
     max_retries: int = CONFIG.max_retries,
@@ -151,27 +520,21 @@ def retry_with_exponential_backoff(
             else:
                 status_code = getattr(e, 'code', 500)
             
-            # 可重试的状态码
-            retryable_codes = {403, 409, 412, 429, 500, 502, 503, 504}
-            
-            if status_code not in retryable_codes or attempt == max_retries - 1:
+            if status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries - 1:
                 logging.error(f"API错误不可重试或达到最大重试次数: {status_code}")
                 raise e
             
             # 计算等待时间
-            delay = min(base_delay * (2 ** attempt), max_delay)
-            
-            if enable_jitter:
-                # 添加随机化，避免惊群效应
-                delay = random.uniform(0, delay)
+            delay = compute_retry_delay(attempt, status_code, base_delay, max_delay, enable_jitter)
             
-            # 对429做特殊处理
             if status_code == 429:
-                delay *= 2  # 速率限制时等待更久
                 logging.warning(f"遇到速率限制 (尝试 {attempt + 1}/{max_retries}), 等待 {delay:.2f}s")
             else:
                 logging.warning(f"API调用失败 {status_code} (尝试 {attempt + 1}/{max_retries}), 等待 {delay:.2f}s")
             
+            metrics.record_retry(status_code, delay)
+            quota.record_retry()
+            tracing.add_event('retry', attempt=attempt + 1, status=status_code, delay=round(delay, 3))
             time.sleep(delay)
             
         except Exception as e:
@@ -179,22 +542,98 @@ def retry_with_exponential_backoff(
                 logging.error(f"达到最大重试次数，操作失败: {e}")
                 raise e
             
-            delay = min(base_delay * (2 ** attempt), max_delay)
-            if enable_jitter:
-                delay = random.uniform(0, delay)
+            delay = compute_retry_delay(attempt, None, base_delay, max_delay, enable_jitter)
             
             logging.warning(f"操作失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}, 等待 {delay:.2f}s")
+            metrics.record_retry(None, delay)
+            quota.record_retry()
+            tracing.add_event('retry', attempt=attempt + 1, error=str(e), delay=round(delay, 3))
             time.sleep(delay)
 
+# ==================== 本轮共享的账单账户状态 ====================
+
+class BillingAccountStatusCache:
+    """单轮同步内跨服务账号共享的账单账户状态
+    
+    同一个账单账户只以本轮第一次观察到的状态为准；任一服务账号观察到关闭后，
+    本轮内对所有服务账号都视为关闭，并记录此前按开启状态处理过它的服务账号，
+    由本轮结束前的补充处理统一换绑。
+    """
+    
+    def __init__(self, allow_skip_list: bool = True):
+        self.allow_skip_list = allow_skip_list
+        self._accounts: Dict[str, Dict[str, Any]] = {}
+        self._seen_open_by: Dict[str, set] = defaultdict(set)
+        self._recheck: set = set()
+        self.list_calls = 0
+        self.list_skipped = 0
+        self.lock = Lock()
+    
+    def lookup(self, service_account_name: str, known_names: List[str]) -> Optional[List[Dict[str, Any]]]:
+        """服务账号已知的账单账户本轮都已获取过时直接返回缓存状态，否则返回 None"""
+        if not self.allow_skip_list or not known_names:
+            return None
+        with self.lock:
+            if any(name not in self._accounts for name in known_names):
+                return None
+            self.list_skipped += 1
+            return [self._observe(service_account_name, self._accounts[name]) for name in known_names]
+    
+    def merge(self, service_account_name: str, billing_accounts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并服务账号刚列出的账单账户，返回本轮统一后的状态"""
+        with self.lock:
+            self.list_calls += 1
+            merged = []
+            for account in billing_accounts:
+                cached = self._accounts.get(account['name'])
+                if cached is None:
+                    self._accounts[account['name']] = dict(account)
+                elif cached['open'] and not account['open']:
+                    cached['open'] = False
+                    affected = self._seen_open_by.pop(account['name'], set()) - {service_account_name}
+                    if affected:
+                        self._recheck |= affected
+                        logging.info(f"账单账户 {account['name']} 已关闭，本轮补充处理服务账号: {sorted(affected)}")
+                merged.append(self._observe(service_account_name, self._accounts[account['name']]))
+            return merged
+    
+    def _observe(self, service_account_name: str, account: Dict[str, Any]) -> Dict[str, Any]:
+        if account['open']:
+            self._seen_open_by[account['name']].add(service_account_name)
+        return dict(account)
+    
+    def accounts_to_recheck(self) -> set:
+        """取出需要按新关闭状态补充处理的服务账号"""
+        with self.lock:
+            names, self._recheck = self._recheck, set()
+            return names
+
+def fetch_billing_accounts(
+    api_client: 'GoogleAPIClient',
+    session: Session,
+    service_account_id: int,
+    billing_cache: Optional[BillingAccountStatusCache] = None
+) -> List[Dict[str, Any]]:
+    """获取服务账号可见的账单账户，本轮已由其他服务账号获取过时复用共享状态"""
+    if billing_cache is None:
+        return get_billing_accounts_v1(api_client)
+    
+    known_names = [row[0] for row in session.query(BillingAccount.name).filter_by(service_account_id=service_account_id).all()]
+    cached = billing_cache.lookup(api_client.service_account_name, known_names)
+    if cached is not None:
+        return cached
+    
+    return billing_cache.merge(api_client.service_account_name, get_billing_accounts_v1(api_client))
+
 # ==================== Google API 客户端管理 ====================
 
 class GoogleAPIClient:
     """Google API客户端管理器"""
     
-    def __init__(self, credentials, service_account_name: str):
+    def __init__(self, credentials, service_account_name: str, rate_limiter: Optional[RateLimiter] = None):
         self.credentials = credentials
         self.service_account_name = service_account_name
-        self.rate_limiter = get_rate_limiter(service_account_name)
+        self.rate_limiter = rate_limiter or get_rate_limiter(service_account_name)
         self._services = {}
     
     def get_service(self, service_name: str, version: str):
@@ -204,10 +643,16 @@ class GoogleAPIClient:
             build_kwargs = {
                 'serviceName': service_name,
                 'version': version,
-                'credentials': self.credentials,
                 'cache_discovery': False
             }
             
+            if CONFIG.shared_http_transport:
+                # 所有服务对象共享线程安全的连接池，按服务账号附加授权头
+                from services.http_transport import AuthorizedPooledHttp, get_shared_transport
+                build_kwargs['http'] = AuthorizedPooledHttp(get_shared_transport(), self.credentials)
+            else:
+                build_kwargs['credentials'] = self.credentials
+            
             # 只在支持的版本中添加static_discovery参数
             try:
                 # 检查是否支持static_discovery参数
@@ -215,20 +660,45 @@ class GoogleAPIClient:
                 from googleapiclient.discovery import build as discovery_build
                 sig = inspect.signature(discovery_build)
                 if 'static_discovery' in sig.parameters:
-                    build_kwargs['static_discovery'] = False
+                    # 自定义地址时使用内置的 discovery 文档，不访问 googleapis.com
+                    build_kwargs['static_discovery'] = bool(CONFIG.gcp_api_endpoint)
             except (ImportError, AttributeError):
                 # 老版本不支持，跳过此参数
                 pass
             
+            if CONFIG.gcp_api_endpoint:
+                build_kwargs['client_options'] = {'api_endpoint': CONFIG.gcp_api_endpoint}
+            
             self._services[key] = build(**build_kwargs)
         return self._services[key]
     
     def execute_with_rate_limit(self, request, timeout: float = 30.0):
         """执行API请求，带QPS限速"""
-        if not self.rate_limiter.acquire(timeout=timeout):
+        wait_start = time.perf_counter()
+        acquired = self.rate_limiter.acquire(timeout=timeout)
+        call_start = time.perf_counter()
+        metrics.RATE_LIMIT_WAIT_SECONDS.labels(self.service_account_name).observe(call_start - wait_start)
+        if not acquired:
             raise Exception(f"QPS限速超时: {self.service_account_name}")
         
-        return request.execute()
+        method = getattr(request, 'methodId', None) or 'unknown'
+        status = '200'
+        with tracing.span(method) as call_span:
+            if call_span.recording:
+                _set_request_attributes(call_span, request, self.service_account_name, call_start - wait_start)
+            try:
+                return request.execute()
+            except HttpError as e:
+                status = str(e.resp.status)
+                call_span.set_error(f"HTTP {status}")
+                raise
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                call_span.set_attribute('http.status_code', status)
+                metrics.API_REQUEST_SECONDS.labels(method, status).observe(time.perf_counter() - call_start)
+                quota.record_call(self.service_account_name, method, failed=status != '200')
     
     def close(self):
         """关闭所有连接"""
@@ -240,6 +710,16 @@ class GoogleAPIClient:
                     pass
         self._services.clear()
 
+# 从请求地址中提取项目和账单账户，作为 span 属性
+_RESOURCE_PATTERN = re.compile(r'/(projects|billingAccounts)/([^/:?]+)')
+
+def _set_request_attributes(call_span, request, service_account_name: str, limiter_wait: float):
+    uri = getattr(request, 'uri', '') or ''
+    call_span.set_attribute('service_account', service_account_name)
+    call_span.set_attribute('rate_limit.wait', round(limiter_wait, 4))
+    for kind, value in _RESOURCE_PATTERN.findall(uri):
+        call_span.set_attribute('project_id' if kind == 'projects' else 'billing_account_id', value)
+
 # ==================== v3 API 实现 ====================
 
 def get_projects_v3(api_client: GoogleAPIClient) -> List[str]:
@@ -352,6 +832,10 @@ def get_project_billing_info_v1(api_client: GoogleAPIClient, project_id: str) ->
         logging.error(f"获取项目 {project_id} 账单信息时发生异常: {e}")
         return None
 
+def billing_account_of(billing_info: Optional[Dict[str, Any]]) -> str:
+    """从 getBillingInfo 响应中取出账单账户名，未绑定（缺失或空字符串）统一为 'None'"""
+    return (billing_info or {}).get('billingAccountName') or 'None'
+
 def update_project_billing_info_v1(api_client: GoogleAPIClient, project_id: str, billing_account_name: str):
     """更新项目账单信息 - v1版本"""
     def _update_billing_info():
@@ -364,114 +848,262 @@ def update_project_billing_info_v1(api_client: GoogleAPIClient, project_id: str,
     
     return retry_with_exponential_backoff(_update_billing_info)
 
-def remove_project_admin_permission_v3(api_client: GoogleAPIClient, project_id: str, service_account_email: str) -> bool:
-    """移除项目管理员权限 - v3版本，支持条件IAM"""
-    service = api_client.get_service('cloudresourcemanager', 'v3')
-    resource = f'projects/{project_id}'
-    target_member = f"serviceAccount:{service_account_email}"
-    
-    def _update_iam_policy():
-        # 1. 获取当前策略（支持条件IAM）
-        get_policy_request = service.projects().getIamPolicy(
-            resource=resource,
-            body={
-                'options': {
-                    'requestedPolicyVersion': 3  # 支持条件绑定
-                }
-            }
-        )
-        policy = api_client.execute_with_rate_limit(get_policy_request)
-        
-        # 2. 移除目标成员
-        bindings = policy.get("bindings", [])
-        updated = False
-        new_bindings = []
-        
-        admin_roles = ["roles/owner", "roles/editor", "roles/resourcemanager.projectIamAdmin"]
+# ==================== IAM 策略读-改-写 ====================
+
+PROJECT_ADMIN_ROLES = ("roles/owner", "roles/editor", "roles/resourcemanager.projectIamAdmin")
+BILLING_ADMIN_ROLES = ("roles/billing.admin",)
+
+# etag 冲突: 策略在读取后被其他人修改
+IAM_CONFLICT_STATUS_CODES = {409, 412}
+
+class _PendingRemoval:
+    """等待写入的一次成员移除请求"""
+    __slots__ = ('members', 'roles', 'done', 'result')
+    
+    def __init__(self, members: List[str], roles: Tuple[str, ...]):
+        self.members = members
+        self.roles = roles
+        self.done = False
+        self.result = False
+
+class _ResourcePolicyState:
+    """单个资源的策略缓存、按凭据分组的待写入移除请求和串行化锁"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.pending: Dict[str, List[_PendingRemoval]] = {}
+        self.policy: Optional[Dict[str, Any]] = None
+        self.fetched_at = 0.0
+
+class IamPolicyManager:
+    """IAM 策略的读-改-写层
+    
+    - 策略按资源缓存（带 etag），TTL 内直接在缓存上修改后 setIamPolicy，只有 etag 冲突时才重新读取
+    - 同一资源上使用同一服务账号凭据并发的移除请求合并为一次 setIamPolicy，同一资源的写入串行执行
+    - setIamPolicy 返回的新策略（新 etag）回写缓存，后续移除可以省掉 getIamPolicy
+    - 资源状态保存在 TTL + LRU 缓存中，长期未访问或超出 max_resources 时淘汰
+    """
+    
+    def __init__(self, ttl: float, max_resources: int = 10000):
+        self.ttl = ttl
+        # 访问时重新写入以刷新过期时间；状态被淘汰后再次访问会新建，etag 保证写入安全
+        self._states: TTLCache = TTLCache(maxsize=max_resources, ttl=max(ttl, 60))
+        self._states_lock = Lock()
+        self._listeners: List[Any] = []
+        self._stats_lock = Lock()
+        self.stats = {
+            'get_calls': 0,
+            'set_calls': 0,
+            'cache_hits': 0,
+            'conflicts': 0,
+            'coalesced': 0,
+            'noop': 0
+        }
+    
+    def _state(self, resource: str) -> _ResourcePolicyState:
+        with self._states_lock:
+            state = self._states.get(resource) or _ResourcePolicyState()
+            self._states[resource] = state
+            return state
+    
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+    
+    def get_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        with self._states_lock:
+            stats['cached_policies'] = sum(1 for state in self._states.values() if state.policy is not None)
+        return stats
+    
+    def remember(self, resource: str, policy: Dict[str, Any]):
+        """写入外部读取到的策略（如 IAM 清单扫描的结果）"""
+        state = self._state(resource)
+        with state.lock:
+            state.policy = policy
+            state.fetched_at = time.monotonic()
+    
+    def invalidate(self, resource: str):
+        state = self._state(resource)
+        with state.lock:
+            state.policy = None
+    
+    def add_listener(self, callback):
+        """注册策略写入成功后的回调 callback(resource, policy)"""
+        self._listeners.append(callback)
+    
+    def _notify(self, resource: str, policy: Dict[str, Any]):
+        for callback in self._listeners:
+            try:
+                callback(resource, policy)
+            except Exception as e:
+                logging.error(f"IAM 策略变更回调失败 {resource}: {e}")
+    
+    def fetch_policy(self, api_client: 'GoogleAPIClient', resource: str) -> Dict[str, Any]:
+        """读取资源的最新策略并写入缓存"""
+        policy = self._get_policy(api_client, resource)
+        self.remember(resource, policy)
+        return policy
+    
+    def _iam_resource(self, api_client: 'GoogleAPIClient', resource: str):
+        if resource.startswith('projects/'):
+            return api_client.get_service('cloudresourcemanager', 'v3').projects()
+        return api_client.get_service('cloudbilling', 'v1').billingAccounts()
+    
+    def _get_policy(self, api_client: 'GoogleAPIClient', resource: str) -> Dict[str, Any]:
+        iam_resource = self._iam_resource(api_client, resource)
         
-        for binding in bindings:
-            if binding.get("role") in admin_roles and target_member in binding.get("members", []):
-                members = [m for m in binding["members"] if m != target_member]
-                if members:
-                    binding["members"] = members
-                    new_bindings.append(binding)
-                # 如果members为空，则不添加此binding（自动清理）
-                updated = True
+        def _get():
+            if resource.startswith('projects/'):
+                # 支持条件绑定
+                request = iam_resource.getIamPolicy(resource=resource, body={'options': {'requestedPolicyVersion': 3}})
             else:
-                new_bindings.append(binding)
+                request = iam_resource.getIamPolicy(resource=resource)
+            self._count('get_calls')
+            return api_client.execute_with_rate_limit(request)
         
-        if not updated:
-            logging.info("目标服务账号不在项目的管理员角色中，无需修改")
-            return True
-        
-        # 3. 更新策略（使用updateMask提高安全性）
-        policy["bindings"] = new_bindings
-        set_policy_request = service.projects().setIamPolicy(
-            resource=resource,
-            body={
-                'policy': policy,
-                'updateMask': 'bindings,etag'  # 只更新指定字段
-            }
-        )
-        api_client.execute_with_rate_limit(set_policy_request)
-        
-        logging.info(f"已成功移除 {target_member} 在项目 {project_id} 上的管理员权限")
-        return True
+        return retry_with_exponential_backoff(_get)
     
-    try:
-        return retry_with_exponential_backoff(_update_iam_policy)
-    except Exception as e:
-        logging.error(f"移除项目权限失败: {e}")
-        return False
-
-def remove_billing_admin_permission_v1(api_client: GoogleAPIClient, billing_account_name: str, service_account_email: str) -> bool:
-    """移除账单管理员权限 - v1版本，改进并发安全"""
-    service = api_client.get_service('cloudbilling', 'v1')
-    billing_account_id = billing_account_name.split('/')[-1]
-    resource = f"billingAccounts/{billing_account_id}"
-    target_member = f"serviceAccount:{service_account_email}"
+    def _set_policy(self, api_client: 'GoogleAPIClient', resource: str, policy: Dict[str, Any]) -> Dict[str, Any]:
+        iam_resource = self._iam_resource(api_client, resource)
+        if resource.startswith('projects/'):
+            # 只更新指定字段，etag 保证并发安全
+            body = {'policy': policy, 'updateMask': 'bindings,etag'}
+        else:
+            body = {'policy': policy}
+        self._count('set_calls')
+        return api_client.execute_with_rate_limit(iam_resource.setIamPolicy(resource=resource, body=body))
     
-    def _update_billing_iam_policy():
-        # 1. 获取当前策略
-        get_policy_request = service.billingAccounts().getIamPolicy(resource=resource)
-        policy = api_client.execute_with_rate_limit(get_policy_request)
-        
-        bindings = policy.get("bindings", [])
+    @staticmethod
+    def _apply_removals(policy: Dict[str, Any], removals: List[_PendingRemoval]) -> Tuple[Dict[str, Any], bool]:
+        """在策略副本上应用所有移除请求，返回 (新策略, 是否有变化)"""
         updated = False
         new_bindings = []
+        for binding in policy.get('bindings', []):
+            members = list(binding.get('members', []))
+            for removal in removals:
+                if binding.get('role') in removal.roles:
+                    remaining = [member for member in members if member not in removal.members]
+                    if len(remaining) != len(members):
+                        updated = True
+                        members = remaining
+            if members:
+                new_bindings.append(dict(binding, members=members))
+            # members 为空时不保留此 binding（自动清理）
+        return dict(policy, bindings=new_bindings), updated
+    
+    def remove_members(self, api_client: 'GoogleAPIClient', resource: str, members: List[str], roles: Tuple[str, ...]) -> bool:
+        """从资源策略的指定角色中移除成员
         
-        # 2. 遍历并移除目标成员
-        for binding in bindings:
-            if binding.get("role") == "roles/billing.admin" and target_member in binding.get("members", []):
-                members = [m for m in binding["members"] if m != target_member]
-                if members:
-                    binding["members"] = members
-                    new_bindings.append(binding)
-                # 如果members为空，则不添加此binding（自动清理）
-                updated = True
-            else:
-                new_bindings.append(binding)
-        
-        if not updated:
-            logging.info("目标服务账号不在 roles/billing.admin 中，无需修改")
-            return True
-        
-        # 3. 更新策略（保留etag确保并发安全）
-        policy["bindings"] = new_bindings
-        set_policy_request = service.billingAccounts().setIamPolicy(
-            resource=resource,
-            body={"policy": policy}
-        )
-        api_client.execute_with_rate_limit(set_policy_request)
+        同一资源上同时等待、且使用同一服务账号凭据的请求合并为一次写入；
+        不同凭据的请求各自用自己的 api_client 写入，不会借用持锁线程的权限。
+        """
+        removal = _PendingRemoval(members, tuple(roles))
+        credentials_key = api_client.service_account_name
+        state = self._state(resource)
+        with self._states_lock:
+            state.pending.setdefault(credentials_key, []).append(removal)
         
-        logging.info(f"已成功移除 {target_member} 在账单 {billing_account_id} 上的 Billing Admin 权限")
-        return True
+        with state.lock:
+            if removal.done:
+                # 已由前一个持锁线程合并写入
+                self._count('coalesced')
+                return removal.result
+            
+            with self._states_lock:
+                batch = state.pending.pop(credentials_key, [])
+            
+            try:
+                result = self._write_locked(api_client, resource, state, batch)
+            except Exception as e:
+                logging.error(f"更新 {resource} 的 IAM 策略失败: {e}")
+                result = False
+            
+            for pending in batch:
+                pending.result = result
+                pending.done = True
+            return removal.result
     
-    try:
-        return retry_with_exponential_backoff(_update_billing_iam_policy)
-    except Exception as e:
-        logging.error(f"移除账单权限失败: {e}")
-        return False
+    def _write_locked(self, api_client: 'GoogleAPIClient', resource: str, state: _ResourcePolicyState,
+                      batch: List[_PendingRemoval]) -> bool:
+        attempt = 0
+        while True:
+            fresh = state.policy is None or time.monotonic() - state.fetched_at > self.ttl
+            if fresh:
+                state.policy = self._get_policy(api_client, resource)
+                state.fetched_at = time.monotonic()
+            else:
+                self._count('cache_hits')
+            
+            new_policy, updated = self._apply_removals(state.policy, batch)
+            if not updated and not fresh:
+                # 缓存中已没有目标成员，但成员可能在缓存之后被重新授予，重新读取确认
+                state.policy = None
+                continue
+            if not updated:
+                self._count('noop')
+                self._notify(resource, state.policy)
+                logging.info(f"{resource} 的策略中没有需要移除的成员，无需修改")
+                return True
+            
+            try:
+                state.policy = self._set_policy(api_client, resource, new_policy)
+                state.fetched_at = time.monotonic()
+                self._notify(resource, state.policy)
+                removed = sorted({member for pending in batch for member in pending.members})
+                logging.info(f"已从 {resource} 的 IAM 策略中移除 {removed}（合并 {len(batch)} 个请求）")
+                return True
+            except HttpError as e:
+                status_code = e.resp.status
+                attempt += 1
+                if status_code not in RETRYABLE_STATUS_CODES or attempt >= CONFIG.max_retries:
+                    state.policy = None
+                    raise
+                if status_code in IAM_CONFLICT_STATUS_CODES:
+                    # etag 过期: 重新读取后在最新策略上再次应用
+                    self._count('conflicts')
+                    metrics.record_retry(status_code, 0)
+                    quota.record_retry()
+                    logging.warning(f"{resource} 的 IAM 策略 etag 冲突，重新读取 (尝试 {attempt}/{CONFIG.max_retries})")
+                    state.policy = None
+                    continue
+                # 限流或服务端错误: 缓存的 etag 仍然有效，退避后直接重试写入
+                delay = compute_retry_delay(attempt - 1, status_code)
+                metrics.record_retry(status_code, delay)
+                quota.record_retry()
+                logging.warning(f"更新 {resource} 的 IAM 策略失败 {status_code} (尝试 {attempt}/{CONFIG.max_retries}), 等待 {delay:.2f}s")
+                time.sleep(delay)
+
+_iam_manager: Optional[IamPolicyManager] = None
+
+def get_iam_manager() -> IamPolicyManager:
+    """获取进程内共享的 IAM 策略管理器"""
+    global _iam_manager
+    with _limiter_lock:
+        if _iam_manager is None:
+            # 关闭缓存时 TTL 为 0，每次写入前都重新读取（仍会合并并发请求）
+            _iam_manager = IamPolicyManager(
+                CONFIG.iam_policy_ttl if CONFIG.iam_policy_cache_enabled else 0,
+                CONFIG.iam_policy_max_resources
+            )
+        return _iam_manager
+
+def get_iam_stats() -> Dict[str, int]:
+    return get_iam_manager().get_stats()
+
+def remove_project_admin_permission_v3(api_client: GoogleAPIClient, project_id: str, service_account_email: str) -> bool:
+    """移除项目管理员权限 - v3版本，支持条件IAM"""
+    return get_iam_manager().remove_members(
+        api_client, f'projects/{project_id}', [f"serviceAccount:{service_account_email}"], PROJECT_ADMIN_ROLES
+    )
+
+def remove_billing_admin_permission_v1(api_client: GoogleAPIClient, billing_account_name: str, service_account_email: str) -> bool:
+    """移除账单管理员权限 - v1版本，改进并发安全"""
+    billing_account_id = billing_account_name.split('/')[-1]
+    return get_iam_manager().remove_members(
+        api_client, f"billingAccounts/{billing_account_id}", [f"serviceAccount:{service_account_email}"], BILLING_ADMIN_ROLES
+    )
 
 # ==================== 业务逻辑函数 ====================
 
@@ -485,6 +1117,30 @@ def get_service_account_email(credentials_file: str) -> Optional[str]:
         logging.error(f"无法从凭证文件获取服务账号邮箱: {e}")
         return None
 
+# 作为后续操作前置条件的记录（删除项目记录前检查是否已解除权限）始终同步写入:
+# 异步写入时记录可能还在队列里，甚至在另一个 worker 进程的队列里，立即读取会查不到
+SYNCHRONOUS_AUDIT_OPERATIONS = frozenset({'remove_project_permission'})
+
+def _submit_after_commit(session: Session, writer, record: Dict[str, Any]):
+    """调用者事务提交后再把记录交给写入器，回滚时丢弃（与同步写入时加入调用者事务的语义一致）
+    
+    记录引用的服务账号可能是该事务中新建的，提前写入会违反外键约束。
+    """
+    pending = session.info.setdefault('pending_audit_records', [])
+    if not session.info.get('audit_listeners'):
+        session.info['audit_listeners'] = True
+        
+        @event.listens_for(session, 'after_commit')
+        def _submit_pending(committed_session):
+            for pending_record in committed_session.info.pop('pending_audit_records', []):
+                writer.submit(pending_record)
+        
+        @event.listens_for(session, 'after_rollback')
+        def _discard_pending(rolled_back_session):
+            rolled_back_session.info.pop('pending_audit_records', None)
+    
+    pending.append(record)
+
 def log_operation(
     operation_type: str,
     service_account_id: int,
@@ -496,8 +1152,33 @@ def log_operation(
     message: str = '',
     session: Optional[Session] = None
 ):
-    """记录操作日志 - 线程安全版本"""
+    """记录操作日志 - 线程安全版本
+    
+    启用异步审计写入时记录交给后台写入器批量落库，传入 session 时等该事务提交后再提交给写入器；
+    否则（或 SYNCHRONOUS_AUDIT_OPERATIONS 中的记录）同步写入：传入 session 时加入调用者的事务，不传时独立提交。
+    """
     try:
+        from services.audit_log import get_audit_writer
+        
+        writer = get_audit_writer()
+        if writer is not None and operation_type not in SYNCHRONOUS_AUDIT_OPERATIONS:
+            record = {
+                'operation_type': operation_type,
+                'service_account_id': service_account_id,
+                'project_id': project_id,
+                'billing_account_id': billing_account_id,
+                'old_value': old_value,
+                'new_value': new_value,
+                'status': status,
+                'message': message,
+                'created_at': datetime.utcnow()
+            }
+            if session is not None:
+                _submit_after_commit(session, writer, record)
+            else:
+                writer.submit(record)
+            return
+        
         # 如果没有传入session，创建新的独立session
         if session is None:
             with create_db_session() as session:
@@ -531,6 +1212,35 @@ def log_operation(
     except Exception as e:
         logging.error(f"记录操作日志失败: {e}")
 
+def log_operations(operations: List[Dict[str, Any]]):
+    """批量记录操作日志: 启用异步审计写入时交给写入器（SYNCHRONOUS_AUDIT_OPERATIONS 除外），否则一次事务批量插入"""
+    if not operations:
+        return
+    
+    try:
+        from services.audit_log import get_audit_writer
+        
+        writer = get_audit_writer()
+        now = datetime.utcnow()
+        if writer is not None:
+            synchronous = []
+            for operation in operations:
+                if operation['operation_type'] in SYNCHRONOUS_AUDIT_OPERATIONS:
+                    synchronous.append(operation)
+                else:
+                    writer.submit(dict(operation, created_at=operation.get('created_at') or now))
+            operations = synchronous
+            if not operations:
+                return
+        
+        with create_db_session() as session:
+            session.bulk_insert_mappings(BillingOperation, [
+                dict(operation, created_at=operation.get('created_at') or now) for operation in operations
+            ])
+    
+    except Exception as e:
+        logging.error(f"批量记录操作日志失败: {e}")
+
 def get_current_billing_usage(projects_billing_info: Dict[str, str]) -> Dict[str, int]:
     """统计每个账单当前的项目使用数量"""
     usage = defaultdict(int)
@@ -671,206 +1381,396 @@ def redistribute_projects(
     
     return failed_projects
 
-def process_account(app, gcp_account: Dict[str, str]) -> bool:
+def get_or_create_service_account(session: Session, gcp_account: Dict[str, str], email: Optional[str]) -> ServiceAccount:
+    """查找或创建服务账号记录"""
+    sa_obj = session.query(ServiceAccount).filter_by(name=gcp_account['name']).first()
+    if not sa_obj:
+        sa_obj = ServiceAccount(
+            name=gcp_account['name'],
+            email=email,
+            credentials_file=gcp_account['credentials_file']
+        )
+        session.add(sa_obj)
+        session.flush()  # 获取ID但不提交事务
+    return sa_obj
+
+def save_billing_accounts(session: Session, service_account_id: int, billing_accounts: List[Dict[str, Any]]):
+    """更新数据库中的账单账户信息 - 一次查询加载已有记录"""
+    existing = {
+        db_account.name: db_account
+        for db_account in session.query(BillingAccount).filter_by(service_account_id=service_account_id).all()
+    }
+    
+    for account in billing_accounts:
+        db_account = existing.get(account['name'])
+        
+        if not db_account:
+            db_account = BillingAccount(
+                name=account['name'],
+                display_name=account['displayName'],
+                account_id=account['name'].split('/')[-1],
+                is_open=account['open'],
+                is_used=False,
+                service_account_id=service_account_id
+            )
+            session.add(db_account)
+            existing[account['name']] = db_account
+        else:
+            db_account.display_name = account['displayName']
+            db_account.is_open = account['open']
+
+def save_project_states(
+    session: Session,
+    service_account_id: int,
+    projects: List[str],
+    projects_billing_info: Dict[str, str],
+    billing_accounts_dict: Dict[str, Dict[str, Any]]
+):
+    """把项目的账单绑定状态写入数据库，并更新账单使用状态"""
+    used_billing_accounts = set()
+    existing = {
+        db_project.project_id: db_project
+        for db_project in session.query(Project).filter_by(service_account_id=service_account_id).all()
+    }
+    
+    for project_id in projects:
+        current_billing_account = projects_billing_info.get(project_id, 'None')
+        
+        display_name = 'None'
+        if current_billing_account != 'None':
+            account_info_temp = billing_accounts_dict.get(current_billing_account, {})
+            display_name = account_info_temp.get('displayName', current_billing_account)
+            used_billing_accounts.add(current_billing_account)
+        
+        billing_account_id = current_billing_account.split('/')[-1] if current_billing_account != 'None' else None
+        
+        # 更新项目信息
+        db_project = existing.get(project_id)
+        
+        if not db_project:
+            db_project = Project(
+                project_id=project_id,
+                service_account_id=service_account_id,
+                billing_account_id=billing_account_id,
+                billing_account_name=current_billing_account,
+                billing_account_display_name=display_name
+            )
+            session.add(db_project)
+            existing[project_id] = db_project
+        else:
+            db_project.billing_account_id = billing_account_id
+            db_project.billing_account_name = current_billing_account
+            db_project.billing_account_display_name = display_name
+    
+    # 更新账单使用状态
+    for db_account in session.query(BillingAccount).filter_by(service_account_id=service_account_id).all():
+        db_account.is_used = db_account.name in used_billing_accounts
+
+def unbind_projects(
+    api_client: GoogleAPIClient,
+    session: Session,
+    service_account_id: int,
+    failed_projects: List[Tuple[str, str]],
+    projects_billing_info: Dict[str, str],
+    message: str = "失效账单自动解绑"
+) -> List[str]:
+    """解绑绑定在失效账单上的项目，返回解绑成功的项目"""
+    unbound_projects = []
+    if not failed_projects:
+        return unbound_projects
+    
+    logging.info(f"开始解绑 {len(failed_projects)} 个失效账单项目")
+    
+    for project_id, old_billing in failed_projects:
+        try:
+            update_project_billing_info_v1(api_client, project_id, '')
+            unbound_projects.append(project_id)
+            projects_billing_info[project_id] = 'None'
+            
+            log_operation(
+                operation_type='unbind',
+                service_account_id=service_account_id,
+                project_id=project_id,
+                billing_account_id=old_billing.split('/')[-1],
+                old_value=old_billing,
+                new_value='None',
+                status='success',
+                message=message,
+                session=session
+            )
+            logging.info(f"成功解绑项目 {project_id} 的失效账单")
+            
+        except Exception as e:
+            log_operation(
+                operation_type='unbind',
+                service_account_id=service_account_id,
+                project_id=project_id,
+                billing_account_id=old_billing.split('/')[-1],
+                old_value=old_billing,
+                new_value='None',
+                status='failed',
+                message=str(e),
+                session=session
+            )
+            logging.error(f"解绑项目 {project_id} 失败: {e}")
+    
+    return unbound_projects
+
+def rebind_projects(
+    api_client: GoogleAPIClient,
+    session: Session,
+    service_account_id: int,
+    unbound_projects: List[str],
+    active_billing_accounts: List[str],
+    projects_billing_info: Dict[str, str]
+):
+    """把无账单项目分配到可用账单，并回读实际绑定结果更新 projects_billing_info"""
+    current_usage = get_current_billing_usage(projects_billing_info)
+    
+    logging.info(f"当前账单使用情况: {current_usage}")
+    logging.info(f"开始重新分配 {len(unbound_projects)} 个无账单项目")
+    
+    with tracing.span('redistribute', projects=len(unbound_projects)):
+        failed_redistribute_projects = redistribute_projects(
+            unbound_projects, 
+            active_billing_accounts, 
+            current_usage,
+            api_client, 
+            service_account_id,
+            session
+        )
+    
+    if failed_redistribute_projects:
+        logging.warning(f"有 {len(failed_redistribute_projects)} 个项目分配失败，将在下次运行时重试")
+    
+    # 重新获取项目账单信息
+    with tracing.span('reverify', projects=len(unbound_projects)):
+        for project_id in unbound_projects:
+            try:
+                billing_info = get_project_billing_info_v1(api_client, project_id)
+                if billing_info:
+                    projects_billing_info[project_id] = billing_account_of(billing_info)
+            except Exception as e:
+                logging.error(f"重新获取项目 {project_id} 账单信息失败: {e}")
+
+def process_account(app, gcp_account: Dict[str, str], billing_cache: Optional[BillingAccountStatusCache] = None) -> bool:
     """处理单个GCP服务账号 - 完全线程安全版本"""
     api_client = None
+    account_name = gcp_account['name']
+    account_lock = get_account_lock(account_name)
+    with metrics.phase(account_name, 'lock_wait'):
+        account_lock.acquire()
+    account_start = time.perf_counter()
+    success = False
     
     try:
-        with app.app_context():
-            # 创建线程独立的数据库会话
-            with create_db_session() as session:
-                credentials_file = gcp_account['credentials_file']
-                
-                # 创建API客户端
-                credentials = service_account.Credentials.from_service_account_file(
-                    credentials_file,
-                    scopes=['https://www.googleapis.com/auth/cloud-platform']
-                )
-                api_client = GoogleAPIClient(credentials, gcp_account['name'])
-                
-                # 获取服务账号邮箱
-                service_account_email = get_service_account_email(credentials_file)
-                
-                # 查找或创建服务账号记录
-                sa_obj = session.query(ServiceAccount).filter_by(name=gcp_account['name']).first()
-                if not sa_obj:
-                    sa_obj = ServiceAccount(
-                        name=gcp_account['name'],
-                        email=service_account_email,
-                        credentials_file=credentials_file
-                    )
-                    session.add(sa_obj)
-                    session.flush()  # 获取ID但不提交事务
-                
-                # 获取项目和账单信息
-                projects = get_projects_v3(api_client)
-                billing_accounts = get_billing_accounts_v1(api_client)
-                
-                # 处理账单账户信息
-                billing_accounts_dict = {account['name']: account for account in billing_accounts}
-                active_billing_accounts = [account['name'] for account in billing_accounts if account['open']]
-                
-                # 更新数据库中的账单账户信息
-                for account in billing_accounts:
-                    db_account = session.query(BillingAccount).filter_by(
-                        name=account['name'], 
-                        service_account_id=sa_obj.id
-                    ).first()
+        with tracing.span('process_account', service_account=account_name), app.app_context():
+            # 其他进程（多进程模式的子进程、定向重新同步）正在处理该账号时等待
+            with metrics.phase(account_name, 'account_lock_wait'):
+                lock_owner = acquire_account_lock(account_name, wait=CONFIG.task_timeout)
+            if lock_owner is None:
+                logging.warning(f"服务账号 {account_name} 正在被其他进程处理，跳过本轮")
+                return False
+            try:
+                # 创建线程独立的数据库会话
+                with create_db_session() as session:
+                    credentials_file = gcp_account['credentials_file']
                     
-                    if not db_account:
-                        db_account = BillingAccount(
-                            name=account['name'],
-                            display_name=account['displayName'],
-                            account_id=account['name'].split('/')[-1],
-                            is_open=account['open'],
-                            is_used=False,
-                            service_account_id=sa_obj.id
-                        )
-                        session.add(db_account)
-                    else:
-                        db_account.display_name = account['displayName']
-                        db_account.is_open = account['open']
-                
-                # 第一阶段：收集项目状态
-                projects_billing_info = {}
-                failed_projects = []
-                unbound_projects = []
-                
-                logging.info(f"开始处理服务账号 {gcp_account['name']} 的 {len(projects)} 个项目")
-                
-                for project_id in projects:
-                    billing_info = get_project_billing_info_v1(api_client, project_id)
-                    if billing_info:
-                        current_billing_account = billing_info.get('billingAccountName', 'None')
-                        projects_billing_info[project_id] = current_billing_account
-                        
-                        if current_billing_account == 'None':
-                            unbound_projects.append(project_id)
-                        elif current_billing_account not in active_billing_accounts:
-                            failed_projects.append((project_id, current_billing_account))
-                            logging.info(f"发现失效账单项目: {project_id} -> {current_billing_account}")
-                    else:
-                        projects_billing_info[project_id] = 'None'
-                        unbound_projects.append(project_id)
-                
-                # 第二阶段：批量解绑失效账单项目
-                if failed_projects:
-                    logging.info(f"开始解绑 {len(failed_projects)} 个失效账单项目")
+                    # 创建API客户端，凭据和令牌由令牌管理器共享
+                    from services.token_manager import get_credentials
+                    with metrics.phase(account_name, 'credentials'), tracing.span('credentials'):
+                        credentials = get_credentials(credentials_file, gcp_account['name'])
+                    api_client = GoogleAPIClient(credentials, gcp_account['name'])
                     
-                    for project_id, old_billing in failed_projects:
-                        try:
-                            update_project_billing_info_v1(api_client, project_id, '')
-                            unbound_projects.append(project_id)
-                            projects_billing_info[project_id] = 'None'
-                            
-                            log_operation(
-                                operation_type='unbind',
-                                service_account_id=sa_obj.id,
-                                project_id=project_id,
-                                billing_account_id=old_billing.split('/')[-1],
-                                old_value=old_billing,
-                                new_value='None',
-                                status='success',
-                                message="失效账单自动解绑",
-                                session=session
-                            )
-                            logging.info(f"成功解绑项目 {project_id} 的失效账单")
-                            
-                        except Exception as e:
-                            log_operation(
-                                operation_type='unbind',
-                                service_account_id=sa_obj.id,
-                                project_id=project_id,
-                                billing_account_id=old_billing.split('/')[-1],
-                                old_value=old_billing,
-                                new_value='None',
-                                status='failed',
-                                message=str(e),
-                                session=session
-                            )
-                            logging.error(f"解绑项目 {project_id} 失败: {e}")
-                
-                # 第三阶段：统一分配无账单项目
-                if unbound_projects and active_billing_accounts and CONFIG.enable_auto_switch:
-                    current_usage = get_current_billing_usage(projects_billing_info)
+                    # 获取服务账号邮箱
+                    service_account_email = get_service_account_email(credentials_file)
+                    
+                    # 查找或创建服务账号记录
+                    sa_obj = get_or_create_service_account(session, gcp_account, service_account_email)
+                    
+                    # 获取项目和账单信息
+                    with metrics.phase(account_name, 'list_projects'), tracing.span('list_projects'):
+                        projects = get_projects_v3(api_client)
+                    with metrics.phase(account_name, 'list_billing_accounts'), tracing.span('list_billing_accounts'):
+                        billing_accounts = fetch_billing_accounts(api_client, session, sa_obj.id, billing_cache)
                     
-                    logging.info(f"当前账单使用情况: {current_usage}")
-                    logging.info(f"开始重新分配 {len(unbound_projects)} 个无账单项目")
+                    # 处理账单账户信息
+                    billing_accounts_dict = {account['name']: account for account in billing_accounts}
+                    active_billing_accounts = [account['name'] for account in billing_accounts if account['open']]
                     
-                    failed_redistribute_projects = redistribute_projects(
-                        unbound_projects, 
-                        active_billing_accounts, 
-                        current_usage,
-                        api_client, 
-                        sa_obj.id,
-                        session
-                    )
+                    # 更新数据库中的账单账户信息
+                    save_billing_accounts(session, sa_obj.id, billing_accounts)
+                    # 先提交服务账号和账单账户记录: 逐个项目检查耗时较长，期间不持有这些行的写锁
+                    session.commit()
                     
-                    if failed_redistribute_projects:
-                        logging.warning(f"有 {len(failed_redistribute_projects)} 个项目分配失败，将在下次运行时重试")
+                    # 第一阶段：收集项目状态
+                    projects_billing_info = {}
+                    failed_projects = []
+                    unbound_projects = []
                     
-                    # 重新获取项目账单信息
-                    for project_id in unbound_projects:
-                        try:
+                    logging.info(f"开始处理服务账号 {gcp_account['name']} 的 {len(projects)} 个项目")
+                    
+                    with metrics.phase(account_name, 'project_billing_info'), tracing.span('project_billing_info'):
+                        for project_id in projects:
                             billing_info = get_project_billing_info_v1(api_client, project_id)
                             if billing_info:
-                                projects_billing_info[project_id] = billing_info.get('billingAccountName', 'None')
-                        except Exception as e:
-                            logging.error(f"重新获取项目 {project_id} 账单信息失败: {e}")
-                
-                # 第四阶段：更新数据库记录
-                used_billing_accounts = set()
-                
-                for project_id in projects:
-                    current_billing_account = projects_billing_info.get(project_id, 'None')
+                                current_billing_account = billing_account_of(billing_info)
+                                projects_billing_info[project_id] = current_billing_account
+                            
+                                if current_billing_account == 'None':
+                                    unbound_projects.append(project_id)
+                                elif current_billing_account not in active_billing_accounts:
+                                    failed_projects.append((project_id, current_billing_account))
+                                    logging.info(f"发现失效账单项目: {project_id} -> {current_billing_account}")
+                            else:
+                                projects_billing_info[project_id] = 'None'
+                                unbound_projects.append(project_id)
                     
-                    display_name = 'None'
-                    if current_billing_account != 'None':
-                        account_info_temp = billing_accounts_dict.get(current_billing_account, {})
-                        display_name = account_info_temp.get('displayName', current_billing_account)
-                        used_billing_accounts.add(current_billing_account)
+                    # 第二阶段：批量解绑失效账单项目
+                    with metrics.phase(account_name, 'unbind'), tracing.span('unbind'):
+                        unbound_projects.extend(unbind_projects(api_client, session, sa_obj.id, failed_projects, projects_billing_info))
+                    session.commit()
                     
-                    # 更新项目信息
-                    db_project = session.query(Project).filter_by(
-                        project_id=project_id, 
-                        service_account_id=sa_obj.id
-                    ).first()
+                    # 第三阶段：统一分配无账单项目
+                    if unbound_projects and active_billing_accounts and CONFIG.enable_auto_switch:
+                        with metrics.phase(account_name, 'rebind'), tracing.span('rebind'):
+                            rebind_projects(api_client, session, sa_obj.id, unbound_projects, active_billing_accounts, projects_billing_info)
                     
-                    if not db_project:
-                        db_project = Project(
-                            project_id=project_id,
-                            service_account_id=sa_obj.id,
-                            billing_account_id=current_billing_account.split('/')[-1] if current_billing_account != 'None' else None,
-                            billing_account_name=current_billing_account,
-                            billing_account_display_name=display_name
-                        )
-                        session.add(db_project)
-                    else:
-                        db_project.billing_account_id = current_billing_account.split('/')[-1] if current_billing_account != 'None' else None
-                        db_project.billing_account_name = current_billing_account
-                        db_project.billing_account_display_name = display_name
-                
-                # 更新账单使用状态
-                for db_account in session.query(BillingAccount).filter_by(service_account_id=sa_obj.id).all():
-                    db_account.is_used = db_account.name in used_billing_accounts
-                
-                # 事务会自动提交
-                logging.info(f"成功处理服务账号 {gcp_account['name']}")
-                return True
+                    # 第四阶段：更新数据库记录
+                    with metrics.phase(account_name, 'save'), tracing.span('save'):
+                        save_project_states(session, sa_obj.id, projects, projects_billing_info, billing_accounts_dict)
+                    
+                    # 事务会自动提交
+                    logging.info(f"成功处理服务账号 {gcp_account['name']}")
+                    success = True
+                    return True
+            finally:
+                release_account_lock(account_name, lock_owner)
             
     except Exception as e:
         logging.error(f"处理服务账号 {gcp_account['name']} 时发生错误: {str(e)}", exc_info=True)
         return False
     finally:
+        account_lock.release()
         # 确保API客户端被正确关闭
         if api_client:
             api_client.close()
+        metrics.SYNC_ACCOUNT_SECONDS.labels(account_name, 'success' if success else 'failed').observe(
+            time.perf_counter() - account_start
+        )
+
+def run_accounts_in_threads(
+    app,
+    gcp_accounts: List[Dict[str, str]],
+    billing_cache: Optional[BillingAccountStatusCache] = None
+) -> Tuple[int, int]:
+    """在线程池中处理一批服务账号，返回 (成功数, 失败数)"""
+    # 自适应线程数
+    max_workers = min(CONFIG.max_workers, max(2, len(gcp_accounts)))
+    
+    # 剖析同步轮次时，各线程的 cProfile 结果并入本轮
+    from services.profiling import get_profiler
+    run_account = tracing.wrap(get_profiler().wrap(process_account))
+    
+    # 改进的超时处理
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_account = {
+            executor.submit(run_account, app, account, billing_cache): account 
+            for account in gcp_accounts
+        }
+        
+        success_count = 0
+        failed_count = 0
+        
+        # 使用as_completed的超时参数，而不是future.result的超时
+        try:
+            for future in as_completed(future_to_account, timeout=CONFIG.task_timeout):
+                account = future_to_account[future]
+                try:
+                    result = future.result()  # 不再设置timeout
+                    if result:
+                        success_count += 1
+                    else:
+                        failed_count += 1
+                except Exception as e:
+                    failed_count += 1
+                    logging.error(f"处理服务账号 {account['name']} 时发生异常: {e}")
+        
+        except TimeoutError:
+            logging.error(f"任务执行超时 ({CONFIG.task_timeout}s)，取消剩余任务")
+            # 取消所有未完成的任务
+            for future in future_to_account:
+                if not future.done():
+                    future.cancel()
+            failed_count += len([f for f in future_to_account if not f.done()])
+    
+    return success_count, failed_count
+
+def run_sync_cycle(app, gcp_accounts: List[Dict[str, str]], cycle: int = 0) -> Tuple[int, int]:
+    """按配置的执行模式处理一轮服务账号，返回 (成功数, 失败数)
+    
+    cycle 为轮次序号，第 0 轮及每隔 billing_full_list_every 轮所有服务账号都重新列出账单账户。
+    """
+    if CONFIG.sync_execution_mode == 'process':
+        # 多进程模式: 每个子进程处理一个分片，绕开 GIL（账单状态无法跨进程共享）
+        from services.process_pool import run_accounts_in_processes
+        return run_accounts_in_processes(gcp_accounts)
+    
+    billing_cache = None
+    if CONFIG.share_billing_status:
+        full_list_every = max(1, CONFIG.billing_full_list_every)
+        billing_cache = BillingAccountStatusCache(allow_skip_list=cycle % full_list_every != 0)
+    
+    if CONFIG.sync_execution_mode == 'async':
+        # 异步模式: 单个事件循环上并发执行全部 REST 调用
+        from services.async_sync import run_accounts_async
+        run_accounts = run_accounts_async
+    else:
+        run_accounts = run_accounts_in_threads
+    
+    success_count, failed_count = run_accounts(app, gcp_accounts, billing_cache)
+    if billing_cache is None:
+        return success_count, failed_count
+    
+    # 本轮中途发现账单关闭时，补充处理之前按开启状态处理过它的服务账号
+    recheck = billing_cache.accounts_to_recheck()
+    if recheck:
+        accounts = [account for account in gcp_accounts if account['name'] in recheck]
+        logging.info(f"账单账户状态变化，补充处理 {len(accounts)} 个服务账号")
+        run_accounts(app, accounts, billing_cache)
+    
+    logging.info(
+        f"账单账户列表调用 {billing_cache.list_calls} 次, 复用本轮状态 {billing_cache.list_skipped} 次"
+    )
+    return success_count, failed_count
 
 def update_project_status(app):
     """定期更新项目状态的后台任务 - 改进版超时处理"""
     consecutive_failures = 0
     max_consecutive_failures = 3
     
+    # 多副本部署时，通过数据库租约只处理分配给本进程的服务账号
+    from services.coordination import init_coordinator
+    coordinator = init_coordinator(app)
+    cycle = 0
+    
+    # 账单关闭由快速轮询在 FAST_POLL_INTERVAL 内处理，本循环负责项目发现和全量对账
+    from services.billing_poll import start_fast_poll_thread
+    start_fast_poll_thread(app)
+    
+    # webhook 写入的定向重新同步请求在独立线程中处理
+    from services.resync import start_resync_thread
+    start_resync_thread(app)
+    
+    # 服务账号管理员权限清单在独立线程中按只读限速器扫描
+    from services.iam_inventory import start_iam_scan_thread
+    start_iam_scan_thread(app)
+    
+    # 按需剖析: 管理接口写入的触发文件由本进程处理
+    from services.profiling import get_profiler, init_sync_profiling
+    init_sync_profiling()
+    profiler = get_profiler()
+    
     while True:
         start_time = time.time()
         sleep_time = CONFIG.update_interval
@@ -886,42 +1786,17 @@ def update_project_status(app):
                     time.sleep(CONFIG.update_interval)
                     continue
                 
-                # 自适应线程数
-                max_workers = min(CONFIG.max_workers, max(2, len(gcp_accounts)))
+                if coordinator is not None:
+                    gcp_accounts = coordinator.owned_accounts(gcp_accounts)
                 
-                # 改进的超时处理
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    future_to_account = {
-                        executor.submit(process_account, app, account): account 
-                        for account in gcp_accounts
-                    }
-                    
-                    success_count = 0
-                    failed_count = 0
-                    
-                    # 使用as_completed的超时参数，而不是future.result的超时
-                    try:
-                        for future in as_completed(future_to_account, timeout=CONFIG.task_timeout):
-                            account = future_to_account[future]
-                            try:
-                                result = future.result()  # 不再设置timeout
-                                if result:
-                                    success_count += 1
-                                else:
-                                    failed_count += 1
-                            except Exception as e:
-                                failed_count += 1
-                                logging.error(f"处理服务账号 {account['name']} 时发生异常: {e}")
-                    
-                    except TimeoutError:
-                        logging.error(f"任务执行超时 ({CONFIG.task_timeout}s)，取消剩余任务")
-                        # 取消所有未完成的任务
-                        for future in future_to_account:
-                            if not future.done():
-                                future.cancel()
-                        failed_count += len([f for f in future_to_account if not f.done()])
+                with tracing.start_trace('sync_cycle', cycle=cycle, accounts=len(gcp_accounts)) as cycle_span, \
+                        profiler.profile_cycle(f"cycle{cycle}"):
+                    success_count, failed_count = run_sync_cycle(app, gcp_accounts, cycle)
+                    cycle_span.set_attribute('failed_accounts', failed_count)
+                cycle += 1
             
             execution_time = time.time() - start_time
+            metrics.SYNC_CYCLE_SECONDS.observe(execution_time)
             
             # 健康状态管理
             if failed_count == 0:
@@ -940,6 +1815,10 @@ def update_project_status(app):
                     if consecutive_failures >= 5:
                         send_alert_if_configured(f"GCP账单管理系统连续失败{consecutive_failures}次")
             
+            # 每天执行一次操作记录汇总、归档和清理
+            from services.retention import run_retention_if_due
+            run_retention_if_due(app)
+            
             # 计算下次执行的等待时间
             sleep_time = max(30, sleep_time - execution_time)
             logging.info(f"等待 {sleep_time:.2f} 秒后开始下一轮")
@@ -1002,10 +1881,8 @@ def remove_project_admin_rights(project_id: str, service_account_id: int) -> Tup
                 return False, "找不到指定的项目"
             
             # 创建API客户端
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_obj.credentials_file,
-                scopes=['https://www.googleapis.com/auth/cloud-platform']
-            )
+            from services.token_manager import get_credentials
+            credentials = get_credentials(service_account_obj.credentials_file, service_account_obj.name)
             api_client = GoogleAPIClient(credentials, service_account_obj.name)
             
             try:
@@ -1062,10 +1939,8 @@ def remove_billing_admin_rights(billing_account_name: str, service_account_id: i
                 return False, "找不到指定的服务账号"
             
             # 创建API客户端
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_obj.credentials_file,
-                scopes=['https://www.googleapis.com/auth/cloud-platform']
-            )
+            from services.token_manager import get_credentials
+            credentials = get_credentials(service_account_obj.credentials_file, service_account_obj.name)
             api_client = GoogleAPIClient(credentials, service_account_obj.name)
             
             try:
@@ -1138,10 +2013,8 @@ def unbind_project_billing(project_id: str, service_account_id: int) -> Tuple[bo
             old_billing_account_id = project.billing_account_id
             
             # 创建API客户端
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_obj.credentials_file,
-                scopes=['https://www.googleapis.com/auth/cloud-platform']
-            )
+            from services.token_manager import get_credentials
+            credentials = get_credentials(service_account_obj.credentials_file, service_account_obj.name)
             api_client = GoogleAPIClient(credentials, service_account_obj.name)
             
             try:
@@ -0,0 +1,309 @@
+# services/bulk_ops.py - 项目和账单账户的批量操作
+#
+# 退役服务账号时需要对数百个项目解除权限、删除记录。批量任务在一个后台任务中
+# 并发执行（BULK_CONCURRENCY），所有线程共用该服务账号的凭据和 QPS 限速器，
+# 逐项结果通过 JobProgress 增量写回，操作日志攒批写入，数据库变更最后批量提交；
+# 删除记录的结果在批量删除提交后才记录。单个任务的数量上限见 BULK_MAX_ITEMS。
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from models import ServiceAccount, Project, BillingAccount
+from services import tracing
+from services.billing_service import (
+    CONFIG, GoogleAPIClient, create_db_session, log_operations,
+    remove_billing_admin_permission_v1, remove_project_admin_permission_v3, update_project_billing_info_v1
+)
+
+PROJECT_ACTIONS = ('unbind', 'remove_admin', 'delete_record', 'retire')
+BILLING_ACTIONS = ('remove_admin', 'delete_record')
+
+# 操作日志攒够这么多条写入一次
+AUDIT_BATCH_SIZE = 200
+
+class _OperationBuffer:
+    """线程安全的操作日志缓冲区"""
+
+    def __init__(self, service_account_id: int):
+        self.service_account_id = service_account_id
+        self._operations: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, operation_type: str, status: str, message: str, project_id: Optional[str] = None,
+            billing_account_id: Optional[str] = None, old_value: Optional[str] = None, new_value: Optional[str] = None):
+        # 字段保持一致，批量插入时所有行使用同一条 INSERT 语句
+        operation = {
+            'operation_type': operation_type,
+            'service_account_id': self.service_account_id,
+            'project_id': project_id,
+            'billing_account_id': billing_account_id,
+            'old_value': old_value,
+            'new_value': new_value,
+            'status': status,
+            'message': message
+        }
+        with self._lock:
+            self._operations.append(operation)
+            if len(self._operations) < AUDIT_BATCH_SIZE:
+                return
+            batch, self._operations = self._operations, []
+        log_operations(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._operations = self._operations, []
+        log_operations(batch)
+
+def select_project_ids(service_account_id: int, project_ids: Optional[List[str]], filters: Optional[Dict[str, Any]]) -> List[str]:
+    """按 ID 列表或过滤条件选出服务账号下的项目"""
+    query = Project.query.with_entities(Project.project_id).filter(Project.service_account_id == service_account_id)
+    if project_ids is not None:
+        query = query.filter(Project.project_id.in_(project_ids))
+    else:
+        filters = filters or {}
+        if filters.get('billing_account_id'):
+            query = query.filter(Project.billing_account_id == filters['billing_account_id'])
+        if filters.get('unbound'):
+            query = query.filter(Project.billing_account_id.is_(None))
+        elif filters.get('unbound') is False:
+            query = query.filter(Project.billing_account_id.isnot(None))
+    return sorted({row[0] for row in query.all()})
+
+def select_billing_ids(service_account_id: int, billing_ids: Optional[List[str]], filters: Optional[Dict[str, Any]]) -> List[str]:
+    """按 ID 列表或过滤条件选出服务账号下的账单账户"""
+    query = BillingAccount.query.with_entities(BillingAccount.account_id).filter(
+        BillingAccount.service_account_id == service_account_id
+    )
+    if billing_ids is not None:
+        query = query.filter(BillingAccount.account_id.in_(billing_ids))
+    else:
+        filters = filters or {}
+        if filters.get('is_open') is not None:
+            query = query.filter(BillingAccount.is_open == bool(filters['is_open']))
+        if filters.get('is_used') is not None:
+            query = query.filter(BillingAccount.is_used == bool(filters['is_used']))
+    return sorted({row[0] for row in query.all()})
+
+def _run_concurrently(items: List[str], func: Callable[[str], None]):
+    # 工作线程中写数据库（操作日志攒批写入等）需要应用上下文
+    app = current_app._get_current_object()
+
+    def run(item: str):
+        with app.app_context():
+            func(item)
+    run = tracing.wrap(run)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(CONFIG.bulk_concurrency, len(items))), thread_name_prefix='bulk') as executor:
+        list(executor.map(run, items))
+
+def _load_service_account(service_account_id: int) -> Optional[Dict[str, str]]:
+    with create_db_session() as session:
+        sa_obj = session.get(ServiceAccount, service_account_id)
+        if sa_obj is None:
+            return None
+        return {'name': sa_obj.name, 'email': sa_obj.email, 'credentials_file': sa_obj.credentials_file}
+
+def _client_factory(service_account: Dict[str, str]):
+    """每个线程一个 API 客户端；凭据和 QPS 限速器按服务账号共享"""
+    from services.token_manager import get_credentials
+
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def get_client() -> GoogleAPIClient:
+        if not hasattr(local, 'client'):
+            credentials = get_credentials(service_account['credentials_file'], service_account['name'])
+            local.client = GoogleAPIClient(credentials, service_account['name'])
+            with clients_lock:
+                clients.append(local.client)
+        return local.client
+
+    def close_all():
+        for client in clients:
+            client.close()
+
+    return get_client, close_all
+
+def run_bulk_project_action(progress, service_account_id: int, action: str, project_ids: List[str]) -> Tuple[bool, str]:
+    """批量执行项目操作: unbind / remove_admin / delete_record / retire(解除权限后删除记录)"""
+    service_account = _load_service_account(service_account_id)
+    if service_account is None:
+        return False, "找不到指定的服务账号"
+
+    with create_db_session() as session:
+        bindings = {
+            project_id: (billing_account_id, billing_account_name)
+            for project_id, billing_account_id, billing_account_name in session.query(
+                Project.project_id, Project.billing_account_id, Project.billing_account_name
+            ).filter(Project.service_account_id == service_account_id, Project.project_id.in_(project_ids)).all()
+        }
+
+    buffer = _OperationBuffer(service_account_id)
+    get_client, close_all = _client_factory(service_account)
+    unbound: List[str] = []
+    # 待删除记录的项目及删除成功后记录的结果消息
+    deletable: Dict[str, str] = {}
+    results_lock = threading.Lock()
+
+    if action == 'delete_record':
+        # 与单个删除相同: 按 IAM 清单判断，未扫描的项目退回检查解除权限的操作记录
+        from services.iam_inventory import released_projects
+        released = released_projects(service_account_id, project_ids)
+
+    def process(project_id: str):
+        if project_id not in bindings:
+            progress.record(project_id, False, "找不到指定的项目")
+            return
+
+        if action == 'unbind':
+            billing_account_id, billing_account_name = bindings[project_id]
+            if not billing_account_id:
+                progress.record(project_id, True, "项目已经没有关联账单")
+                return
+            try:
+                update_project_billing_info_v1(get_client(), project_id, '')
+                with results_lock:
+                    unbound.append(project_id)
+                buffer.add(
+                    operation_type='unbind', project_id=project_id, billing_account_id=billing_account_id,
+                    old_value=billing_account_name, new_value='None', status='success', message="批量解绑项目账单"
+                )
+                progress.record(project_id, True, "成功解绑项目账单")
+            except Exception as e:
+                buffer.add(
+                    operation_type='unbind', project_id=project_id, billing_account_id=billing_account_id,
+                    old_value=billing_account_name, new_value='None', status='failed', message=str(e)
+                )
+                progress.record(project_id, False, f"解绑项目账单失败: {e}")
+            return
+
+        if action == 'delete_record':
+            if project_id not in released:
+                progress.record(project_id, False, "删除前必须先解除服务账号对该项目的管理员权限")
+                return
+            with results_lock:
+                deletable[project_id] = "项目记录已删除"
+            return
+
+        # remove_admin / retire
+        try:
+            success = remove_project_admin_permission_v3(get_client(), project_id, service_account['email'])
+            message = f"{'成功' if success else '失败'}解除项目Admin权限"
+        except Exception as e:
+            success, message = False, str(e)
+        buffer.add(
+            operation_type='remove_project_permission', project_id=project_id, old_value="project.admin",
+            new_value="removed" if success else "failed", status='success' if success else 'failed',
+            message=f"批量{message}"
+        )
+        if success and action == 'retire':
+            with results_lock:
+                deletable[project_id] = "成功解除项目Admin权限并删除记录"
+            return
+        progress.record(project_id, success, message)
+
+    try:
+        _run_concurrently(project_ids, process)
+    finally:
+        close_all()
+
+    # 数据库变更批量提交
+    try:
+        with create_db_session() as session:
+            if unbound:
+                session.query(Project).filter(
+                    Project.service_account_id == service_account_id,
+                    Project.project_id.in_(unbound)
+                ).update({
+                    'billing_account_id': None,
+                    'billing_account_name': 'None',
+                    'billing_account_display_name': 'None'
+                }, synchronize_session=False)
+            if deletable:
+                session.query(Project).filter(
+                    Project.service_account_id == service_account_id,
+                    Project.project_id.in_(list(deletable))
+                ).delete(synchronize_session=False)
+    except Exception as e:
+        logging.error(f"批量项目操作 {action} 提交数据库变更失败: {e}")
+        for project_id in deletable:
+            progress.record(project_id, False, f"删除项目记录失败: {e}")
+    else:
+        for project_id, message in deletable.items():
+            buffer.add(operation_type='delete_project', project_id=project_id, status='success', message='批量从系统中删除项目记录')
+            progress.record(project_id, True, message)
+    buffer.flush()
+
+    logging.info(
+        f"批量项目操作 {action} 完成: 服务账号 {service_account['name']}, "
+        f"成功 {progress.completed} 个, 失败 {progress.failed} 个"
+    )
+    return progress.failed == 0, f"{len(project_ids)} 个项目: 成功 {progress.completed} 个, 失败 {progress.failed} 个"
+
+def run_bulk_billing_action(progress, service_account_id: int, action: str, billing_ids: List[str]) -> Tuple[bool, str]:
+    """批量执行账单账户操作: remove_admin / delete_record"""
+    service_account = _load_service_account(service_account_id)
+    if service_account is None:
+        return False, "找不到指定的服务账号"
+
+    buffer = _OperationBuffer(service_account_id)
+
+    if action == 'delete_record':
+        # 纯数据库操作，不需要并发
+        with create_db_session() as session:
+            in_use = {
+                row[0] for row in session.query(Project.billing_account_id).filter(
+                    Project.service_account_id == service_account_id,
+                    Project.billing_account_id.in_(billing_ids)
+                ).distinct().all()
+            }
+            existing = {
+                row[0] for row in session.query(BillingAccount.account_id).filter(
+                    BillingAccount.service_account_id == service_account_id,
+                    BillingAccount.account_id.in_(billing_ids)
+                ).all()
+            }
+            deletable = [billing_id for billing_id in billing_ids if billing_id in existing and billing_id not in in_use]
+            if deletable:
+                session.query(BillingAccount).filter(
+                    BillingAccount.service_account_id == service_account_id,
+                    BillingAccount.account_id.in_(deletable)
+                ).delete(synchronize_session=False)
+
+        for billing_id in billing_ids:
+            if billing_id not in existing:
+                progress.record(billing_id, False, "未找到对应的账单记录")
+            elif billing_id in in_use:
+                progress.record(billing_id, False, "有项目正在使用此账单，无法删除")
+            else:
+                buffer.add(operation_type='delete_billing', billing_account_id=billing_id, status='success', message='批量从系统中删除账单记录')
+                progress.record(billing_id, True, "账单记录已成功删除")
+        buffer.flush()
+        return progress.failed == 0, f"{len(billing_ids)} 个账单: 成功 {progress.completed} 个, 失败 {progress.failed} 个"
+
+    get_client, close_all = _client_factory(service_account)
+
+    def process(billing_id: str):
+        try:
+            success = remove_billing_admin_permission_v1(get_client(), f"billingAccounts/{billing_id}", service_account['email'])
+            message = f"{'成功' if success else '失败'}解除Billing Admin权限"
+        except Exception as e:
+            success, message = False, str(e)
+        buffer.add(
+            operation_type='remove_permission', billing_account_id=billing_id, old_value="billing.admin",
+            new_value="removed" if success else "failed", status='success' if success else 'failed',
+            message=f"批量{message}"
+        )
+        progress.record(billing_id, success, message)
+
+    try:
+        _run_concurrently(billing_ids, process)
+    finally:
+        close_all()
+    buffer.flush()
+
+    return progress.failed == 0, f"{len(billing_ids)} 个账单: 成功 {progress.completed} 个, 失败 {progress.failed} 个"
@@ -0,0 +1,312 @@
+# services/coordination.py - 多副本同步进程之间的服务账号分片
+#
+# 基于现有 MySQL 的租约表实现:
+#   - 每个同步进程定期写 worker_heartbeats 心跳
+#   - 每轮开始时按存活进程列表做 rendezvous hash，算出本进程应负责的服务账号
+#   - 通过条件 UPDATE 获取 account_leases 租约，租约过期前由心跳线程续约
+#   - 进程退出或心跳超时后，其租约过期，由其他进程在下一轮接管
+#   - 全局单例任务（数据保留、清理已完成的请求）只由持有 leader_leases 租约的进程执行，
+#     易主时 epoch 加一，任务在每个事务中按 epoch 校验租约（fencing）
+import atexit
+import hashlib
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.orm import Session
+
+from models import AccountLease, LeaderLease, WorkerHeartbeat
+from services.billing_service import CONFIG, create_db_session
+
+# 单例任务共用的 leader 租约
+LEADER_LEASE = 'singleton-jobs'
+
+class LeadershipLost(Exception):
+    """单例任务执行期间 leader 租约已过期或被其他进程接管"""
+
+def _rendezvous_score(worker_id: str, account_name: str) -> int:
+    digest = hashlib.md5(f"{worker_id}:{account_name}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def assign_owner(account_name: str, worker_ids: List[str]) -> Optional[str]:
+    """rendezvous hash - 进程增减时只有少量服务账号需要迁移"""
+    if not worker_ids:
+        return None
+    return max(worker_ids, key=lambda worker_id: _rendezvous_score(worker_id, account_name))
+
+class AccountCoordinator:
+    """服务账号租约协调器"""
+
+    def __init__(self, app, worker_id: str, lease_ttl: int, heartbeat_interval: int):
+        self.app = app
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.owned: Set[str] = set()
+        self.leader_epoch: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """写入首次心跳并启动心跳/续约线程"""
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run, name='account-coordinator', daemon=True)
+        self._thread.start()
+        logging.info(f"服务账号协调器已启动: worker_id={self.worker_id}")
+
+    def stop(self):
+        """停止心跳并释放全部租约，让其他进程立即接管"""
+        self._stop_event.set()
+        try:
+            with self.app.app_context():
+                with create_db_session() as session:
+                    session.query(AccountLease).filter(
+                        AccountLease.owner_id == self.worker_id
+                    ).update({'owner_id': None, 'expires_at': datetime.utcnow()}, synchronize_session=False)
+                    session.query(LeaderLease).filter(
+                        LeaderLease.name == LEADER_LEASE,
+                        LeaderLease.owner_id == self.worker_id
+                    ).update({'owner_id': None, 'expires_at': datetime.utcnow()}, synchronize_session=False)
+                    session.query(WorkerHeartbeat).filter(
+                        WorkerHeartbeat.worker_id == self.worker_id
+                    ).delete(synchronize_session=False)
+            with self._lock:
+                self.owned.clear()
+                self.leader_epoch = None
+            logging.info(f"已释放 worker {self.worker_id} 的全部租约")
+        except Exception as e:
+            logging.error(f"释放租约失败: {e}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logging.error(f"写入心跳失败: {e}")
+
+    def heartbeat(self):
+        """写入心跳并为当前持有的租约续期"""
+        now = datetime.utcnow()
+        with self.app.app_context():
+            with create_db_session() as session:
+                worker = session.get(WorkerHeartbeat, self.worker_id)
+                if worker is None:
+                    session.add(WorkerHeartbeat(
+                        worker_id=self.worker_id,
+                        hostname=socket.gethostname(),
+                        started_at=now,
+                        heartbeat_at=now
+                    ))
+                else:
+                    worker.heartbeat_at = now
+
+                with self._lock:
+                    owned = list(self.owned)
+                if owned:
+                    renewed = session.query(AccountLease).filter(
+                        AccountLease.account_name.in_(owned),
+                        AccountLease.owner_id == self.worker_id
+                    ).update({'expires_at': now + timedelta(seconds=self.lease_ttl)}, synchronize_session=False)
+                    if renewed != len(owned):
+                        logging.warning(f"部分租约续期失败 ({renewed}/{len(owned)})，将在下一轮重新分配")
+
+                with self._lock:
+                    epoch = self.leader_epoch
+                if epoch is not None:
+                    renewed = session.query(LeaderLease).filter(
+                        LeaderLease.name == LEADER_LEASE,
+                        LeaderLease.owner_id == self.worker_id,
+                        LeaderLease.epoch == epoch
+                    ).update({'expires_at': now + timedelta(seconds=self.lease_ttl)}, synchronize_session=False)
+                    if not renewed:
+                        logging.warning(f"leader 租约 (epoch {epoch}) 已被其他进程接管")
+                        with self._lock:
+                            self.leader_epoch = None
+
+    def live_workers(self) -> List[str]:
+        """心跳未超时的同步进程列表（始终包含自身）"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease_ttl)
+        with self.app.app_context():
+            with create_db_session() as session:
+                worker_ids = [row[0] for row in session.query(WorkerHeartbeat.worker_id).filter(
+                    WorkerHeartbeat.heartbeat_at >= cutoff
+                ).all()]
+        if self.worker_id not in worker_ids:
+            worker_ids.append(self.worker_id)
+        return sorted(worker_ids)
+
+    def _try_acquire(self, session, account_name: str, now: datetime) -> bool:
+        expires_at = now + timedelta(seconds=self.lease_ttl)
+        acquired = session.query(AccountLease).filter(
+            AccountLease.account_name == account_name,
+            (AccountLease.owner_id == self.worker_id) |
+            (AccountLease.owner_id.is_(None)) |
+            (AccountLease.expires_at < now)
+        ).update({
+            'owner_id': self.worker_id,
+            'expires_at': expires_at,
+            'acquired_at': now
+        }, synchronize_session=False)
+        if acquired:
+            return True
+
+        if session.get(AccountLease, account_name) is not None:
+            return False
+
+        # 租约行不存在时插入，并发插入时主键冲突的一方失败
+        try:
+            with session.begin_nested():
+                session.add(AccountLease(
+                    account_name=account_name,
+                    owner_id=self.worker_id,
+                    expires_at=expires_at,
+                    acquired_at=now
+                ))
+            return True
+        except sa_exc.IntegrityError:
+            return False
+
+    def rebalance(self, account_names: List[str]) -> Set[str]:
+        """按存活进程重新计算分片，获取应负责的租约并释放不再负责的租约"""
+        live_workers = self.live_workers()
+        desired = {name for name in account_names if assign_owner(name, live_workers) == self.worker_id}
+
+        now = datetime.utcnow()
+        owned = set()
+        with self.app.app_context():
+            with create_db_session() as session:
+                for account_name in sorted(desired):
+                    if self._try_acquire(session, account_name, now):
+                        owned.add(account_name)
+
+                with self._lock:
+                    released = self.owned - desired
+                if released:
+                    session.query(AccountLease).filter(
+                        AccountLease.account_name.in_(released),
+                        AccountLease.owner_id == self.worker_id
+                    ).update({'owner_id': None, 'expires_at': now}, synchronize_session=False)
+
+        with self._lock:
+            self.owned = owned
+
+        waiting = desired - owned
+        logging.info(
+            f"服务账号分片: 存活进程 {len(live_workers)} 个, 本进程负责 {len(owned)} 个账号"
+            + (f", 等待租约过期 {len(waiting)} 个" if waiting else "")
+            + (f", 释放 {len(released)} 个" if released else "")
+        )
+        return owned
+
+    def owned_accounts(self, gcp_accounts: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """返回本进程本轮应处理的服务账号"""
+        owned = self.rebalance([account['name'] for account in gcp_accounts])
+        return [account for account in gcp_accounts if account['name'] in owned]
+
+    def acquire_leadership(self) -> Optional[int]:
+        """获取或续期 leader 租约，返回 fencing epoch；其他进程持有未过期的租约时返回 None"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_ttl)
+        with self._lock:
+            current_epoch = self.leader_epoch
+
+        epoch = None
+        with self.app.app_context():
+            with create_db_session() as session:
+                lease = session.query(LeaderLease).filter(LeaderLease.name == LEADER_LEASE).with_for_update().first()
+                if lease is None:
+                    # 租约行不存在时插入，并发插入时主键冲突的一方失败
+                    try:
+                        with session.begin_nested():
+                            session.add(LeaderLease(
+                                name=LEADER_LEASE, owner_id=self.worker_id, epoch=1, expires_at=expires_at, acquired_at=now
+                            ))
+                        epoch = 1
+                    except sa_exc.IntegrityError:
+                        epoch = None
+                elif lease.owner_id == self.worker_id and lease.epoch == current_epoch and lease.expires_at >= now:
+                    lease.expires_at = expires_at
+                    epoch = lease.epoch
+                elif lease.owner_id is None or lease.owner_id == self.worker_id or lease.expires_at < now:
+                    # 易主（包括本进程的租约已过期后重新获取）: epoch 加一，使之前持有的 epoch 失效
+                    lease.owner_id = self.worker_id
+                    lease.epoch += 1
+                    lease.expires_at = expires_at
+                    lease.acquired_at = now
+                    epoch = lease.epoch
+
+        with self._lock:
+            self.leader_epoch = epoch
+        if epoch is not None and epoch != current_epoch:
+            logging.info(f"本进程成为 leader: worker_id={self.worker_id}, epoch={epoch}")
+        return epoch
+
+    def check_fence(self, session: Session, epoch: int):
+        """在单例任务的事务中确认 leader 租约仍以该 epoch 由本进程持有，否则抛出 LeadershipLost
+        
+        租约行加锁到事务结束，其他进程接管租约的更新会等本事务完成。
+        """
+        held = session.query(LeaderLease.name).filter(
+            LeaderLease.name == LEADER_LEASE,
+            LeaderLease.owner_id == self.worker_id,
+            LeaderLease.epoch == epoch,
+            LeaderLease.expires_at >= datetime.utcnow()
+        ).with_for_update().first()
+        if held is None:
+            raise LeadershipLost(f"leader 租约 (epoch {epoch}) 已失效")
+
+    def owns(self, account_name: str) -> bool:
+        """本进程当前是否持有该服务账号的租约"""
+        with self._lock:
+            return account_name in self.owned
+
+# 全局协调器实例
+_coordinator: Optional[AccountCoordinator] = None
+
+def init_coordinator(app) -> Optional[AccountCoordinator]:
+    """根据配置创建并启动协调器，未启用多副本协调时返回 None"""
+    global _coordinator
+
+    if not CONFIG.coordination_enabled:
+        return None
+
+    if _coordinator is None:
+        worker_id = CONFIG.worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        _coordinator = AccountCoordinator(
+            app,
+            worker_id=worker_id,
+            lease_ttl=CONFIG.lease_ttl,
+            heartbeat_interval=CONFIG.heartbeat_interval
+        )
+        _coordinator.start()
+        atexit.register(shutdown_coordinator)
+    return _coordinator
+
+def get_coordinator() -> Optional[AccountCoordinator]:
+    """获取全局协调器，未启用时返回 None"""
+    return _coordinator
+
+def shutdown_coordinator():
+    """进程退出前释放租约"""
+    if _coordinator is not None:
+        _coordinator.stop()
+
+def leader_fence() -> Tuple[bool, Optional[Callable[[Session], None]]]:
+    """单例任务入口: 返回 (本进程是否应执行, fence)
+
+    未启用多副本协调时直接执行，fence 为 None；启用时只有持有 leader 租约的进程执行，
+    任务在每个写事务开始时调用 fence(session) 校验租约。
+    """
+    if _coordinator is None:
+        return True, None
+
+    epoch = _coordinator.acquire_leadership()
+    if epoch is None:
+        return False, None
+    return True, lambda session: _coordinator.check_fence(session, epoch)
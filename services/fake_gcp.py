@@ -0,0 +1,626 @@
+# services/fake_gcp.py - 本地 Google API 替身（Resource Manager / Cloud Billing / IAM）
+#
+# 用于离线测试和压测同步引擎，不依赖真实的 Google 项目:
+#
+#   python -m services.fake_gcp --port 8099 --accounts 2 --projects 5000 --credentials-dir data/fake_credentials
+#
+# 然后以如下配置启动 Web / 同步进程:
+#
+#   GCP_API_ENDPOINT=http://127.0.0.1:8099 GCP_CREDENTIALS_DIR=data/fake_credentials \
+#   GCP_ACCOUNT_NAMES=fake-sa-000,fake-sa-001 DATABASE_URL=sqlite:///data/fake.db
+#
+# 生成的凭据文件是格式完整的服务账号密钥，token_uri 指向本服务: /token 不校验签名，
+# 按 JWT 的 iss（服务账号邮箱）签发令牌，之后每个请求按令牌识别服务账号。
+# 服务账号能看到的项目和账单账户由 IAM 策略决定（任一绑定中包含该服务账号）。
+#
+# 模拟的接口与本项目使用的一致:
+#   GET  v3/projects:search, v1/projects                     项目列表
+#   GET  v1/billingAccounts, v1/billingAccounts/{id}          账单账户
+#   GET  v1/billingAccounts/{id}/projects                     账单账户下的项目
+#   GET  v1/projects/{id}/billingInfo, PUT 同一路径             项目账单信息
+#   POST v3/projects/{id}:getIamPolicy / :setIamPolicy        项目 IAM 策略（带 etag）
+#   GET/POST v1/billingAccounts/{id}:getIamPolicy, POST :setIamPolicy
+#
+# 管理接口（不需要令牌）:
+#   GET  /_fake/stats                 按方法、服务账号统计的调用次数和注入的错误
+#   GET  /_fake/state                 汇总状态（见 FakeGcpState.snapshot）
+#   POST /_fake/reset-stats           清空调用统计
+#   POST /_fake/config                修改延迟、错误注入和配额（字段见 FakeGcpConfig）
+#   POST /_fake/seed                  重新生成数据（参数见 FakeGcpState.seed）
+#   POST /_fake/close-billing         关闭账单账户: {"billing_accounts": [...]} 或 {"fraction": 0.5}
+import argparse
+import base64
+import bisect
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+SERVICE_ACCOUNT_DOMAIN = 'fake-project.iam.gserviceaccount.com'
+TOKEN_PREFIX = 'fake-token:'
+TOKEN_LIFETIME = 3600
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# 错误状态码对应的 google.rpc.Code 名称
+_STATUS_NAMES = {
+    400: 'INVALID_ARGUMENT',
+    401: 'UNAUTHENTICATED',
+    403: 'PERMISSION_DENIED',
+    404: 'NOT_FOUND',
+    409: 'ABORTED',
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE'
+}
+
+def service_account_email(name: str) -> str:
+    return f"{name}@{SERVICE_ACCOUNT_DOMAIN}"
+
+class FakeApiError(Exception):
+    """返回给客户端的 Google 格式错误"""
+
+    def __init__(self, code: int, message: str, status: Optional[str] = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status or _STATUS_NAMES.get(code, 'UNKNOWN')
+
+    def payload(self) -> Dict[str, Any]:
+        return {'error': {'code': self.code, 'message': self.message, 'status': self.status}}
+
+@dataclass
+class FakeGcpConfig:
+    """延迟、错误注入和配额（运行中可通过 /_fake/config 修改）"""
+    latency: float = 0.0  # 每个请求的固定延迟（秒）
+    latency_jitter: float = 0.0  # 额外的随机延迟上限（秒）
+    error_rate_429: float = 0.0  # 随机返回 429 的比例
+    error_rate_5xx: float = 0.0  # 随机返回 500/503 的比例
+    qps_per_account: int = 0  # 每个服务账号每秒的请求上限，超出返回 429，0 表示不限
+    daily_quota_per_account: int = 0  # 每个服务账号的请求总数上限，超出返回 429，0 表示不限
+
+    def update(self, values: Dict[str, Any]):
+        for field in fields(self):
+            if field.name in values:
+                setattr(self, field.name, field.type(values[field.name]))
+
+class FakeGcpState:
+    """项目、账单账户和 IAM 策略的内存状态，所有修改在一把锁内完成"""
+
+    def __init__(self, config: Optional[FakeGcpConfig] = None):
+        self.config = config or FakeGcpConfig()
+        self.lock = threading.RLock()
+        self.projects: Dict[str, Dict[str, Any]] = {}
+        self.billing_accounts: Dict[str, Dict[str, Any]] = {}
+        # 服务账号邮箱 -> 可见的项目 / 账单账户 ID（有序，用于分页）
+        self.visible_projects: Dict[str, List[str]] = {}
+        self.visible_billing: Dict[str, List[str]] = {}
+        self.accounts: List[str] = []
+        self.calls: Counter = Counter()
+        self.account_calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self._second_calls: Dict[str, Tuple[int, int]] = {}
+        self._etag_counter = 0
+        self._random = random.Random(0)
+
+    # ---------- 数据生成 ----------
+
+    def seed(self, accounts: int = 1, projects: int = 100, billing_accounts: int = 5, bound_ratio: float = 0.8,
+             closed_ratio: float = 0.0, max_projects_per_billing: int = 3, extra_members: int = 1, seed: int = 0):
+        """按服务账号生成数据
+
+        每个服务账号: projects 个项目（roles/owner）和 billing_accounts 个账单账户（roles/billing.admin），
+        bound_ratio 的项目绑定到本账号的账单账户（每个账户最多 max_projects_per_billing 个），
+        closed_ratio 的账单账户为关闭状态（绑定在上面的项目需要换绑）。
+        """
+        rng = random.Random(seed)
+        with self.lock:
+            self._random = random.Random(seed + 1)
+            self.projects.clear()
+            self.billing_accounts.clear()
+            self.visible_projects.clear()
+            self.visible_billing.clear()
+            self.accounts = [f"fake-sa-{index:03d}" for index in range(accounts)]
+            number = 100000000000
+            for account_index, name in enumerate(self.accounts):
+                member = f"serviceAccount:{service_account_email(name)}"
+                others = [f"user:admin{index}@example.com" for index in range(extra_members)]
+
+                billing_ids = []
+                for index in range(billing_accounts):
+                    billing_id = f"{account_index:06X}-{index:06X}-{rng.getrandbits(24):06X}"
+                    self.billing_accounts[billing_id] = {
+                        'display_name': f"{name} billing {index}",
+                        'open': rng.random() >= closed_ratio,
+                        'policy': self._new_policy([{'role': 'roles/billing.admin', 'members': [member] + others}])
+                    }
+                    billing_ids.append(billing_id)
+
+                capacity = {billing_id: max_projects_per_billing for billing_id in billing_ids}
+                for index in range(projects):
+                    project_id = f"{name}-p{index:05d}"
+                    billing_id = ''
+                    if rng.random() < bound_ratio:
+                        # 关闭的账户上也有绑定，模拟需要换绑的项目
+                        candidates = [bid for bid in billing_ids if capacity[bid] > 0]
+                        if candidates:
+                            billing_id = rng.choice(candidates)
+                            capacity[billing_id] -= 1
+                    number += 1
+                    self.projects[project_id] = {
+                        'number': str(number),
+                        'billing_account': billing_id,
+                        'policy': self._new_policy([{'role': 'roles/owner', 'members': [member] + others}])
+                    }
+            self._rebuild_visibility()
+        logging.info(
+            f"Fake GCP 数据已生成: {len(self.accounts)} 个服务账号, {len(self.projects)} 个项目, "
+            f"{len(self.billing_accounts)} 个账单账户"
+        )
+
+    def _new_policy(self, bindings: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {'version': 1, 'bindings': bindings, 'etag': self._next_etag()}
+
+    def _next_etag(self) -> str:
+        self._etag_counter += 1
+        return base64.b64encode(f"etag-{self._etag_counter}".encode()).decode()
+
+    def _rebuild_visibility(self):
+        self.visible_projects = {service_account_email(name): [] for name in self.accounts}
+        self.visible_billing = {service_account_email(name): [] for name in self.accounts}
+        for project_id in sorted(self.projects):
+            for email in _policy_service_accounts(self.projects[project_id]['policy']):
+                self.visible_projects.setdefault(email, []).append(project_id)
+        for billing_id in sorted(self.billing_accounts):
+            for email in _policy_service_accounts(self.billing_accounts[billing_id]['policy']):
+                self.visible_billing.setdefault(email, []).append(billing_id)
+
+    def close_billing_accounts(self, billing_ids: Optional[List[str]] = None, fraction: float = 0.0) -> List[str]:
+        """关闭指定的账单账户，或按比例随机关闭开启中的账户，返回关闭的 ID"""
+        with self.lock:
+            if billing_ids is None:
+                open_ids = sorted(bid for bid, account in self.billing_accounts.items() if account['open'])
+                billing_ids = self._random.sample(open_ids, int(len(open_ids) * fraction))
+            closed = [bid for bid in billing_ids if bid in self.billing_accounts]
+            for billing_id in closed:
+                self.billing_accounts[billing_id]['open'] = False
+        return closed
+
+    def snapshot(self) -> Dict[str, Any]:
+        """汇总状态（压测结束后核对换绑结果）"""
+        with self.lock:
+            closed = {bid for bid, account in self.billing_accounts.items() if not account['open']}
+            bound = [project['billing_account'] for project in self.projects.values() if project['billing_account']]
+            return {
+                'projects': len(self.projects),
+                'billing_accounts': len(self.billing_accounts),
+                'closed_billing_accounts': len(closed),
+                'bound_projects': len(bound),
+                'projects_on_closed_billing': sum(1 for bid in bound if bid in closed)
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'account_calls': dict(self.account_calls),
+                'total_calls': sum(self.calls.values()),
+                'injected_errors': dict(self.injected),
+                'config': asdict(self.config),
+                'state': self.snapshot()
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.account_calls.clear()
+            self.injected.clear()
+
+    # ---------- 请求处理 ----------
+
+    def issue_token(self, form: Dict[str, List[str]]) -> Dict[str, Any]:
+        """OAuth2 JWT bearer 授权: 不校验签名，按 iss 签发令牌"""
+        assertion = (form.get('assertion') or [''])[0]
+        try:
+            payload = assertion.split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        except (IndexError, ValueError):
+            raise FakeApiError(400, 'invalid assertion', 'invalid_grant')
+        return {'access_token': TOKEN_PREFIX + claims['iss'], 'expires_in': TOKEN_LIFETIME, 'token_type': 'Bearer'}
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: Dict[str, Any],
+               authorization: str) -> Dict[str, Any]:
+        """处理一个 API 请求，返回响应体；错误通过 FakeApiError 抛出"""
+        token = authorization[7:] if authorization.startswith('Bearer ') else ''
+        if not token.startswith(TOKEN_PREFIX):
+            raise FakeApiError(401, 'Request had invalid authentication credentials.')
+        email = token[len(TOKEN_PREFIX):]
+
+        route, handler, params = self._route(method, path)
+        with self.lock:
+            self.calls[route] += 1
+            self.account_calls[email] += 1
+            self._check_quota(email, route)
+
+        config = self.config
+        if config.latency or config.latency_jitter:
+            time.sleep(config.latency + self._random.random() * config.latency_jitter)
+        roll = self._random.random()
+        if roll < config.error_rate_429:
+            self._inject(route, 429)
+        if roll < config.error_rate_429 + config.error_rate_5xx:
+            self._inject(route, self._random.choice((500, 503)))
+
+        with self.lock:
+            return handler(email, query, body, *params)
+
+    def _inject(self, route: str, code: int):
+        with self.lock:
+            self.injected[f"{route}:{code}"] += 1
+        raise FakeApiError(code, 'Injected error')
+
+    def _check_quota(self, email: str, route: str):
+        config = self.config
+        if config.daily_quota_per_account and self.account_calls[email] > config.daily_quota_per_account:
+            self.injected[f"{route}:quota"] += 1
+            raise FakeApiError(429, "Quota exceeded for quota metric 'Requests' and limit 'Requests per day'")
+        if config.qps_per_account:
+            second = int(time.time())
+            current, count = self._second_calls.get(email, (second, 0))
+            count = count + 1 if current == second else 1
+            self._second_calls[email] = (second, count)
+            if count > config.qps_per_account:
+                self.injected[f"{route}:qps"] += 1
+                raise FakeApiError(429, "Quota exceeded for quota metric 'Requests' and limit 'Requests per minute'")
+
+    _ROUTES = [
+        ('GET', re.compile(r'^/v3/projects:search$'), 'projects.search', '_search_projects'),
+        ('GET', re.compile(r'^/v1/projects$'), 'projects.list', '_list_projects_v1'),
+        ('GET', re.compile(r'^/v1/billingAccounts$'), 'billingAccounts.list', '_list_billing_accounts'),
+        ('GET', re.compile(r'^/v1/billingAccounts/([^/:]+)$'), 'billingAccounts.get', '_get_billing_account'),
+        ('GET', re.compile(r'^/v1/billingAccounts/([^/:]+)/projects$'), 'billingAccounts.projects.list', '_list_billing_projects'),
+        ('GET', re.compile(r'^/v1/projects/([^/:]+)/billingInfo$'), 'projects.getBillingInfo', '_get_billing_info'),
+        ('PUT', re.compile(r'^/v1/projects/([^/:]+)/billingInfo$'), 'projects.updateBillingInfo', '_update_billing_info'),
+        ('POST', re.compile(r'^/v3/projects/([^/:]+):getIamPolicy$'), 'projects.getIamPolicy', '_get_project_policy'),
+        ('POST', re.compile(r'^/v3/projects/([^/:]+):setIamPolicy$'), 'projects.setIamPolicy', '_set_project_policy'),
+        ('GET', re.compile(r'^/v1/billingAccounts/([^/:]+):getIamPolicy$'), 'billingAccounts.getIamPolicy', '_get_billing_policy'),
+        ('POST', re.compile(r'^/v1/billingAccounts/([^/:]+):getIamPolicy$'), 'billingAccounts.getIamPolicy', '_get_billing_policy'),
+        ('POST', re.compile(r'^/v1/billingAccounts/([^/:]+):setIamPolicy$'), 'billingAccounts.setIamPolicy', '_set_billing_policy'),
+    ]
+
+    def _route(self, method: str, path: str):
+        for route_method, pattern, name, handler in self._ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                return name, getattr(self, handler), match.groups()
+        raise FakeApiError(404, f"Method not found: {method} {path}")
+
+    # ---------- 项目 ----------
+
+    def _project_or_403(self, email: str, project_id: str) -> Dict[str, Any]:
+        project = self.projects.get(project_id)
+        if project is None or email not in _policy_service_accounts(project['policy']):
+            # 与真实 API 一致: 不存在和无权限都返回 403
+            raise FakeApiError(403, f"The caller does not have permission on projects/{project_id}")
+        return project
+
+    def _page(self, items: List[str], query: Dict[str, List[str]]) -> Tuple[List[str], Optional[str]]:
+        page_size = min(MAX_PAGE_SIZE, int((query.get('pageSize') or [DEFAULT_PAGE_SIZE])[0]) or DEFAULT_PAGE_SIZE)
+        offset = int((query.get('pageToken') or ['0'])[0] or 0)
+        page = items[offset:offset + page_size]
+        return page, str(offset + page_size) if offset + page_size < len(items) else None
+
+    def _search_projects(self, email, query, body):
+        page, next_token = self._page(self.visible_projects.get(email, []), query)
+        response = {'projects': [
+            {
+                'name': f"projects/{self.projects[project_id]['number']}",
+                'projectId': project_id,
+                'displayName': project_id,
+                'state': 'ACTIVE'
+            }
+            for project_id in page
+        ]}
+        if next_token:
+            response['nextPageToken'] = next_token
+        return response
+
+    def _list_projects_v1(self, email, query, body):
+        page, next_token = self._page(self.visible_projects.get(email, []), query)
+        response = {'projects': [
+            {'projectNumber': self.projects[project_id]['number'], 'projectId': project_id, 'lifecycleState': 'ACTIVE'}
+            for project_id in page
+        ]}
+        if next_token:
+            response['nextPageToken'] = next_token
+        return response
+
+    def _billing_info(self, project_id: str) -> Dict[str, Any]:
+        billing_id = self.projects[project_id]['billing_account']
+        return {
+            'name': f"projects/{project_id}/billingInfo",
+            'projectId': project_id,
+            'billingAccountName': f"billingAccounts/{billing_id}" if billing_id else '',
+            'billingEnabled': bool(billing_id) and self.billing_accounts[billing_id]['open']
+        }
+
+    def _get_billing_info(self, email, query, body, project_id):
+        self._project_or_403(email, project_id)
+        return self._billing_info(project_id)
+
+    def _update_billing_info(self, email, query, body, project_id):
+        project = self._project_or_403(email, project_id)
+        billing_name = body.get('billingAccountName') or ''
+        billing_id = billing_name.split('/', 1)[1] if billing_name.startswith('billingAccounts/') else billing_name
+        if billing_id:
+            account = self.billing_accounts.get(billing_id)
+            if account is None or email not in _policy_service_accounts(account['policy']):
+                raise FakeApiError(403, f"The caller does not have permission on billingAccounts/{billing_id}")
+            if not account['open']:
+                raise FakeApiError(400, f"Billing account billingAccounts/{billing_id} is closed", 'FAILED_PRECONDITION')
+        project['billing_account'] = billing_id
+        return self._billing_info(project_id)
+
+    # ---------- 账单账户 ----------
+
+    def _billing_or_403(self, email: str, billing_id: str) -> Dict[str, Any]:
+        account = self.billing_accounts.get(billing_id)
+        if account is None or email not in _policy_service_accounts(account['policy']):
+            raise FakeApiError(403, f"The caller does not have permission on billingAccounts/{billing_id}")
+        return account
+
+    def _billing_payload(self, billing_id: str) -> Dict[str, Any]:
+        account = self.billing_accounts[billing_id]
+        return {
+            'name': f"billingAccounts/{billing_id}",
+            'open': account['open'],
+            'displayName': account['display_name'],
+            'masterBillingAccount': ''
+        }
+
+    def _list_billing_accounts(self, email, query, body):
+        page, next_token = self._page(self.visible_billing.get(email, []), query)
+        response = {'billingAccounts': [self._billing_payload(billing_id) for billing_id in page]}
+        if next_token:
+            response['nextPageToken'] = next_token
+        return response
+
+    def _get_billing_account(self, email, query, body, billing_id):
+        self._billing_or_403(email, billing_id)
+        return self._billing_payload(billing_id)
+
+    def _list_billing_projects(self, email, query, body, billing_id):
+        self._billing_or_403(email, billing_id)
+        project_ids = sorted(pid for pid, project in self.projects.items() if project['billing_account'] == billing_id)
+        page, next_token = self._page(project_ids, query)
+        response = {'projectBillingInfo': [self._billing_info(project_id) for project_id in page]}
+        if next_token:
+            response['nextPageToken'] = next_token
+        return response
+
+    # ---------- IAM ----------
+
+    def _get_project_policy(self, email, query, body, project_id):
+        return dict(self._project_or_403(email, project_id)['policy'])
+
+    def _set_project_policy(self, email, query, body, project_id):
+        project = self._project_or_403(email, project_id)
+        project['policy'] = self._replace_policy(project['policy'], body, f"projects/{project_id}")
+        _update_visibility(self.visible_projects, project_id, project['policy'])
+        return dict(project['policy'])
+
+    def _get_billing_policy(self, email, query, body, billing_id):
+        return dict(self._billing_or_403(email, billing_id)['policy'])
+
+    def _set_billing_policy(self, email, query, body, billing_id):
+        account = self._billing_or_403(email, billing_id)
+        account['policy'] = self._replace_policy(account['policy'], body, f"billingAccounts/{billing_id}")
+        _update_visibility(self.visible_billing, billing_id, account['policy'])
+        return dict(account['policy'])
+
+    def _replace_policy(self, current: Dict[str, Any], body: Dict[str, Any], resource: str) -> Dict[str, Any]:
+        policy = body.get('policy') or {}
+        if policy.get('etag') and policy['etag'] != current['etag']:
+            raise FakeApiError(409, f"There were concurrent policy changes for {resource}. Please retry the whole read-modify-write with exponential backoff.")
+        return {
+            'version': policy.get('version', current.get('version', 1)),
+            'bindings': [binding for binding in policy.get('bindings', []) if binding.get('members')],
+            'etag': self._next_etag()
+        }
+
+def _policy_service_accounts(policy: Dict[str, Any]) -> set:
+    return {
+        member.split(':', 1)[1]
+        for binding in policy.get('bindings', [])
+        for member in binding.get('members', [])
+        if member.startswith('serviceAccount:')
+    }
+
+def _update_visibility(visible: Dict[str, List[str]], resource_id: str, policy: Dict[str, Any]):
+    """策略变化后更新服务账号可见的资源列表"""
+    members = _policy_service_accounts(policy)
+    for email, resource_ids in visible.items():
+        index = bisect.bisect_left(resource_ids, resource_id)
+        present = index < len(resource_ids) and resource_ids[index] == resource_id
+        if present and email not in members:
+            del resource_ids[index]
+        elif not present and email in members:
+            resource_ids.insert(index, resource_id)
+    for email in members - visible.keys():
+        visible[email] = [resource_id]
+
+# ==================== HTTP 服务 ====================
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeGCP/1.0'
+    # 响应头和响应体分两次写出，保持连接时 Nagle + 延迟确认会让每个请求多等约 40ms
+    disable_nagle_algorithm = True
+    state: FakeGcpState
+
+    def log_message(self, format, *args):
+        logging.debug(f"fake-gcp {self.address_string()} {format % args}")
+
+    def _send(self, code: int, payload: Dict[str, Any]):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self, method: str):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        query = parse_qs(parts.query)
+        try:
+            if parts.path == '/token':
+                self._send(200, self.state.issue_token(parse_qs(raw_body.decode('utf-8'))))
+            elif parts.path.startswith('/_fake/'):
+                self._send(200, self._admin(method, parts.path, json.loads(raw_body or b'{}')))
+            else:
+                body = json.loads(raw_body) if raw_body else {}
+                self._send(200, self.state.handle(method, parts.path, query, body, self.headers.get('Authorization', '')))
+        except FakeApiError as e:
+            self._send(e.code, e.payload())
+        except ValueError as e:
+            self._send(400, FakeApiError(400, f"Invalid request: {e}").payload())
+        except Exception as e:
+            logging.exception("fake-gcp 请求处理失败")
+            self._send(500, FakeApiError(500, str(e)).payload())
+
+    def _admin(self, method: str, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        if path == '/_fake/stats' and method == 'GET':
+            return self.state.stats()
+        if path == '/_fake/state' and method == 'GET':
+            return self.state.snapshot()
+        if path == '/_fake/reset-stats' and method == 'POST':
+            self.state.reset_stats()
+            return {}
+        if path == '/_fake/config' and method == 'POST':
+            self.state.config.update(body)
+            return asdict(self.state.config)
+        if path == '/_fake/seed' and method == 'POST':
+            self.state.seed(**body)
+            return self.state.snapshot()
+        if path == '/_fake/close-billing' and method == 'POST':
+            return {'closed': self.state.close_billing_accounts(body.get('billing_accounts'), float(body.get('fraction', 0)))}
+        raise FakeApiError(404, f"Unknown admin endpoint: {method} {path}")
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+class FakeGcpServer:
+    """在后台线程中运行的替身服务（测试和压测在进程内使用）"""
+
+    def __init__(self, state: Optional[FakeGcpState] = None, host: str = '127.0.0.1', port: int = 0):
+        self.state = state or FakeGcpState()
+        handler = type('FakeGcpHandler', (_Handler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeGcpServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-gcp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def write_credentials(self, directory: str) -> List[Dict[str, str]]:
+        """为每个服务账号写入指向本服务的密钥文件，返回 GCP_ACCOUNTS 格式的列表"""
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        # 本服务不校验签名，所有服务账号共用一把密钥
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode('ascii')
+        os.makedirs(directory, exist_ok=True)
+        accounts = []
+        for index, name in enumerate(self.state.accounts):
+            path = os.path.join(directory, f"{name}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'type': 'service_account',
+                    'project_id': 'fake-project',
+                    'private_key_id': f"fake-key-{index}",
+                    'private_key': private_key,
+                    'client_email': service_account_email(name),
+                    'client_id': str(100000 + index),
+                    'token_uri': f"{self.url}/token"
+                }, f, indent=2)
+            accounts.append({'name': name, 'credentials_file': path})
+        return accounts
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 Google API 替身（Resource Manager / Cloud Billing / IAM）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--accounts', type=int, default=1, help='服务账号数')
+    parser.add_argument('--projects', type=int, default=100, help='每个服务账号的项目数')
+    parser.add_argument('--billing-accounts', type=int, default=5, help='每个服务账号的账单账户数')
+    parser.add_argument('--bound-ratio', type=float, default=0.8)
+    parser.add_argument('--closed-ratio', type=float, default=0.0)
+    parser.add_argument('--max-projects-per-billing', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--credentials-dir', default='data/fake_credentials')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate-5xx', type=float, default=0.0)
+    parser.add_argument('--qps-per-account', type=int, default=0)
+    parser.add_argument('--daily-quota-per-account', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = FakeGcpConfig(
+        latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate_429=args.error_rate_429, error_rate_5xx=args.error_rate_5xx,
+        qps_per_account=args.qps_per_account, daily_quota_per_account=args.daily_quota_per_account
+    )
+    state = FakeGcpState(config)
+    state.seed(
+        accounts=args.accounts, projects=args.projects, billing_accounts=args.billing_accounts,
+        bound_ratio=args.bound_ratio, closed_ratio=args.closed_ratio,
+        max_projects_per_billing=args.max_projects_per_billing, seed=args.seed
+    )
+    server = FakeGcpServer(state, args.host, args.port)
+    accounts = server.write_credentials(args.credentials_dir)
+    logging.info(f"Fake GCP 已启动: {server.url}")
+    logging.info(
+        f"GCP_API_ENDPOINT={server.url} GCP_CREDENTIALS_DIR={args.credentials_dir} "
+        f"GCP_ACCOUNT_NAMES={','.join(account['name'] for account in accounts)}"
+    )
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# services/http_transport.py - 所有 Google API 调用共享的 HTTP 连接池
+#
+# googleapiclient 默认给每个服务对象创建独立的 httplib2.Http，既不是线程安全的，
+# 也会在 GoogleAPIClient 重建时丢弃已建立的 TLS 连接。这里提供一个进程级共享的
+# 连接池（requests/urllib3，安装 httpx[http2] 时可启用 HTTP/2），并用
+# AuthorizedPooledHttp 包装成 httplib2 兼容接口，按服务账号附加授权头。
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import google.auth.transport.requests
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+except ImportError:  # 未安装 httpx 时只使用 HTTP/1.1 连接池
+    httpx = None
+
+class PooledResponse(dict):
+    """httplib2.Response 兼容对象 - 小写响应头字典，带 status/reason 属性"""
+
+    def __init__(self, status: int, reason: str, headers):
+        super().__init__((key.lower(), value) for key, value in headers.items())
+        self.status = status
+        self.reason = reason
+        self['status'] = str(status)
+
+class _CountingAdapter(HTTPAdapter):
+    """统计新建 TCP/TLS 连接数的 HTTPAdapter"""
+
+    def __init__(self, *args, **kwargs):
+        self.connections_opened = 0
+        self._count_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _on_new_connection(self):
+        with self._count_lock:
+            self.connections_opened += 1
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                adapter._on_new_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                adapter._on_new_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+class SharedTransport:
+    """线程安全的共享 HTTP 连接池，保持 keep-alive 复用连接"""
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, timeout: float, http2: bool = False):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.requests_sent = 0
+        self.errors = 0
+
+        # 刷新令牌等辅助请求始终走 requests 会话
+        self.session = requests.Session()
+        adapter = _CountingAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._adapter = adapter
+        # google-auth 的 Request 在析构时会关闭传入的 session，只能创建一个并长期持有
+        self._auth_request = google.auth.transport.requests.Request(session=self.session)
+
+        self.http2 = bool(http2 and httpx is not None)
+        self._httpx_client = None
+        if http2 and httpx is None:
+            logging.warning("未安装 httpx[http2]，Google API 调用使用 HTTP/1.1 连接池")
+        if self.http2:
+            self._httpx_client = httpx.Client(
+                http2=True,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=pool_connections * pool_maxsize,
+                    max_keepalive_connections=pool_connections * pool_maxsize
+                )
+            )
+
+    def request(self, uri: str, method: str = 'GET', body=None, headers: Optional[Dict[str, str]] = None) -> Tuple[PooledResponse, bytes]:
+        """发送请求，返回 httplib2 风格的 (response, content)"""
+        with self.lock:
+            self.requests_sent += 1
+        try:
+            if self._httpx_client is not None:
+                response = self._httpx_client.request(method, uri, content=body, headers=headers)
+                return PooledResponse(response.status_code, response.reason_phrase, response.headers), response.content
+
+            response = self.session.request(method, uri, data=body, headers=headers, timeout=self.timeout)
+            return PooledResponse(response.status_code, response.reason, response.headers), response.content
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+
+    def refresh_request(self):
+        """google-auth 刷新令牌使用的请求对象，复用同一个连接池"""
+        return self._auth_request
+
+    def stats(self) -> Dict[str, Any]:
+        """连接复用统计: 新建连接数越接近请求数，说明复用越差（HTTP/2 模式下只统计辅助请求的连接）"""
+        with self.lock:
+            stats = {
+                'requests': self.requests_sent,
+                'errors': self.errors,
+                'http2': self.http2,
+                'connections_opened': self._adapter.connections_opened,
+                'hosts': len(self._adapter.poolmanager.pools)
+            }
+        if stats['requests'] and not self.http2:
+            stats['connection_reuse_ratio'] = round(1 - stats['connections_opened'] / stats['requests'], 4)
+        return stats
+
+    def close(self):
+        self.session.close()
+        if self._httpx_client is not None:
+            self._httpx_client.close()
+
+class AuthorizedPooledHttp:
+    """httplib2.Http 兼容的授权包装 - 每个服务账号一个，底层共享连接池"""
+
+    def __init__(self, transport: SharedTransport, credentials):
+        self.transport = transport
+        self.credentials = credentials
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        request_headers = dict(headers or {})
+        self.credentials.before_request(self.transport.refresh_request(), method, uri, request_headers)
+
+        response, content = self.transport.request(uri, method, body=body, headers=request_headers)
+
+        # 令牌被提前吊销或过期时刷新一次后重试
+        if response.status == 401:
+            self.credentials.refresh(self.transport.refresh_request())
+            request_headers = dict(headers or {})
+            self.credentials.apply(request_headers)
+            response, content = self.transport.request(uri, method, body=body, headers=request_headers)
+
+        return response, content
+
+    def close(self):
+        """共享连接池不随单个服务对象关闭"""
+        pass
+
+# 进程级共享连接池
+_transport: Optional[SharedTransport] = None
+_transport_lock = threading.Lock()
+
+def get_shared_transport() -> SharedTransport:
+    """获取进程级共享连接池，首次调用时按配置创建"""
+    global _transport
+    from services.billing_service import CONFIG
+
+    with _transport_lock:
+        if _transport is None:
+            _transport = SharedTransport(
+                pool_connections=CONFIG.http_pool_connections,
+                pool_maxsize=CONFIG.http_pool_maxsize,
+                timeout=CONFIG.http_timeout,
+                http2=CONFIG.http2_enabled
+            )
+        return _transport
+
+def get_transport_stats() -> Optional[Dict[str, Any]]:
+    """共享连接池统计，尚未创建时返回 None"""
+    return _transport.stats() if _transport is not None else None
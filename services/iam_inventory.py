@@ -0,0 +1,315 @@
+# services/iam_inventory.py - 服务账号管理员权限清单
+#
+# 后台线程用独立的只读限速器（IAM_SCAN_QPS）逐个读取项目和账单账户的 IAM 策略，
+# 把已登记的服务账号在其上的管理员角色写入 iam_admin_grants（每个服务账号/资源一行），
+# 策略 etag 记录在 iam_policy_snapshots。资源超过 IAM_SCAN_MAX_AGE 未扫描时重新读取，
+# etag 未变化时只更新扫描时间。通过 IamPolicyManager 成功移除权限后会立即更新清单。
+# 扫描属于低优先级任务，服务账号的 API 调用量接近预算时推迟（见 services/quota.py）。
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+from sqlalchemy import String, func, literal, or_
+
+from models import ServiceAccount, Project, BillingAccount, BillingOperation, IamPolicySnapshot, IamAdminGrant
+from services import quota
+from services.billing_service import (
+    BILLING_ADMIN_ROLES, CONFIG, PROJECT_ADMIN_ROLES, GoogleAPIClient, create_db_session,
+    get_iam_manager, get_read_rate_limiter
+)
+
+ADMIN_ROLES = {
+    'project': PROJECT_ADMIN_ROLES,
+    'billing_account': BILLING_ADMIN_ROLES
+}
+
+# 扫描结果攒够这么多条写入一次数据库
+WRITE_BATCH_SIZE = 50
+
+def resource_type_of(resource: str) -> str:
+    return 'project' if resource.startswith('projects/') else 'billing_account'
+
+def _member_ids(session) -> Tuple[Dict[str, int], Optional[datetime]]:
+    """已登记服务账号的 IAM 成员名 → ID，以及最近一次登记时间"""
+    rows = session.query(ServiceAccount.id, ServiceAccount.email, ServiceAccount.created_at).all()
+    members = {f"serviceAccount:{email}": account_id for account_id, email, _ in rows}
+    newest = max((created_at for _, _, created_at in rows if created_at), default=None)
+    return members, newest
+
+def admin_grants(policy: Dict[str, Any], resource_type: str, member_ids: Dict[str, int]) -> Dict[int, List[str]]:
+    """从策略中找出已登记服务账号持有的管理员角色"""
+    admin_roles = ADMIN_ROLES[resource_type]
+    grants: Dict[int, List[str]] = {}
+    for binding in policy.get('bindings', []):
+        role = binding.get('role')
+        if role not in admin_roles:
+            continue
+        for member in binding.get('members', []):
+            account_id = member_ids.get(member)
+            if account_id is not None and role not in grants.setdefault(account_id, []):
+                grants[account_id].append(role)
+    return grants
+
+def record_policy(session, resource: str, policy: Dict[str, Any], member_ids: Dict[str, int],
+                  accounts_since: Optional[datetime] = None) -> bool:
+    """写入资源策略对应的管理员清单，返回清单是否被重写（etag 未变化时只更新扫描时间）"""
+    now = datetime.utcnow()
+    resource_type = resource_type_of(resource)
+    etag = policy.get('etag')
+    snapshot = session.query(IamPolicySnapshot).filter_by(resource=resource).first()
+
+    # 上次扫描之后新登记的服务账号需要按当前策略重新匹配
+    if (snapshot is not None and snapshot.error is None and etag and snapshot.etag == etag
+            and (accounts_since is None or snapshot.scanned_at >= accounts_since)):
+        snapshot.scanned_at = now
+        return False
+
+    if snapshot is None:
+        snapshot = IamPolicySnapshot(resource=resource, resource_type=resource_type)
+        session.add(snapshot)
+    snapshot.etag = etag
+    snapshot.error = None
+    snapshot.scanned_at = now
+
+    session.query(IamAdminGrant).filter(IamAdminGrant.resource == resource).delete(synchronize_session=False)
+    for account_id, roles in admin_grants(policy, resource_type, member_ids).items():
+        session.add(IamAdminGrant(
+            service_account_id=account_id,
+            resource=resource,
+            resource_type=resource_type,
+            roles=','.join(roles),
+            updated_at=now
+        ))
+    return True
+
+def record_scan_error(session, resource: str, service_account_id: Optional[int], error: str):
+    """扫描失败: 无权读取策略说明该服务账号已不是管理员，只删除它自己的清单记录（未指定时删除全部）"""
+    snapshot = session.query(IamPolicySnapshot).filter_by(resource=resource).first()
+    if snapshot is None:
+        snapshot = IamPolicySnapshot(resource=resource, resource_type=resource_type_of(resource))
+        session.add(snapshot)
+    snapshot.error = error[:300]
+    snapshot.scanned_at = datetime.utcnow()
+    query = session.query(IamAdminGrant).filter(IamAdminGrant.resource == resource)
+    if service_account_id is not None:
+        query = query.filter(IamAdminGrant.service_account_id == service_account_id)
+    query.delete(synchronize_session=False)
+
+def forget_resource(session, resource: str):
+    """资源已不存在: 清除所有服务账号的清单记录，保留快照以免每轮重复扫描"""
+    record_scan_error(session, resource, None, '404: not found')
+
+def _due_resources(session, service_account_id: int, limit: int) -> List[str]:
+    """服务账号可见、从未扫描或超过 IAM_SCAN_MAX_AGE 未扫描的资源，最久未扫描的优先"""
+    cutoff = datetime.utcnow() - timedelta(seconds=CONFIG.iam_scan_max_age)
+    project_resource = literal('projects/', String) + Project.project_id
+    sources = [
+        (project_resource, Project, Project.service_account_id),
+        (BillingAccount.name, BillingAccount, BillingAccount.service_account_id)
+    ]
+    due = []
+    for resource_expr, model, owner_column in sources:
+        rows = session.query(resource_expr, IamPolicySnapshot.scanned_at).select_from(model).outerjoin(
+            IamPolicySnapshot, IamPolicySnapshot.resource == resource_expr
+        ).filter(
+            owner_column == service_account_id,
+            or_(IamPolicySnapshot.id.is_(None), IamPolicySnapshot.scanned_at < cutoff)
+        ).order_by(IamPolicySnapshot.scanned_at).limit(limit).all()
+        due.extend(rows)
+    due.sort(key=lambda row: row[1] or datetime.min)
+    return [row[0] for row in due[:limit]]
+
+def scan_account(app, gcp_account: Dict[str, str], claimed: set, claimed_lock: threading.Lock) -> Tuple[int, int]:
+    """扫描单个服务账号可见的到期资源，返回 (扫描数, 清单变化数)"""
+    scanned = changed = 0
+    api_client = None
+    # 清单扫描是低优先级任务，调用量接近预算时推迟到下一轮
+    if not quota.allows(gcp_account['name'], quota.PRIORITY_LOW):
+        logging.info(f"服务账号 {gcp_account['name']} 的 API 调用量接近预算，推迟 IAM 清单扫描")
+        return 0, 0
+    with app.app_context():
+        try:
+            with create_db_session() as session:
+                sa_obj = session.query(ServiceAccount).filter_by(name=gcp_account['name']).first()
+                if sa_obj is None:
+                    return 0, 0
+                service_account_id = sa_obj.id
+                resources = _due_resources(session, service_account_id, CONFIG.iam_scan_batch)
+            if not resources:
+                return 0, 0
+
+            from services.token_manager import get_credentials
+            credentials = get_credentials(gcp_account['credentials_file'], gcp_account['name'])
+            api_client = GoogleAPIClient(credentials, gcp_account['name'], get_read_rate_limiter(gcp_account['name']))
+            manager = get_iam_manager()
+
+            results: List[Tuple[str, Optional[Dict[str, Any]], Optional[HttpError]]] = []
+            for resource in resources:
+                if not quota.allows(gcp_account['name'], quota.PRIORITY_LOW):
+                    logging.info(f"服务账号 {gcp_account['name']} 的 API 调用量接近预算，剩余资源下轮再扫描")
+                    break
+                # 多个服务账号可见的账单账户本轮只扫描一次
+                with claimed_lock:
+                    if resource in claimed:
+                        continue
+                    claimed.add(resource)
+                try:
+                    results.append((resource, manager.fetch_policy(api_client, resource), None))
+                except HttpError as e:
+                    if e.resp.status in (403, 404):
+                        results.append((resource, None, e))
+                    else:
+                        logging.warning(f"读取 {resource} 的 IAM 策略失败，下轮重试: {e}")
+                if len(results) >= WRITE_BATCH_SIZE:
+                    changed += _write_results(service_account_id, results)
+                    scanned += len(results)
+                    results = []
+            changed += _write_results(service_account_id, results)
+            scanned += len(results)
+        except Exception as e:
+            logging.error(f"扫描服务账号 {gcp_account['name']} 的 IAM 清单失败: {e}", exc_info=True)
+        finally:
+            if api_client:
+                api_client.close()
+    return scanned, changed
+
+def _write_results(service_account_id: int, results: List[Tuple[str, Optional[Dict[str, Any]], Optional[HttpError]]]) -> int:
+    if not results:
+        return 0
+    changed = 0
+    with create_db_session() as session:
+        member_ids, accounts_since = _member_ids(session)
+        for resource, policy, error in results:
+            if policy is not None:
+                changed += record_policy(session, resource, policy, member_ids, accounts_since)
+            elif error.resp.status == 404:
+                forget_resource(session, resource)
+                changed += 1
+            else:
+                record_scan_error(session, resource, service_account_id, f"{error.resp.status}: {error.reason}")
+                changed += 1
+    return changed
+
+def scan_once(app, gcp_accounts: List[Dict[str, str]]) -> Tuple[int, int]:
+    """执行一轮清单扫描，返回 (扫描数, 清单变化数)"""
+    claimed: set = set()
+    claimed_lock = threading.Lock()
+    max_workers = min(CONFIG.max_workers, max(1, len(gcp_accounts)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='iam-scan') as executor:
+        results = list(executor.map(lambda account: scan_account(app, account, claimed, claimed_lock), gcp_accounts))
+    return sum(result[0] for result in results), sum(result[1] for result in results)
+
+def run_iam_scan_loop(app):
+    """清单扫描循环，多副本部署时只扫描本进程持有租约的服务账号"""
+    from services.coordination import get_coordinator
+
+    while True:
+        start_time = time.time()
+        try:
+            gcp_accounts = [account for account in app.config['GCP_ACCOUNTS'] if account.get('name')]
+            coordinator = get_coordinator()
+            if coordinator is not None:
+                gcp_accounts = [account for account in gcp_accounts if coordinator.owns(account['name'])]
+
+            if gcp_accounts:
+                scanned, changed = scan_once(app, gcp_accounts)
+                if scanned:
+                    logging.info(f"IAM 清单扫描完成: 扫描 {scanned} 个资源, 更新 {changed} 个, 耗时 {time.time() - start_time:.2f} 秒")
+        except Exception as e:
+            logging.error(f"IAM 清单扫描失败: {e}", exc_info=True)
+
+        time.sleep(max(1, CONFIG.iam_scan_interval - (time.time() - start_time)))
+
+_scan_thread: Optional[threading.Thread] = None
+
+def start_iam_scan_thread(app) -> Optional[threading.Thread]:
+    """启动清单扫描线程，未启用时返回 None"""
+    global _scan_thread
+
+    if not CONFIG.iam_scan_enabled:
+        return None
+
+    if _scan_thread is None:
+        _scan_thread = threading.Thread(target=run_iam_scan_loop, args=(app,), name='iam-scan', daemon=True)
+        _scan_thread.start()
+        logging.info(f"IAM 清单扫描已启动: 每 {CONFIG.iam_scan_interval} 秒检查一次，限速 {CONFIG.iam_scan_qps} QPS")
+    return _scan_thread
+
+def init_iam_inventory(app):
+    """IamPolicyManager 写入或确认策略后同步更新清单"""
+    def on_policy_change(resource: str, policy: Dict[str, Any]):
+        with app.app_context():
+            with create_db_session() as session:
+                member_ids, _ = _member_ids(session)
+                record_policy(session, resource, policy, member_ids)
+
+    get_iam_manager().add_listener(on_policy_change)
+
+def admin_resources(service_account_id: int, resource_type: Optional[str] = None) -> Dict[str, Any]:
+    """服务账号仍持有管理员角色的资源（需在应用上下文中调用）"""
+    query = IamAdminGrant.query.filter(IamAdminGrant.service_account_id == service_account_id)
+    if resource_type:
+        query = query.filter(IamAdminGrant.resource_type == resource_type)
+    grants = [grant.to_dict() for grant in query.order_by(IamAdminGrant.resource_type, IamAdminGrant.resource).all()]
+
+    scanned_at = {
+        resource: value
+        for resource, value in IamPolicySnapshot.query.with_entities(
+            IamPolicySnapshot.resource, IamPolicySnapshot.scanned_at
+        ).filter(IamPolicySnapshot.resource.in_([grant['resource'] for grant in grants])).all()
+    } if grants else {}
+    for grant in grants:
+        grant['scanned_at'] = scanned_at[grant['resource']].isoformat() if scanned_at.get(grant['resource']) else None
+
+    oldest = IamPolicySnapshot.query.with_entities(func.min(IamPolicySnapshot.scanned_at)).scalar()
+    return {
+        'resources': grants,
+        'total': len(grants),
+        'oldest_scan': oldest.isoformat() if oldest else None
+    }
+
+def released_projects(service_account_id: int, project_ids: List[str]) -> set:
+    """服务账号已不再是管理员的项目（删除项目记录的前置条件，需在应用上下文中调用）
+
+    优先按清单判断；项目尚未扫描或扫描出错时，退回检查 IAM_SCAN_MAX_AGE 内
+    最近一次解除权限操作是否成功（更早的记录可能已被重新授权，等待清单扫描）。
+    """
+    if not project_ids:
+        return set()
+    resources = {f'projects/{project_id}': project_id for project_id in project_ids}
+    scanned = {
+        resource for resource, error in IamPolicySnapshot.query.with_entities(
+            IamPolicySnapshot.resource, IamPolicySnapshot.error
+        ).filter(IamPolicySnapshot.resource.in_(list(resources))).all()
+        if not error
+    }
+    granted = {
+        row[0] for row in IamAdminGrant.query.with_entities(IamAdminGrant.resource).filter(
+            IamAdminGrant.service_account_id == service_account_id,
+            IamAdminGrant.resource.in_(list(resources))
+        ).all()
+    }
+    released = {resources[resource] for resource in scanned if resource not in granted}
+
+    # 清单中有管理员记录的项目即使未完成扫描也视为仍有权限
+    unknown = [
+        project_id for resource, project_id in resources.items()
+        if resource not in scanned and resource not in granted
+    ]
+    if unknown:
+        latest = {}
+        for project_id, status in BillingOperation.query.with_entities(
+            BillingOperation.project_id, BillingOperation.status
+        ).filter(
+            BillingOperation.operation_type == 'remove_project_permission',
+            BillingOperation.service_account_id == service_account_id,
+            BillingOperation.project_id.in_(unknown),
+            BillingOperation.created_at >= datetime.utcnow() - timedelta(seconds=CONFIG.iam_scan_max_age)
+        ).order_by(BillingOperation.created_at, BillingOperation.id).all():
+            latest[project_id] = status
+        released.update(project_id for project_id, status in latest.items() if status == 'success')
+    return released
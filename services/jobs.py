@@ -0,0 +1,241 @@
+# services/jobs.py - 手动操作的异步任务执行器
+#
+# 解绑账单、解除权限等手动操作会调用 Google API，并在重试中等待最长 max_retry_delay，
+# 直接在请求线程中执行会长时间占用 Web 线程。这里把它们提交到 Web 进程内的线程池，
+# 立即返回任务 ID；任务状态写入 jobs 表，多个 gunicorn 进程都能查询。
+# 同一资源上排队或执行中的任务会被复用，重复点击不会重复调用 Google API；
+# jobs.active_key 的唯一索引保证多个 gunicorn 进程同时提交时也只有一个活动任务。
+# 执行进程每 HEARTBEAT_INTERVAL 秒刷新本进程排队和执行中任务的 heartbeat_at，
+# 超过 task_timeout 未刷新的活动任务才视为执行进程已退出（长时间运行的批量任务不会被误判）。
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import exc as sa_exc, func
+
+from models import Job
+from services import tracing
+from services.billing_service import CONFIG, create_db_session
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# 批量任务进度写回数据库的最短间隔（秒）
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+# 刷新本进程活动任务 heartbeat_at 的间隔（秒）
+HEARTBEAT_INTERVAL = 30
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# 本进程已提交、尚未结束的任务 ID
+_local_jobs: Set[str] = set()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CONFIG.job_workers, thread_name_prefix='job')
+        return _executor
+
+def _update_job(job_id: str, **values):
+    values.setdefault('heartbeat_at', datetime.utcnow())
+    with create_db_session() as session:
+        session.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+
+def _heartbeat_loop(app):
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with _executor_lock:
+            job_ids = list(_local_jobs)
+        if not job_ids:
+            continue
+        try:
+            with app.app_context():
+                with create_db_session() as session:
+                    session.query(Job).filter(
+                        Job.id.in_(job_ids),
+                        Job.status.in_(ACTIVE_STATUSES)
+                    ).update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+        except Exception as e:
+            logging.error(f"刷新任务心跳失败: {e}")
+
+def _start_heartbeat(app):
+    global _heartbeat_thread
+    with _executor_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, args=(app,), name='job-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+def _stale_before():
+    """心跳早于该时间的活动任务视为执行进程已退出"""
+    return datetime.utcnow() - timedelta(seconds=CONFIG.task_timeout)
+
+class JobProgress:
+    """批量任务的逐项结果，定期写回 jobs 表供前端增量展示"""
+
+    def __init__(self, job_id: str, total: int):
+        self.job_id = job_id
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.items: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, item_id: str, success: bool, message: str):
+        """记录单项结果，距上次写回超过 PROGRESS_FLUSH_INTERVAL 时写回数据库"""
+        with self._lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.items.append({'id': item_id, 'success': success, 'message': message})
+            due = time.monotonic() - self._last_flush >= PROGRESS_FLUSH_INTERVAL
+            if due:
+                self._last_flush = time.monotonic()
+        if due:
+            self.flush()
+
+    def values(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'completed': self.completed,
+                'failed': self.failed,
+                'result': json.dumps(self.items, ensure_ascii=False)
+            }
+
+    def flush(self):
+        _update_job(self.job_id, **self.values())
+
+def _run_job(
+    app,
+    job_id: str,
+    func: Callable[..., Tuple[bool, str]],
+    args: tuple,
+    on_done: Optional[Callable[[], None]],
+    total: Optional[int] = None
+):
+    with app.app_context():
+        _update_job(job_id, status='running', started_at=datetime.utcnow())
+        progress = JobProgress(job_id, total) if total is not None else None
+        try:
+            with tracing.start_trace('job', job_id=job_id, function=func.__name__, total=total):
+                success, message = func(progress, *args) if progress is not None else func(*args)
+        except Exception as e:
+            logging.error(f"任务 {job_id} 执行异常: {e}", exc_info=True)
+            success, message = False, str(e)
+
+        if progress is not None:
+            counts = progress.values()
+        else:
+            counts = {'completed': 1 if success else 0, 'failed': 0 if success else 1}
+        _update_job(
+            job_id,
+            status='succeeded' if success else 'failed',
+            message=message,
+            finished_at=datetime.utcnow(),
+            active_key=None,
+            **counts
+        )
+
+        with _executor_lock:
+            _local_jobs.discard(job_id)
+
+        if on_done is not None:
+            try:
+                on_done()
+            except Exception as e:
+                logging.error(f"任务 {job_id} 完成回调失败: {e}")
+
+def _insert_job(session, job: Job) -> Tuple[Dict[str, Any], bool]:
+    """插入任务，同一资源已有活动任务时返回 (已有任务信息, True)
+
+    活动任务由 active_key 唯一索引判定: 插入冲突时读取（加锁读，读到其他进程刚提交的任务）
+    持有该 key 的任务；它超过 task_timeout 未刷新心跳（执行进程已退出）时标记为失败并释放 key 后重新插入。
+    """
+    cutoff = _stale_before()
+    for _ in range(3):
+        try:
+            with session.begin_nested():
+                session.add(job)
+                session.flush()
+            return job.to_dict(), False
+        except sa_exc.IntegrityError:
+            pass
+
+        existing = session.query(Job).filter(Job.active_key == job.resource_key).with_for_update().first()
+        if existing is None:
+            # 已有任务恰好在此期间结束
+            continue
+        if (existing.heartbeat_at or existing.created_at) >= cutoff:
+            return existing.to_dict(), True
+        session.query(Job).filter(
+            Job.id == existing.id,
+            Job.active_key == job.resource_key,
+            func.coalesce(Job.heartbeat_at, Job.created_at) < cutoff
+        ).update({
+            'status': 'failed',
+            'message': '任务执行超时或执行进程已退出',
+            'finished_at': datetime.utcnow(),
+            'active_key': None
+        }, synchronize_session=False)
+    raise RuntimeError(f"提交任务冲突: {job.resource_key}")
+
+def submit_job(
+    job_type: str,
+    resource_key: str,
+    func: Callable[..., Tuple[bool, str]],
+    args: tuple = (),
+    service_account_id: Optional[int] = None,
+    on_done: Optional[Callable[[], None]] = None,
+    total: Optional[int] = None
+) -> Tuple[Dict[str, Any], bool]:
+    """提交任务，返回 (任务信息, 是否与已有任务合并)；需在应用上下文中调用
+    
+    传入 total 时为批量任务: func 的第一个参数是 JobProgress，用于逐项记录结果。
+    """
+    app = current_app._get_current_object()
+
+    with create_db_session() as session:
+        job_info, coalesced = _insert_job(session, Job(
+            id=uuid.uuid4().hex,
+            job_type=job_type,
+            resource_key=resource_key,
+            active_key=resource_key,
+            service_account_id=service_account_id,
+            status='queued',
+            total=total if total is not None else 1,
+            heartbeat_at=datetime.utcnow()
+        ))
+    if coalesced:
+        return job_info, True
+
+    _start_heartbeat(app)
+    with _executor_lock:
+        _local_jobs.add(job_info['id'])
+    _get_executor().submit(_run_job, app, job_info['id'], func, args, on_done, total)
+    logging.info(f"已提交任务 {job_info['id']}: {job_type} {resource_key}")
+    return job_info, False
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """查询任务状态"""
+    with create_db_session() as session:
+        job = session.get(Job, job_id)
+        if job is None:
+            return None
+        job_info = job.to_dict()
+        stale = (job.heartbeat_at or job.created_at) < _stale_before()
+
+    # 执行任务的进程已退出时，任务会一直停留在排队/执行状态
+    if job_info['status'] in ACTIVE_STATUSES and stale:
+        job_info['status'] = 'failed'
+        job_info['message'] = '任务执行超时或执行进程已退出'
+    return job_info
@@ -0,0 +1,241 @@
+# services/metrics.py - Prometheus 指标
+#
+# Web 进程通过 /metrics 暴露指标，同步进程在 METRICS_PORT 上启动独立的 HTTP 服务。
+# gunicorn 多 worker 时设置 PROMETHEUS_MULTIPROC_DIR 启用多进程模式: 多进程模式不支持回调型 Gauge，
+# 队列深度、借出连接数等 Gauge 由事件发生处主动更新，按存活进程求和 (multiprocess_mode='livesum')。
+# prometheus_client 未安装时所有指标都是空操作，热路径上只多一次方法调用。
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:  # prometheus_client 不可用时指标退化为空操作
+    prometheus_client = None
+
+class _NoopMetric:
+    """prometheus_client 缺失时的替身，接口与带标签/不带标签的指标一致"""
+
+    def labels(self, *args, **kwargs) -> '_NoopMetric':
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+    def observe(self, amount: float):
+        pass
+
+    def set(self, value: float):
+        pass
+
+_NOOP = _NoopMetric()
+
+# Google API 调用、数据库语句的耗时分布（秒）
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 同步阶段、服务账号、整轮的耗时分布（秒）
+SLOW_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# 可跨进程合并的计数器和直方图: 多进程执行模式的同步子进程把增量回传给父进程（见 snapshot / merge）
+_MERGEABLE: Dict[str, object] = {}
+
+def _counter(name: str, documentation: str, labelnames: Sequence[str] = ()):
+    if prometheus_client is None:
+        return _NOOP
+    metric = _MERGEABLE[name] = Counter(name, documentation, labelnames)
+    return metric
+
+def _gauge(name: str, documentation: str, labelnames: Sequence[str] = (), multiprocess_mode: str = 'all'):
+    if prometheus_client is None:
+        return _NOOP
+    return Gauge(name, documentation, labelnames, multiprocess_mode=multiprocess_mode)
+
+def _histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = FAST_BUCKETS):
+    if prometheus_client is None:
+        return _NOOP
+    metric = _MERGEABLE[name] = Histogram(name, documentation, labelnames, buckets=buckets)
+    return metric
+
+# ==================== 同步 ====================
+
+SYNC_CYCLE_SECONDS = _histogram('gcp_billing_sync_cycle_seconds', '一轮全量同步耗时', buckets=SLOW_BUCKETS)
+SYNC_ACCOUNT_SECONDS = _histogram(
+    'gcp_billing_sync_account_seconds', '单个服务账号的同步耗时', ('account', 'result'), buckets=SLOW_BUCKETS
+)
+SYNC_PHASE_SECONDS = _histogram(
+    'gcp_billing_sync_phase_seconds', '服务账号同步各阶段耗时', ('account', 'phase'), buckets=SLOW_BUCKETS
+)
+
+# ==================== Google API ====================
+
+API_REQUEST_SECONDS = _histogram(
+    'gcp_billing_api_request_seconds', 'Google API 单次调用耗时（_count 即调用次数）', ('method', 'status')
+)
+API_RETRIES_TOTAL = _counter('gcp_billing_api_retries_total', 'Google API 重试次数', ('status',))
+API_BACKOFF_SECONDS_TOTAL = _counter('gcp_billing_api_backoff_seconds_total', 'Google API 重试退避等待总时长', ('status',))
+RATE_LIMIT_WAIT_SECONDS = _histogram('gcp_billing_rate_limit_wait_seconds', 'QPS 限速器等待令牌的时间', ('account',))
+RATE_LIMIT_TOKENS = _gauge('gcp_billing_rate_limit_tokens', 'QPS 限速器剩余令牌数', ('account',))
+QUOTA_DEFERRED_TOTAL = _counter(
+    'gcp_billing_quota_deferred_total', '因调用量预算推迟的低优先级任务次数', ('account', 'window')
+)
+
+# ==================== 数据库 ====================
+
+DB_QUERY_SECONDS = _histogram('gcp_billing_db_query_seconds', '数据库语句执行耗时', ('statement',))
+DB_COMMIT_SECONDS = _histogram('gcp_billing_db_commit_seconds', '数据库事务提交耗时')
+DB_POOL_CHECKOUTS_TOTAL = _counter('gcp_billing_db_pool_checkouts_total', '连接池借出次数')
+DB_POOL_CHECKOUT_WAIT_SECONDS = _histogram('gcp_billing_db_pool_checkout_wait_seconds', '从连接池借出连接的等待时间')
+DB_POOL_CHECKED_OUT = _gauge('gcp_billing_db_pool_checked_out', '当前借出的连接数', multiprocess_mode='livesum')
+
+# ==================== 审计日志 / Web ====================
+
+AUDIT_QUEUE_DEPTH = _gauge('gcp_billing_audit_queue_depth', '审计日志写入队列中的记录数', multiprocess_mode='livesum')
+HTTP_REQUEST_SECONDS = _histogram(
+    'gcp_billing_http_request_seconds', 'API 请求处理耗时', ('route', 'method', 'status')
+)
+
+class _PhaseTimer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+def phase(account: str, name: str) -> _PhaseTimer:
+    """记录同步阶段耗时: with phase(account, 'list_projects'): ..."""
+    return _PhaseTimer(SYNC_PHASE_SECONDS.labels(account, name))
+
+def record_retry(status_code, delay: float):
+    """记录一次重试及其退避时间"""
+    status = str(status_code or 'error')
+    API_RETRIES_TOTAL.labels(status).inc()
+    API_BACKOFF_SECONDS_TOTAL.labels(status).inc(delay)
+
+def install_db_instrumentation(engine):
+    """按语句类型记录数据库执行耗时"""
+    if prometheus_client is None:
+        return
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info['metrics_query_start'].pop()
+        verb = statement.lstrip()[:6].upper()
+        DB_QUERY_SECONDS.labels(verb if verb in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') else 'OTHER').observe(
+            time.perf_counter() - start
+        )
+
+    def handle_error(exception_context):
+        starts = exception_context.connection.info.get('metrics_query_start') if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+
+def install_flask_instrumentation(app):
+    """按路由模板记录请求耗时（路由模板基数有限，不会按 ID 产生新标签）"""
+    if prometheus_client is None:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+def init_metrics(app):
+    """为应用注册数据库和请求指标"""
+    from models import db
+
+    with app.app_context():
+        install_db_instrumentation(db.engine)
+    install_flask_instrumentation(app)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """返回 (指标文本, Content-Type)"""
+    if prometheus_client is None:
+        return b'# prometheus_client is not installed\n', 'text/plain; charset=utf-8'
+
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+# ==================== 跨进程合并 ====================
+# prometheus_client 没有合并样本的公开接口，这里直接读写子指标的计数值（_value / _buckets / _sum）
+
+def _children(metric):
+    if metric._labelnames:
+        with metric._lock:
+            return list(metric._metrics.items())
+    return [((), metric)]
+
+def snapshot() -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+    """计数器和直方图的当前值: {(指标名, 标签值): 计数器为 [总数]，直方图为 [各桶计数..., 总和]}"""
+    values = {}
+    for name, metric in _MERGEABLE.items():
+        for labels, child in _children(metric):
+            if isinstance(metric, Counter):
+                values[(name, labels)] = [child._value.get()]
+            else:
+                values[(name, labels)] = [bucket.get() for bucket in child._buckets] + [child._sum.get()]
+    return values
+
+def delta_since(before: Dict[Tuple[str, Tuple[str, ...]], List[float]]) -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+    """与 snapshot() 的结果相比的增量，只包含有变化的序列"""
+    delta = {}
+    for key, current in snapshot().items():
+        previous = before.get(key)
+        changes = [value - old for value, old in zip(current, previous)] if previous else current
+        if any(changes):
+            delta[key] = changes
+    return delta
+
+def merge(delta: Dict[Tuple[str, Tuple[str, ...]], List[float]]):
+    """把其他进程回传的增量累加到本进程的指标"""
+    for (name, labels), changes in delta.items():
+        metric = _MERGEABLE.get(name)
+        if metric is None:
+            continue
+        child = metric.labels(*labels) if labels else metric
+        if isinstance(metric, Counter):
+            child.inc(changes[0])
+        else:
+            for bucket, change in zip(child._buckets, changes[:-1]):
+                bucket.inc(change)
+            child._sum.inc(changes[-1])
+
+def start_metrics_server(port: int) -> Optional[int]:
+    """在独立端口上暴露指标（同步进程没有 Web 服务），返回监听端口"""
+    if prometheus_client is None or not port:
+        return None
+    prometheus_client.start_http_server(port)
+    logging.info(f"指标服务已启动: http://0.0.0.0:{port}/metrics")
+    return port
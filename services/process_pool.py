@@ -0,0 +1,163 @@
+# services/process_pool.py - 多进程执行模式
+#
+# 每个子进程拥有独立的 Flask app、数据库引擎、Google API 客户端和 QPS 限速器，
+# 父进程把服务账号按分片分配给子进程，子进程内部再用线程池处理分片中的账号，
+# 处理结果、耗时、指标增量和 span 回传给父进程汇总。
+# 子进程只初始化数据库引擎和配置（不建表、不启动后台线程）；审计日志同步写入，
+# API 调用量台账在每个分片结束时显式写出（子进程以 os._exit 退出，不会执行 atexit）。
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.billing_service import CONFIG
+
+# 子进程内的 Flask app，由进程池初始化函数创建
+_worker_app = None
+
+# 父进程中的常驻进程池，避免每轮重新启动子进程
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = Lock()
+
+def _init_worker():
+    """子进程初始化: 只创建 app 和数据库引擎"""
+    global _worker_app
+    from app import create_base_app
+    from models import db
+    from services import metrics, tracing
+    from services.billing_service import install_pool_instrumentation
+    from services.iam_inventory import init_iam_inventory
+    from services.quota import bind_quota_ledger
+
+    _worker_app = create_base_app()
+    with _worker_app.app_context():
+        install_pool_instrumentation(db.engine)
+        metrics.install_db_instrumentation(db.engine)
+    init_iam_inventory(_worker_app)
+    bind_quota_ledger(_worker_app)
+    tracing.collect_spans()
+    logging.info(f"同步子进程 {os.getpid()} 初始化完成")
+
+def _process_shard(gcp_accounts: List[Dict[str, str]], trace_context: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+    """在子进程中处理一个分片的服务账号，返回 {'results', 'metrics', 'spans'}"""
+    from services import metrics, tracing
+    from services.billing_service import process_account
+    from services.quota import get_ledger
+
+    def _run(account):
+        start_time = time.time()
+        try:
+            success = process_account(_worker_app, account)
+        except Exception as e:
+            logging.error(f"子进程处理服务账号 {account['name']} 时发生异常: {e}")
+            success = False
+        return {
+            'name': account['name'],
+            'success': bool(success),
+            'duration': time.time() - start_time,
+            'pid': os.getpid()
+        }
+
+    metrics_before = metrics.snapshot()
+    threads = max(1, min(CONFIG.process_threads, len(gcp_accounts)))
+    with tracing.continue_trace(trace_context):
+        run = tracing.wrap(_run)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(run, gcp_accounts))
+
+    try:
+        get_ledger().flush()
+    except Exception as e:
+        logging.error(f"子进程写出 API 调用量台账失败: {e}")
+
+    return {
+        'results': results,
+        'metrics': metrics.delta_since(metrics_before),
+        'spans': tracing.drain_spans()
+    }
+
+def _get_executor(process_count: int) -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: 不继承父进程的数据库连接和后台线程
+            _executor = ProcessPoolExecutor(
+                max_workers=process_count,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        return _executor
+
+def _reset_executor(terminate: bool = False):
+    """丢弃当前进程池，下次使用时重建；terminate 为 True 时同时终止仍在运行的子进程"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            # shutdown 不会中断正在执行的分片，超时的子进程需要显式终止，否则会占用到下一轮
+            processes = list((_executor._processes or {}).values()) if terminate else []
+            _executor.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            _executor = None
+
+def shard_accounts(gcp_accounts: List[Dict[str, str]], shard_count: int) -> List[List[Dict[str, str]]]:
+    """把服务账号轮询分配到 shard_count 个分片"""
+    shards = [gcp_accounts[index::shard_count] for index in range(shard_count)]
+    return [shard for shard in shards if shard]
+
+def run_accounts_in_processes(gcp_accounts: List[Dict[str, str]]) -> Tuple[int, int]:
+    """在进程池中分片处理服务账号，返回 (成功数, 失败数)"""
+    process_count = CONFIG.process_workers or os.cpu_count() or 1
+    shards = shard_accounts(gcp_accounts, min(process_count, len(gcp_accounts)))
+    if not shards:
+        return 0, 0
+
+    from services import metrics, tracing
+
+    executor = _get_executor(process_count)
+    trace_context = tracing.trace_context()
+    future_to_shard = {executor.submit(_process_shard, shard, trace_context): shard for shard in shards}
+
+    success_count = 0
+    failed_count = 0
+    finished = set()
+
+    try:
+        for future in as_completed(future_to_shard, timeout=CONFIG.task_timeout):
+            shard = future_to_shard[future]
+            finished.add(future)
+            try:
+                payload = future.result()
+                metrics.merge(payload['metrics'])
+                tracing.submit_spans(payload['spans'])
+                for result in payload['results']:
+                    if result['success']:
+                        success_count += 1
+                    else:
+                        failed_count += 1
+                    logging.info(
+                        f"子进程 {result['pid']} 处理服务账号 {result['name']} "
+                        f"{'成功' if result['success'] else '失败'}, 耗时 {result['duration']:.2f} 秒"
+                    )
+            except BrokenProcessPool as e:
+                failed_count += len(shard)
+                logging.error(f"同步子进程异常退出，重建进程池: {e}")
+                _reset_executor()
+            except Exception as e:
+                failed_count += len(shard)
+                logging.error(f"处理分片 {[account['name'] for account in shard]} 时发生异常: {e}")
+
+    except TimeoutError:
+        logging.error(f"多进程任务执行超时 ({CONFIG.task_timeout}s)，终止子进程并重建进程池")
+        for future, shard in future_to_shard.items():
+            if future not in finished:
+                failed_count += len(shard)
+        # 被终止的子进程未提交的事务由数据库回滚，持有的 account_locks 处理锁在 task_timeout 后过期
+        _reset_executor(terminate=True)
+
+    return success_count, failed_count
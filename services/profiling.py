@@ -0,0 +1,379 @@
+# services/profiling.py - 按需性能剖析
+#
+# 生产容器里无法直接挂 profiler，这里提供按需开启的剖析，结果写入 PROFILE_DIR:
+# - 同步轮次: 接下来 N 轮用 cProfile（各工作线程的结果合并为一个 .pstats）或
+#   采样剖析（所有线程的调用栈，输出 flamegraph.pl / speedscope 可直接读取的 .folded）
+# - API 请求: 在一段时间内按比例抽样，用 cProfile 剖析单个请求，每个请求一个 .pstats
+# - 内存: tracemalloc 快照（.tracemalloc 可用 tracemalloc.Snapshot.load 读取）和前 N 项统计
+#
+# 触发方式: 管理接口在 PROFILE_DIR 写入触发文件，各进程的监视线程每 TRIGGER_POLL_INTERVAL
+# 秒检查一次；同步进程还响应 SIGUSR1（剖析下一轮）和 SIGUSR2（内存快照）。
+# 未触发时热路径上只有一次属性判断。
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from services.billing_service import CONFIG
+
+PROFILE_MODES = ('cprofile', 'sampling')
+
+# 采样剖析的采样间隔（秒）
+SAMPLE_INTERVAL = 0.01
+# 触发文件检查间隔（秒）
+TRIGGER_POLL_INTERVAL = 2.0
+# tracemalloc 记录的调用栈深度和统计输出条数
+TRACEMALLOC_FRAMES = 25
+MEMORY_TOP_STATS = 50
+
+CYCLES_TRIGGER = 'trigger-cycles.json'
+REQUESTS_TRIGGER = 'trigger-requests.json'
+SYNC_MEMORY_TRIGGER = 'trigger-memory-sync.json'
+
+_SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+def _output_path(kind: str, label: str, extension: str) -> str:
+    os.makedirs(CONFIG.profile_dir, exist_ok=True)
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    name = _SAFE_NAME.sub('_', f"{kind}-{label}-{os.getpid()}-{timestamp}").strip('_')
+    return os.path.join(CONFIG.profile_dir, f"{name}.{extension}")
+
+class StackSampler:
+    """采样剖析器: 定期读取所有线程的调用栈，按折叠栈计数"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write_folded(self, path: str):
+        """折叠栈格式: 每行 "帧;帧;帧 次数"，flamegraph.pl 和 speedscope 可直接读取"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class _CycleSession:
+    """一轮同步的剖析会话"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.profiles: List[cProfile.Profile] = []
+        self.lock = threading.Lock()
+        self.sampler: Optional[StackSampler] = None
+
+class Profiler:
+    """进程内的剖析状态"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cycles_remaining = 0
+        self.cycle_mode = 'cprofile'
+        self.request_sample_rate = 0.0
+        self.request_expires_at = 0.0
+        self.runs_sync = False
+        self.memory_requested = False
+        self._session: Optional[_CycleSession] = None
+        self._last_memory_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._watcher: Optional[threading.Thread] = None
+        self.last_output: Optional[str] = None
+
+    # ---------- 同步轮次 ----------
+
+    def request_cycles(self, cycles: int, mode: str = 'cprofile'):
+        with self._lock:
+            self.cycles_remaining = max(0, cycles)
+            self.cycle_mode = mode if mode in PROFILE_MODES else 'cprofile'
+        logging.info(f"将剖析接下来 {cycles} 轮同步 ({self.cycle_mode})")
+
+    @contextmanager
+    def profile_cycle(self, label: str):
+        """剖析一轮同步；没有待剖析轮次时直接执行"""
+        if not self.cycles_remaining:
+            yield
+            return
+
+        with self._lock:
+            self.cycles_remaining -= 1
+            session = self._session = _CycleSession(self.cycle_mode)
+
+        main_profile = None
+        if session.mode == 'sampling':
+            session.sampler = StackSampler()
+            session.sampler.start()
+        else:
+            main_profile = cProfile.Profile()
+            main_profile.enable()
+        try:
+            yield
+        finally:
+            self._session = None
+            if session.sampler is not None:
+                session.sampler.stop()
+                path = _output_path('cycle', label, 'folded')
+                session.sampler.write_folded(path)
+            else:
+                main_profile.disable()
+                stats = pstats.Stats(main_profile)
+                for profile in session.profiles:
+                    stats.add(profile)
+                path = _output_path('cycle', label, 'pstats')
+                stats.dump_stats(path)
+            self.last_output = path
+            logging.info(f"同步轮次剖析结果已写入 {path}")
+
+    def wrap(self, func: Callable) -> Callable:
+        """在 cProfile 会话中，线程池执行的函数各自剖析后并入本轮结果"""
+        session = self._session
+        if session is None or session.mode != 'cprofile':
+            return func
+
+        def run(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ 同一时刻只允许一个 cProfile，此时只剖析主线程
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with session.lock:
+                    session.profiles.append(profile)
+        return run
+
+    # ---------- API 请求 ----------
+
+    def configure_requests(self, sample_rate: float, expires_at: float):
+        self.request_sample_rate = min(1.0, max(0.0, sample_rate))
+        self.request_expires_at = expires_at
+
+    def should_profile_request(self) -> bool:
+        if not self.request_sample_rate:
+            return False
+        if time.time() > self.request_expires_at:
+            self.request_sample_rate = 0.0
+            return False
+        return random.random() < self.request_sample_rate
+
+    # ---------- 内存 ----------
+
+    def memory_snapshot(self, label: str) -> Dict[str, Any]:
+        """保存 tracemalloc 快照；首次调用开始追踪，之后的快照与上一次对比"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._last_memory_snapshot = None
+            logging.info("tracemalloc 已开始追踪，下一次快照起可以查看内存分配")
+            return {'tracing': True, 'started': True, 'files': []}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        snapshot_path = _output_path('memory', label, 'tracemalloc')
+        snapshot.dump(snapshot_path)
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"current={current} peak={peak}", '', f"Top {MEMORY_TOP_STATS} by line:"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:MEMORY_TOP_STATS]]
+        if self._last_memory_snapshot is not None:
+            lines += ['', f"Top {MEMORY_TOP_STATS} growth since previous snapshot:"]
+            lines += [str(stat) for stat in snapshot.compare_to(self._last_memory_snapshot, 'lineno')[:MEMORY_TOP_STATS]]
+        self._last_memory_snapshot = snapshot
+
+        report_path = snapshot_path[:-len('.tracemalloc')] + '.txt'
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.last_output = report_path
+        logging.info(f"内存快照已写入 {snapshot_path}")
+        return {'tracing': True, 'started': False, 'current': current, 'peak': peak,
+                'files': [os.path.basename(snapshot_path), os.path.basename(report_path)]}
+
+    def stop_memory_tracing(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._last_memory_snapshot = None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'enabled': CONFIG.profiling_enabled,
+            'cycles_remaining': self.cycles_remaining,
+            'cycle_mode': self.cycle_mode,
+            'request_sample_rate': self.request_sample_rate,
+            'request_expires_at': datetime.utcfromtimestamp(self.request_expires_at).isoformat() if self.request_sample_rate else None,
+            'memory_tracing': tracemalloc.is_tracing(),
+            'last_output': os.path.basename(self.last_output) if self.last_output else None
+        }
+
+    # ---------- 触发文件 ----------
+
+    def start_watcher(self):
+        if not CONFIG.profiling_enabled:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='profile-trigger', daemon=True)
+                self._watcher.start()
+
+    def _watch(self):
+        while True:
+            try:
+                self.check_triggers()
+            except Exception as e:
+                logging.error(f"读取剖析触发文件失败: {e}")
+            time.sleep(TRIGGER_POLL_INTERVAL)
+
+    def check_triggers(self):
+        directory = CONFIG.profile_dir
+        requests_trigger = _read_trigger(os.path.join(directory, REQUESTS_TRIGGER))
+        if requests_trigger is not None and requests_trigger.get('expires_at', 0) != self.request_expires_at:
+            self.configure_requests(float(requests_trigger.get('sample_rate', 0)), float(requests_trigger.get('expires_at', 0)))
+
+        if not self.runs_sync:
+            return
+        cycles_trigger = _read_trigger(os.path.join(directory, CYCLES_TRIGGER), consume=True)
+        if cycles_trigger is not None:
+            self.request_cycles(int(cycles_trigger.get('cycles', 1)), cycles_trigger.get('mode', 'cprofile'))
+        if _read_trigger(os.path.join(directory, SYNC_MEMORY_TRIGGER), consume=True) is not None or self.memory_requested:
+            self.memory_requested = False
+            self.memory_snapshot('sync')
+
+def _read_trigger(path: str, consume: bool = False) -> Optional[Dict[str, Any]]:
+    """读取触发文件；consume 时先改名再读取并删除（多个同步进程中只有一个会取到）"""
+    if consume:
+        claimed = f"{path}.{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        path = claimed
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {} if consume else None
+    finally:
+        if consume:
+            os.remove(path)
+
+def write_trigger(name: str, payload: Dict[str, Any]):
+    """写入触发文件（先写临时文件再改名，监视线程不会读到半个文件）"""
+    os.makedirs(CONFIG.profile_dir, exist_ok=True)
+    path = os.path.join(CONFIG.profile_dir, name)
+    temp_path = f"{path}.tmp{os.getpid()}"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    os.replace(temp_path, path)
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """PROFILE_DIR 中的剖析结果文件，最新的在前"""
+    if not os.path.isdir(CONFIG.profile_dir):
+        return []
+    files = []
+    for name in os.listdir(CONFIG.profile_dir):
+        if name.startswith('trigger-'):
+            continue
+        path = os.path.join(CONFIG.profile_dir, name)
+        stat = os.stat(path)
+        files.append({
+            'name': name,
+            'size': stat.st_size,
+            'modified_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()
+        })
+    return sorted(files, key=lambda item: item['modified_at'], reverse=True)
+
+_profiler = Profiler()
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+def init_profiling(app):
+    """Web 进程: 注册请求剖析钩子并启动触发文件监视线程"""
+    if not CONFIG.profiling_enabled:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_profile():
+        if _profiler.request_sample_rate and _profiler.should_profile_request():
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # 已有其他请求在剖析（Python 3.12+）
+                return
+            g.request_profile = profile
+
+    @app.after_request
+    def _stop_request_profile(response):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profile.disable()
+            label = f"{request.method}-{request.url_rule.rule if request.url_rule is not None else 'unmatched'}"
+            path = _output_path('request', label, 'pstats')
+            profile.dump_stats(path)
+            _profiler.last_output = path
+        return response
+
+    _profiler.start_watcher()
+
+def init_sync_profiling():
+    """同步进程: 处理同步轮次和内存快照触发"""
+    if not CONFIG.profiling_enabled:
+        return
+    _profiler.runs_sync = True
+    _profiler.start_watcher()
+
+def install_signal_handlers():
+    """SIGUSR1 剖析下一轮同步，SIGUSR2 保存内存快照（只能在主线程调用）"""
+    import signal
+
+    if not CONFIG.profiling_enabled or not hasattr(signal, 'SIGUSR1'):
+        return
+
+    # 处理函数在主线程中运行，主线程可能正持有 Profiler 的锁，这里只设置标志
+    def on_sigusr1(signum, frame):
+        _profiler.cycle_mode = CONFIG.profile_signal_mode if CONFIG.profile_signal_mode in PROFILE_MODES else 'cprofile'
+        _profiler.cycles_remaining = max(_profiler.cycles_remaining, 1)
+
+    def on_sigusr2(signum, frame):
+        _profiler.memory_requested = True
+
+    signal.signal(signal.SIGUSR1, on_sigusr1)
+    signal.signal(signal.SIGUSR2, on_sigusr2)
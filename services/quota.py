@@ -0,0 +1,327 @@
+# services/quota.py - Google API 调用量台账和预算
+#
+# 每次 API 调用按 (服务账号, 方法, 小时) 在内存中计数（调用、失败、重试），
+# 后台线程每 QUOTA_FLUSH_INTERVAL 秒把增量累加到 api_usage 表（多进程写入同一行时做加法）。
+# 当天用量 = 数据库中所有进程已写入的量 + 本进程未写入的增量，按 UTC 日期计算；
+# 分钟用量只统计本进程。
+#
+# 预算（QUOTA_DAILY_BUDGET / QUOTA_MINUTE_BUDGET，按服务账号，0 表示不限）只约束低优先级任务:
+# 用量达到预算的 (1 - QUOTA_RESERVE_RATIO) 后，IAM 清单扫描、快速账单轮询等后台任务推迟到下一轮，
+# 余量留给账单检查和换绑。常规同步不受预算限制。
+import atexit
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import exc as sa_exc, func
+
+from services import metrics
+
+PRIORITY_HIGH = 'high'
+PRIORITY_LOW = 'low'
+
+# 计数下标: 调用、失败、重试
+_CALLS, _FAILURES, _RETRIES = 0, 1, 2
+
+# 最近一次调用的 (服务账号, 方法)，重试时计入同一个方法；线程和 asyncio 任务各自独立
+_last_call: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar('last_api_call', default=None)
+
+def _hour_bucket(now: datetime) -> datetime:
+    return now.replace(minute=0, second=0, microsecond=0)
+
+def _day_start(now: datetime) -> datetime:
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class UsageLedger:
+    """进程内的 API 调用计数，定期写入数据库"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (服务账号, 方法, 小时) -> [调用, 失败, 重试]，尚未写入数据库的增量
+        self._pending: Dict[Tuple[str, str, datetime], List[int]] = defaultdict(lambda: [0, 0, 0])
+        # 服务账号 -> (分钟序号, 调用数)
+        self._minute: Dict[str, Tuple[int, int]] = {}
+        # 当天数据库中的调用量: 服务账号 -> 调用数，以及对应的日期
+        self._flushed_day: Optional[datetime] = None
+        self._flushed_calls: Dict[str, int] = {}
+        # 正在写入数据库、尚未计入 _flushed_calls 的当天调用量
+        self._in_flight_calls: Dict[str, int] = defaultdict(int)
+        self.app = None
+        self.flushes = 0
+        self.deferred = 0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- 计数 ----------
+
+    def record(self, account: str, method: str, failed: bool = False):
+        """记录一次 API 调用"""
+        _last_call.set((account, method))
+        now = datetime.utcnow()
+        minute = int(time.time() // 60)
+        with self._lock:
+            counts = self._pending[(account, method, _hour_bucket(now))]
+            counts[_CALLS] += 1
+            if failed:
+                counts[_FAILURES] += 1
+            current_minute, calls = self._minute.get(account, (minute, 0))
+            self._minute[account] = (minute, calls + 1 if current_minute == minute else 1)
+
+    def record_retry(self):
+        """把当前上下文中最近一次调用的重试计入台账"""
+        last_call = _last_call.get()
+        if last_call is None:
+            return
+        with self._lock:
+            self._pending[(last_call[0], last_call[1], _hour_bucket(datetime.utcnow()))][_RETRIES] += 1
+
+    # ---------- 预算 ----------
+
+    def usage(self, account: str) -> Dict[str, int]:
+        """服务账号当前分钟（本进程）和当天（所有进程）的调用量"""
+        today = _day_start(datetime.utcnow())
+        minute = int(time.time() // 60)
+        with self._lock:
+            current_minute, minute_calls = self._minute.get(account, (minute, 0))
+            day_calls = self._flushed_calls.get(account, 0) if self._flushed_day == today else 0
+            day_calls += self._in_flight_calls.get(account, 0)
+            day_calls += sum(
+                counts[_CALLS] for (name, _, bucket), counts in self._pending.items()
+                if name == account and bucket >= today
+            )
+        return {'minute': minute_calls if current_minute == minute else 0, 'day': day_calls}
+
+    def exhausted_window(self, account: str) -> Optional[str]:
+        """低优先级用量已到上限的窗口（'minute' / 'day'），都未到上限时返回 None"""
+        from services.billing_service import CONFIG
+
+        usage = self.usage(account)
+        threshold = 1 - CONFIG.quota_reserve_ratio
+        for window, budget in (('minute', CONFIG.quota_minute_budget), ('day', CONFIG.quota_daily_budget)):
+            if budget and usage[window] >= budget * threshold:
+                return window
+        return None
+
+    def allows(self, account: str, priority: str = PRIORITY_LOW) -> bool:
+        """是否允许服务账号继续发起该优先级的调用；高优先级始终允许"""
+        from services.billing_service import CONFIG
+
+        if priority == PRIORITY_HIGH or not CONFIG.quota_ledger_enabled:
+            return True
+        window = self.exhausted_window(account)
+        if window is None:
+            return True
+        with self._lock:
+            self.deferred += 1
+        metrics.QUOTA_DEFERRED_TOTAL.labels(account, window).inc()
+        return False
+
+    # ---------- 写入数据库 ----------
+
+    def flush(self) -> int:
+        """把未写入的增量累加到 api_usage，返回写入的行数"""
+        from models import ApiUsage
+
+        if self.app is None:
+            return 0
+        today = _day_start(datetime.utcnow())
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+            for (account, _, bucket), counts in pending.items():
+                if bucket >= today:
+                    self._in_flight_calls[account] += counts[_CALLS]
+
+        table = ApiUsage.__table__
+        written = 0
+        try:
+            with self.app.app_context():
+                for (account, method, bucket), (calls, failures, retries) in pending.items():
+                    self._upsert(table, account, method, bucket, calls, failures, retries)
+                    written += 1
+                self._reload_today()
+        except Exception as e:
+            # 写入失败的增量放回，下次再写（已写入的行不会重复，见 _upsert）
+            logging.error(f"写入 API 调用量台账失败: {e}")
+            with self._lock:
+                self._in_flight_calls.clear()
+                for key, counts in list(pending.items())[written:]:
+                    merged = self._pending[key]
+                    for index in (_CALLS, _FAILURES, _RETRIES):
+                        merged[index] += counts[index]
+            return written
+        self.flushes += 1
+        return written
+
+    @staticmethod
+    def _upsert(table, account: str, method: str, bucket: datetime, calls: int, failures: int, retries: int):
+        """先做加法更新，行不存在时插入；并发插入冲突后重新更新"""
+        from services.billing_service import create_db_session
+
+        key = (table.c.service_account_name == account) & (table.c.method == method) & (table.c.bucket == bucket)
+        increment = table.update().where(key).values(
+            calls=table.c.calls + calls, failures=table.c.failures + failures, retries=table.c.retries + retries
+        )
+        with create_db_session() as session:
+            if session.execute(increment).rowcount:
+                return
+        try:
+            with create_db_session() as session:
+                session.execute(table.insert().values(
+                    service_account_name=account, method=method, bucket=bucket,
+                    calls=calls, failures=failures, retries=retries
+                ))
+        except sa_exc.IntegrityError:
+            with create_db_session() as session:
+                session.execute(increment)
+
+    def _reload_today(self):
+        """重新读取所有进程当天已写入的调用量"""
+        from services.billing_service import create_db_session
+        from models import ApiUsage
+
+        today = _day_start(datetime.utcnow())
+        with create_db_session() as session:
+            rows = session.query(ApiUsage.service_account_name, func.sum(ApiUsage.calls)).filter(
+                ApiUsage.bucket >= today
+            ).group_by(ApiUsage.service_account_name).all()
+        with self._lock:
+            self._flushed_day = today
+            self._flushed_calls = {name: int(calls or 0) for name, calls in rows}
+            self._in_flight_calls.clear()
+
+    # ---------- 后台线程 ----------
+
+    def start(self, app, interval: float):
+        self.app = app
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='quota-ledger', daemon=True)
+        self._thread.start()
+
+    def _run(self, interval: float):
+        self.flush()
+        while not self._stop_event.wait(interval):
+            self.flush()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pending_rows': len(self._pending),
+                'flushes': self.flushes,
+                'deferred': self.deferred
+            }
+
+_ledger = UsageLedger()
+
+def get_ledger() -> UsageLedger:
+    return _ledger
+
+def record_call(account: str, method: str, failed: bool = False):
+    _ledger.record(account, method, failed)
+
+def record_retry():
+    _ledger.record_retry()
+
+def allows(account: str, priority: str = PRIORITY_LOW) -> bool:
+    return _ledger.allows(account, priority)
+
+def get_quota_stats() -> Dict[str, Any]:
+    from services.billing_service import CONFIG
+    return dict(
+        _ledger.get_stats(),
+        enabled=CONFIG.quota_ledger_enabled,
+        daily_budget=CONFIG.quota_daily_budget,
+        minute_budget=CONFIG.quota_minute_budget
+    )
+
+def init_quota_ledger(app):
+    """启动台账写入线程，并在进程退出时写出剩余计数"""
+    from services.billing_service import CONFIG
+
+    if not CONFIG.quota_ledger_enabled:
+        return
+    if _ledger.app is None:
+        atexit.register(_ledger.stop)
+    _ledger.start(app, CONFIG.quota_flush_interval)
+
+def bind_quota_ledger(app):
+    """只绑定 app、不启动写入线程，由调用方显式 get_ledger().flush()（多进程模式的同步子进程）"""
+    from services.billing_service import CONFIG
+
+    if CONFIG.quota_ledger_enabled:
+        _ledger.app = app
+
+def account_usage(account: str, days: int = 1) -> Dict[str, Any]:
+    """服务账号最近 days 天按天、方法汇总的调用量（包含本进程未写入的增量）"""
+    from services.billing_service import CONFIG, create_db_session
+    from models import ApiUsage
+
+    since = _day_start(datetime.utcnow()) - timedelta(days=max(1, days) - 1)
+    totals: Dict[Tuple[str, str], List[int]] = defaultdict(lambda: [0, 0, 0])
+    with create_db_session() as session:
+        rows = session.query(ApiUsage.bucket, ApiUsage.method, ApiUsage.calls, ApiUsage.failures, ApiUsage.retries).filter(
+            ApiUsage.service_account_name == account,
+            ApiUsage.bucket >= since
+        ).all()
+    with _ledger._lock:
+        rows += [
+            (bucket, method, *counts) for (name, method, bucket), counts in _ledger._pending.items()
+            if name == account and bucket >= since
+        ]
+    for bucket, method, calls, failures, retries in rows:
+        counts = totals[(bucket.date().isoformat(), method)]
+        counts[_CALLS] += calls
+        counts[_FAILURES] += failures
+        counts[_RETRIES] += retries
+
+    return {
+        'service_account_name': account,
+        'current': _ledger.usage(account),
+        'budgets': {'minute': CONFIG.quota_minute_budget, 'day': CONFIG.quota_daily_budget},
+        'low_priority_deferred_by': _ledger.exhausted_window(account) if CONFIG.quota_ledger_enabled else None,
+        'usage': [
+            {'day': day, 'method': method, 'calls': counts[_CALLS], 'failures': counts[_FAILURES], 'retries': counts[_RETRIES]}
+            for (day, method), counts in sorted(totals.items())
+        ]
+    }
+
+def usage_summary() -> List[Dict[str, Any]]:
+    """所有服务账号当天的调用量汇总（包含本进程未写入的增量）"""
+    from services.billing_service import create_db_session
+    from models import ApiUsage
+
+    today = _day_start(datetime.utcnow())
+    totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])
+    with create_db_session() as session:
+        rows = session.query(
+            ApiUsage.service_account_name, func.sum(ApiUsage.calls), func.sum(ApiUsage.failures), func.sum(ApiUsage.retries)
+        ).filter(ApiUsage.bucket >= today).group_by(ApiUsage.service_account_name).all()
+    with _ledger._lock:
+        rows += [(name, *counts) for (name, _, bucket), counts in _ledger._pending.items() if bucket >= today]
+    for name, calls, failures, retries in rows:
+        counts = totals[name]
+        counts[_CALLS] += int(calls or 0)
+        counts[_FAILURES] += int(failures or 0)
+        counts[_RETRIES] += int(retries or 0)
+
+    return [
+        {
+            'service_account_name': name,
+            'calls': counts[_CALLS],
+            'failures': counts[_FAILURES],
+            'retries': counts[_RETRIES],
+            'low_priority_deferred_by': _ledger.exhausted_window(name)
+        }
+        for name, counts in sorted(totals.items())
+    ]
@@ -0,0 +1,365 @@
+# services/resync.py - webhook 触发的定向重新同步
+#
+# Web 进程收到预算/账单停用通知后，把受影响的服务账号、账单账户或项目解析为
+# 按服务账号拆分的 resync_requests 记录（相同目标的待处理请求合并为一条）；
+# 同步进程每 RESYNC_POLL_INTERVAL 秒领取本进程负责的请求，只处理受影响的对象。
+#
+# 认证只接受 Authorization: Bearer 头: WEBHOOK_TOKEN，或配置 WEBHOOK_OIDC_AUDIENCE 后由 Pub/Sub 推送订阅附带的 OIDC 令牌。
+# 本地测试可直接用 curl 模拟 Pub/Sub 推送:
+#   curl -X POST -H "Authorization: Bearer $WEBHOOK_TOKEN" -H 'Content-Type: application/json' \
+#        -d '{"billing_account": "012345-ABCDEF-678901"}' http://localhost:8848/api/webhooks/resync
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import exc as sa_exc
+
+from models import ServiceAccount, Project, BillingAccount, ResyncRequest
+from services import tracing
+from services.billing_service import (
+    CONFIG, AccountBusy, BillingAccountStatusCache, GoogleAPIClient, acquire_account_lock, billing_account_of,
+    create_db_session, fetch_billing_accounts, get_account_lock, get_project_billing_info_v1, process_account,
+    rebind_projects, release_account_lock, save_billing_accounts, save_project_states, unbind_projects
+)
+
+# 通知中可能出现的目标字段: 自有告警使用下划线命名，Pub/Sub 预算通知使用驼峰属性
+_TARGET_KEYS = {
+    'service_account': ('service_account', 'serviceAccount', 'service_account_name'),
+    'billing_account': ('billing_account', 'billingAccount', 'billingAccountId', 'billing_account_id', 'billingAccountName'),
+    'project': ('project', 'project_id', 'projectId')
+}
+
+# 单个项目的重新同步等待服务账号处理锁的最长秒数，超时后请求重新排队，不在全量同步后面长时间阻塞工作线程
+RESYNC_LOCK_WAIT = 30
+
+def normalize_billing_account(value: str) -> str:
+    """账单账户统一为 billingAccounts/XXXXXX-XXXXXX-XXXXXX 形式"""
+    value = value.strip()
+    return value if value.startswith('billingAccounts/') else f'billingAccounts/{value}'
+
+def parse_notification(payload: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """从普通 JSON 或 Pub/Sub 推送信封中解析出 (目标类型, 目标) 列表"""
+    sources = [payload]
+    message = payload.get('message')
+    if isinstance(message, dict):
+        sources.append(message.get('attributes') or {})
+        data = message.get('data')
+        if data:
+            try:
+                decoded = json.loads(base64.b64decode(data))
+                if isinstance(decoded, dict):
+                    sources.append(decoded)
+            except (binascii.Error, ValueError) as e:
+                logging.warning(f"无法解析 Pub/Sub 消息数据: {e}")
+
+    targets = []
+    for source in sources:
+        for target_type, keys in _TARGET_KEYS.items():
+            for key in keys:
+                value = source.get(key)
+                if not value or not isinstance(value, str):
+                    continue
+                if target_type == 'billing_account':
+                    value = normalize_billing_account(value)
+                if (target_type, value) not in targets:
+                    targets.append((target_type, value))
+    return targets
+
+def verify_pubsub_token(token: str) -> bool:
+    """校验 Pub/Sub 推送附带的 Google OIDC 令牌（audience 和可选的服务账号邮箱）"""
+    if not CONFIG.webhook_oidc_audience:
+        return False
+    try:
+        import google.auth.transport.requests
+        from google.oauth2 import id_token
+        claims = id_token.verify_oauth2_token(
+            token, google.auth.transport.requests.Request(), audience=CONFIG.webhook_oidc_audience
+        )
+    except ValueError as e:
+        logging.warning(f"Pub/Sub OIDC 令牌校验失败: {e}")
+        return False
+    if CONFIG.webhook_oidc_email and (
+        claims.get('email') != CONFIG.webhook_oidc_email or not claims.get('email_verified')
+    ):
+        logging.warning(f"Pub/Sub OIDC 令牌的服务账号不匹配: {claims.get('email')}")
+        return False
+    return True
+
+def _resolve_service_accounts(session, target_type: str, target: str) -> List[str]:
+    """找出目标涉及的服务账号名称"""
+    if target_type == 'service_account':
+        query = session.query(ServiceAccount.name).filter(
+            (ServiceAccount.name == target) | (ServiceAccount.email == target)
+        )
+    elif target_type == 'billing_account':
+        query = session.query(ServiceAccount.name).join(
+            BillingAccount, BillingAccount.service_account_id == ServiceAccount.id
+        ).filter(BillingAccount.name == target)
+    else:
+        query = session.query(ServiceAccount.name).join(
+            Project, Project.service_account_id == ServiceAccount.id
+        ).filter(Project.project_id == target)
+    return sorted({row[0] for row in query.all()})
+
+def _pending_key(service_account_name: str, target_type: str, target: str) -> str:
+    return hashlib.sha1(f"{service_account_name}\n{target_type}\n{target}".encode('utf-8')).hexdigest()
+
+def _enqueue_one(session, service_account_name: str, target_type: str, target: str, source: Optional[str]) -> Tuple[int, bool]:
+    """插入一条待处理请求，返回 (请求 ID, 是否新增)
+
+    相同目标的待处理请求由 pending_key 唯一索引保证只有一条: 插入冲突时把已有请求的合并次数加一；
+    已有请求恰好在此期间被领取（pending_key 已清空）时重新插入。
+    """
+    pending_key = _pending_key(service_account_name, target_type, target)
+    for _ in range(3):
+        try:
+            with session.begin_nested():
+                request = ResyncRequest(
+                    service_account_name=service_account_name,
+                    target_type=target_type,
+                    target=target,
+                    source=source,
+                    status='pending',
+                    pending_key=pending_key
+                )
+                session.add(request)
+                session.flush()
+            return request.id, True
+        except sa_exc.IntegrityError:
+            pass
+
+        # 加锁读: 读到其他进程刚提交的请求，而不是本事务开始时的快照
+        pending_id = session.query(ResyncRequest.id).filter_by(pending_key=pending_key).with_for_update().scalar()
+        if pending_id is not None:
+            session.query(ResyncRequest).filter(ResyncRequest.id == pending_id).update(
+                {'coalesced': ResyncRequest.coalesced + 1}, synchronize_session=False
+            )
+            return pending_id, False
+    raise RuntimeError(f"定向重新同步请求入队冲突: {service_account_name} {target_type} {target}")
+
+def enqueue_resync(targets: List[Tuple[str, str]], source: Optional[str] = None) -> Dict[str, Any]:
+    """写入定向重新同步请求，已有相同的待处理请求时合并，返回入队结果"""
+    queued = []
+    coalesced = []
+    unknown = []
+
+    with create_db_session() as session:
+        for target_type, target in targets:
+            service_account_names = _resolve_service_accounts(session, target_type, target)
+            if not service_account_names:
+                unknown.append({'type': target_type, 'target': target})
+                continue
+
+            for service_account_name in service_account_names:
+                request_id, created = _enqueue_one(session, service_account_name, target_type, target, source)
+                (queued if created else coalesced).append(request_id)
+
+    if queued or coalesced:
+        logging.info(f"定向重新同步入队: 新增 {queued}, 合并 {coalesced}, 来源 {source}")
+    return {'queued': queued, 'coalesced': coalesced, 'unknown': unknown}
+
+def resync_project(app, gcp_account: Dict[str, str], project_id: str) -> str:
+    """只检查单个项目: 未绑定或绑定在已关闭账单上时解绑并重新分配"""
+    account_lock = get_account_lock(gcp_account['name'])
+    if not account_lock.acquire(timeout=RESYNC_LOCK_WAIT):
+        raise AccountBusy(gcp_account['name'])
+    api_client = None
+    lock_owner = None
+    try:
+        with app.app_context():
+            lock_owner = acquire_account_lock(gcp_account['name'], wait=RESYNC_LOCK_WAIT)
+            if lock_owner is None:
+                raise AccountBusy(gcp_account['name'])
+            with create_db_session() as session:
+                sa_obj = session.query(ServiceAccount).filter_by(name=gcp_account['name']).first()
+                if sa_obj is None:
+                    # 尚未经过全量同步的服务账号没有账单和项目记录，由全量同步处理
+                    return f"服务账号 {gcp_account['name']} 尚未同步，跳过"
+                from services.token_manager import get_credentials
+                credentials = get_credentials(gcp_account['credentials_file'], gcp_account['name'])
+                api_client = GoogleAPIClient(credentials, gcp_account['name'])
+
+                billing_accounts = fetch_billing_accounts(
+                    api_client, session, sa_obj.id, BillingAccountStatusCache(allow_skip_list=False)
+                )
+                if not billing_accounts:
+                    # 列表失败时无法判断账单状态，不能据此解绑
+                    return "获取账单账户列表失败，跳过"
+                save_billing_accounts(session, sa_obj.id, billing_accounts)
+                active_billing_accounts = [account['name'] for account in billing_accounts if account['open']]
+
+                projects_billing_info = {
+                    db_project_id: billing_account_name or 'None'
+                    for db_project_id, billing_account_name in session.query(
+                        Project.project_id, Project.billing_account_name
+                    ).filter_by(service_account_id=sa_obj.id).all()
+                }
+                billing_info = get_project_billing_info_v1(api_client, project_id)
+                current_billing_account = billing_account_of(billing_info)
+                projects_billing_info[project_id] = current_billing_account
+
+                unbound_projects = []
+                if current_billing_account == 'None':
+                    unbound_projects.append(project_id)
+                elif current_billing_account not in active_billing_accounts:
+                    unbound_projects = unbind_projects(
+                        api_client, session, sa_obj.id, [(project_id, current_billing_account)],
+                        projects_billing_info, message="通知触发，失效账单自动解绑"
+                    )
+
+                if unbound_projects and active_billing_accounts and CONFIG.enable_auto_switch:
+                    rebind_projects(api_client, session, sa_obj.id, unbound_projects, active_billing_accounts, projects_billing_info)
+
+                billing_accounts_dict = {account['name']: account for account in billing_accounts}
+                save_project_states(session, sa_obj.id, list(projects_billing_info), projects_billing_info, billing_accounts_dict)
+                return f"{project_id} -> {projects_billing_info[project_id]}"
+    finally:
+        if lock_owner:
+            with app.app_context():
+                release_account_lock(gcp_account['name'], lock_owner)
+        account_lock.release()
+        if api_client:
+            api_client.close()
+
+def process_resync_request(app, request: Dict[str, Any]) -> Tuple[bool, str]:
+    """执行单个定向重新同步请求"""
+    gcp_account = next(
+        (account for account in app.config['GCP_ACCOUNTS'] if account['name'] == request['service_account_name']),
+        None
+    )
+    if gcp_account is None:
+        return False, f"未配置服务账号 {request['service_account_name']}"
+
+    if request['target_type'] == 'service_account':
+        return process_account(app, gcp_account), "服务账号全量同步"
+
+    if request['target_type'] == 'billing_account':
+        from services.billing_poll import poll_account
+        unbound = poll_account(app, gcp_account, BillingAccountStatusCache(allow_skip_list=False))
+        return True, f"检查账单状态，重新分配 {unbound} 个项目"
+
+    return True, resync_project(app, gcp_account, request['target'])
+
+def claim_requests(app, limit: int) -> List[Dict[str, Any]]:
+    """领取本进程负责的待处理请求，条件 UPDATE 保证多进程下只被领取一次"""
+    from services.coordination import get_coordinator
+    coordinator = get_coordinator()
+
+    now = datetime.utcnow()
+    claimed = []
+    with app.app_context():
+        with create_db_session() as session:
+            # 进程崩溃遗留的执行中请求重新排队（不恢复 pending_key，期间的新通知已另行入队）
+            session.query(ResyncRequest).filter(
+                ResyncRequest.status == 'running',
+                ResyncRequest.started_at < now - timedelta(seconds=CONFIG.task_timeout)
+            ).update({'status': 'pending'}, synchronize_session=False)
+
+            pending = session.query(ResyncRequest).filter(
+                ResyncRequest.status == 'pending'
+            ).order_by(ResyncRequest.id).limit(limit * 4).all()
+
+            for request in pending:
+                if len(claimed) >= limit:
+                    break
+                if coordinator is not None and not coordinator.owns(request.service_account_name):
+                    continue
+                updated = session.query(ResyncRequest).filter(
+                    ResyncRequest.id == request.id,
+                    ResyncRequest.status == 'pending'
+                ).update({'status': 'running', 'started_at': now, 'pending_key': None}, synchronize_session=False)
+                if updated:
+                    claimed.append(request.to_dict())
+    return claimed
+
+def _finish_request(app, request_id: int, success: bool, message: str):
+    with app.app_context():
+        with create_db_session() as session:
+            session.query(ResyncRequest).filter(ResyncRequest.id == request_id).update({
+                'status': 'done' if success else 'failed',
+                'message': message,
+                'finished_at': datetime.utcnow()
+            }, synchronize_session=False)
+
+def _run_request(app, request: Dict[str, Any]):
+    start_time = time.time()
+    try:
+        with tracing.start_trace(
+            'resync', target_type=request['target_type'], target=request['target'],
+            service_account=request['service_account_name']
+        ):
+            success, message = process_resync_request(app, request)
+    except AccountBusy:
+        # 全量同步正在处理该服务账号: 重新排队，稍后再检查
+        with app.app_context():
+            with create_db_session() as session:
+                _enqueue_one(
+                    session, request['service_account_name'], request['target_type'], request['target'], request['source']
+                )
+        success, message = True, "服务账号正在同步，已重新排队"
+    except Exception as e:
+        logging.error(f"定向重新同步 {request['target_type']} {request['target']} 失败: {e}", exc_info=True)
+        success, message = False, str(e)
+    _finish_request(app, request['id'], success, message)
+    logging.info(
+        f"定向重新同步 {request['target_type']} {request['target']} ({request['service_account_name']}) "
+        f"{'完成' if success else '失败'}, 耗时 {time.time() - start_time:.2f} 秒"
+    )
+
+def purge_finished_requests(app, keep_days: int = 7) -> int:
+    """删除早于 keep_days 天的已完成请求，多副本部署时只由 leader 执行"""
+    from services.coordination import leader_fence
+
+    should_run, fence = leader_fence()
+    if not should_run:
+        return 0
+
+    with app.app_context():
+        with create_db_session() as session:
+            if fence is not None:
+                fence(session)
+            return session.query(ResyncRequest).filter(
+                ResyncRequest.status.in_(['done', 'failed']),
+                ResyncRequest.finished_at < datetime.utcnow() - timedelta(days=keep_days)
+            ).delete(synchronize_session=False)
+
+def run_resync_loop(app):
+    """定向重新同步循环"""
+    last_purge = 0.0
+    with ThreadPoolExecutor(max_workers=max(1, CONFIG.max_workers), thread_name_prefix='resync') as executor:
+        while True:
+            try:
+                requests = claim_requests(app, CONFIG.max_workers)
+                if requests:
+                    list(executor.map(lambda request: _run_request(app, request), requests))
+                    continue
+
+                if time.time() - last_purge > 3600:
+                    last_purge = time.time()
+                    purge_finished_requests(app)
+            except Exception as e:
+                logging.error(f"定向重新同步循环失败: {e}", exc_info=True)
+
+            time.sleep(CONFIG.resync_poll_interval)
+
+_resync_thread: Optional[threading.Thread] = None
+
+def start_resync_thread(app) -> Optional[threading.Thread]:
+    """启动定向重新同步线程，未启用时返回 None"""
+    global _resync_thread
+
+    if not CONFIG.resync_enabled:
+        return None
+
+    if _resync_thread is None:
+        _resync_thread = threading.Thread(target=run_resync_loop, args=(app,), name='resync-worker', daemon=True)
+        _resync_thread.start()
+        logging.info(f"定向重新同步已启动: 每 {CONFIG.resync_poll_interval} 秒检查一次请求队列")
+    return _resync_thread
@@ -0,0 +1,246 @@
+# services/retention.py - billing_operations 数据保留: 按天汇总、归档和清理
+import logging
+import time
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import db, BillingOperation, BillingOperationArchive, BillingOperationDailyRollup
+from services.billing_service import CONFIG, create_db_session
+
+# 归档时复制的列，两张表结构一致
+_ARCHIVE_COLUMNS = [
+    'id', 'operation_type', 'service_account_id', 'project_id', 'billing_account_id',
+    'old_value', 'new_value', 'status', 'message', 'created_at'
+]
+
+# 单例任务在写事务中校验 leader 租约的回调
+Fence = Callable[[Session], None]
+
+_last_run = 0.0
+_run_lock = Lock()
+
+def _as_date(value) -> date:
+    """func.date() 在 SQLite 返回字符串，在 MySQL 返回 date"""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+def rollup_operations(until_day: date, recompute_days: int = 0, not_before: Optional[date] = None, fence: Optional[Fence] = None) -> int:
+    """把 until_day 之前(不含)的操作记录按天汇总，返回写入的汇总行数
+
+    除尚未汇总的日期外，还重新汇总 until_day 之前最近 recompute_days 天并覆盖旧的汇总行:
+    溢出文件回放、跨零点的异步写入等会给已经汇总过的日期补写记录。
+    not_before 之前的日期明细可能已经归档，不再重新汇总。
+    fence 在每个写事务开始时校验 leader 租约（见 coordination.leader_fence）。
+    """
+    with create_db_session() as session:
+        if fence is not None:
+            fence(session)
+        last_day = session.query(db.func.max(BillingOperationDailyRollup.day)).scalar()
+        if last_day is not None:
+            recompute_from = until_day - timedelta(days=recompute_days)
+            if not_before is not None:
+                recompute_from = max(recompute_from, not_before)
+            start_day = min(_as_date(last_day) + timedelta(days=1), recompute_from)
+        else:
+            first_created = session.query(db.func.min(BillingOperation.created_at)).scalar()
+            if first_created is None:
+                return 0
+            start_day = first_created.date()
+
+        if start_day >= until_day:
+            return 0
+
+        start = datetime.combine(start_day, datetime.min.time())
+        end = datetime.combine(until_day, datetime.min.time())
+        day_expr = db.func.date(BillingOperation.created_at)
+
+        rows = session.query(
+            day_expr,
+            BillingOperation.service_account_id,
+            BillingOperation.operation_type,
+            BillingOperation.status,
+            db.func.count(BillingOperation.id)
+        ).filter(
+            BillingOperation.created_at >= start,
+            BillingOperation.created_at < end
+        ).group_by(
+            day_expr,
+            BillingOperation.service_account_id,
+            BillingOperation.operation_type,
+            BillingOperation.status
+        ).all()
+
+        # 先删除区间内已有汇总，保证重复执行结果一致
+        session.query(BillingOperationDailyRollup).filter(
+            BillingOperationDailyRollup.day >= start_day,
+            BillingOperationDailyRollup.day < until_day
+        ).delete(synchronize_session=False)
+
+        session.bulk_insert_mappings(BillingOperationDailyRollup, [
+            {
+                'day': _as_date(day),
+                'service_account_id': service_account_id,
+                'operation_type': operation_type,
+                'status': status,
+                'count': count
+            }
+            for day, service_account_id, operation_type, status, count in rows
+        ])
+
+        logging.info(f"操作记录汇总完成: {start_day} ~ {until_day - timedelta(days=1)}, {len(rows)} 行")
+        return len(rows)
+
+def archive_operations(cutoff: datetime, batch_size: int, fence: Optional[Fence] = None) -> int:
+    """把 cutoff 之前的操作记录分批移动到归档表，返回移动的记录数"""
+    source = BillingOperation.__table__
+    target = BillingOperationArchive.__table__
+    moved = 0
+
+    while True:
+        with create_db_session() as session:
+            if fence is not None:
+                fence(session)
+            ids = [row[0] for row in session.query(BillingOperation.id).filter(
+                BillingOperation.created_at < cutoff
+            ).order_by(BillingOperation.id).limit(batch_size).all()]
+
+            if not ids:
+                break
+
+            columns = [source.c[name] for name in _ARCHIVE_COLUMNS]
+            session.execute(target.insert().from_select(
+                _ARCHIVE_COLUMNS,
+                select(*columns).where(source.c.id.in_(ids))
+            ))
+            session.execute(source.delete().where(source.c.id.in_(ids)))
+            moved += len(ids)
+
+        if len(ids) < batch_size:
+            break
+
+    return moved
+
+def purge_archive(cutoff: datetime, batch_size: int, fence: Optional[Fence] = None) -> int:
+    """分批删除归档表中 cutoff 之前的记录，返回删除的记录数"""
+    table = BillingOperationArchive.__table__
+    purged = 0
+
+    while True:
+        with create_db_session() as session:
+            if fence is not None:
+                fence(session)
+            ids = [row[0] for row in session.query(BillingOperationArchive.id).filter(
+                BillingOperationArchive.created_at < cutoff
+            ).limit(batch_size).all()]
+
+            if not ids:
+                break
+
+            session.execute(table.delete().where(table.c.id.in_(ids)))
+            purged += len(ids)
+
+        if len(ids) < batch_size:
+            break
+
+    return purged
+
+def run_retention(app, fence: Optional[Fence] = None) -> Dict[str, int]:
+    """执行一次完整的保留任务: 汇总 → 归档 → 清理归档"""
+    with app.app_context():
+        now = datetime.utcnow()
+        result = {'rollup_rows': 0, 'archived': 0, 'purged': 0}
+
+        # 最近 rollup_recompute_days 天每次都重新汇总，这些日期的明细不归档
+        recompute_from = now.date() - timedelta(days=CONFIG.rollup_recompute_days)
+        cutoff = None
+        if CONFIG.retention_days > 0:
+            cutoff = min(now - timedelta(days=CONFIG.retention_days), datetime.combine(recompute_from, datetime.min.time()))
+
+        # cutoff 所在的日期已部分归档，从下一天开始才能重新汇总
+        result['rollup_rows'] = rollup_operations(
+            now.date(),
+            recompute_days=CONFIG.rollup_recompute_days,
+            not_before=cutoff.date() + timedelta(days=1) if cutoff else None,
+            fence=fence
+        )
+
+        if cutoff is not None:
+            # 汇总在归档之前执行，cutoff 之前的日期都已汇总；
+            # 但晚于 rollup_recompute_days 才补写到这些日期的记录不会计入汇总
+            result['archived'] = archive_operations(cutoff, CONFIG.retention_batch_size, fence)
+
+        if CONFIG.archive_retention_days > 0:
+            cutoff = now - timedelta(days=CONFIG.archive_retention_days)
+            result['purged'] = purge_archive(cutoff, CONFIG.retention_batch_size, fence)
+
+        logging.info(f"数据保留任务完成: {result}")
+        return result
+
+def run_retention_if_due(app):
+    """距离上次执行超过 retention_interval 时执行保留任务，失败不影响调用方
+
+    多副本部署时只由持有 leader 租约的同步进程执行。
+    """
+    global _last_run
+    from services.coordination import LeadershipLost, leader_fence
+
+    if not CONFIG.retention_enabled:
+        return
+
+    # 先检查 leader 再检查间隔: 非 leader 不记录执行时间，接管后立即执行
+    should_run, fence = leader_fence()
+    if not should_run:
+        return
+
+    with _run_lock:
+        if time.time() - _last_run < CONFIG.retention_interval:
+            return
+        _last_run = time.time()
+
+    try:
+        run_retention(app, fence)
+    except LeadershipLost as e:
+        logging.warning(f"数据保留任务中止: {e}")
+    except Exception as e:
+        logging.error(f"数据保留任务执行失败: {e}", exc_info=True)
+
+def get_daily_stats(days: int, service_account_id: int = None) -> List[Dict]:
+    """查询最近 days 天的操作汇总，今天的数据从明细表实时统计"""
+    today = datetime.utcnow().date()
+    start_day = today - timedelta(days=days - 1)
+
+    query = BillingOperationDailyRollup.query.filter(BillingOperationDailyRollup.day >= start_day)
+    if service_account_id:
+        query = query.filter(BillingOperationDailyRollup.service_account_id == service_account_id)
+    stats = [rollup.to_dict() for rollup in query.order_by(BillingOperationDailyRollup.day).all()]
+
+    today_query = db.session.query(
+        BillingOperation.service_account_id,
+        BillingOperation.operation_type,
+        BillingOperation.status,
+        db.func.count(BillingOperation.id)
+    ).filter(BillingOperation.created_at >= datetime.combine(today, datetime.min.time()))
+    if service_account_id:
+        today_query = today_query.filter(BillingOperation.service_account_id == service_account_id)
+
+    for account_id, operation_type, status, count in today_query.group_by(
+        BillingOperation.service_account_id,
+        BillingOperation.operation_type,
+        BillingOperation.status
+    ).all():
+        stats.append({
+            'day': today.isoformat(),
+            'service_account_id': account_id,
+            'operation_type': operation_type,
+            'status': status,
+            'count': count
+        })
+
+    return stats
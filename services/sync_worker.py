@@ -0,0 +1,33 @@
+# services/sync_worker.py - 独立的同步任务进程入口
+#
+# 用法: python -m services.sync_worker
+# Web 进程只处理 API 请求，定期账单检查和换绑在此进程中运行。
+import logging
+import signal
+import sys
+
+def _handle_sigterm(signum, frame):
+    """容器停止时正常退出，触发 atexit 中的审计日志刷新"""
+    logging.info("收到 SIGTERM，同步进程正在退出...")
+    sys.exit(0)
+
+def main():
+    from app import create_app
+    from services.billing_service import update_project_status
+    
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    
+    # SIGUSR1 剖析下一轮同步，SIGUSR2 保存内存快照
+    from services.profiling import install_signal_handlers
+    install_signal_handlers()
+    
+    logging.info("Starting GCP Billing sync worker")
+    app = create_app()
+    
+    from services.billing_service import CONFIG
+    from services.metrics import start_metrics_server
+    start_metrics_server(CONFIG.metrics_port)
+    update_project_status(app)
+
+if __name__ == "__main__":
+    main()
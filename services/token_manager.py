@@ -0,0 +1,230 @@
+# services/token_manager.py - 服务账号访问令牌的共享与后台预刷新
+#
+# 每个凭据文件只创建一个 service_account.Credentials，所有线程、API 客户端和
+# 手动操作共用同一个对象。后台线程在令牌过期前 token_refresh_margin 秒刷新，
+# 早于 google-auth 自身的刷新阈值，因此请求路径上 before_request 不会再触发令牌获取。
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import google.auth.transport.requests
+from google.oauth2 import service_account
+
+from services.billing_service import CONFIG
+
+CLOUD_PLATFORM_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+# 刷新失败后的最长重试间隔（秒）
+MAX_FAILURE_BACKOFF = 300
+
+class ManagedToken:
+    """单个凭据文件的共享凭据及刷新统计"""
+
+    def __init__(self, name: str, credentials_file: str):
+        self.name = name
+        self.credentials_file = credentials_file
+        self.credentials = None
+        self.lock = threading.Lock()
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.consecutive_failures = 0
+        self.last_refresh_at: Optional[datetime] = None
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.next_attempt = 0.0
+
+    def load(self):
+        if self.credentials is None:
+            self.credentials = service_account.Credentials.from_service_account_file(
+                self.credentials_file,
+                scopes=CLOUD_PLATFORM_SCOPES
+            )
+        return self.credentials
+
+    def needs_refresh(self, margin: float) -> bool:
+        credentials = self.credentials
+        if credentials is None or not credentials.token or credentials.expiry is None:
+            return True
+        return credentials.expiry - datetime.utcnow() < timedelta(seconds=margin)
+
+    def expires_in(self) -> Optional[float]:
+        credentials = self.credentials
+        if credentials is None or credentials.expiry is None:
+            return None
+        return round((credentials.expiry - datetime.utcnow()).total_seconds(), 1)
+
+class TokenManager:
+    """进程级令牌管理器"""
+
+    def __init__(self, refresh_margin: int, check_interval: int):
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self._tokens: Dict[str, ManagedToken] = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._request = None
+        self.refreshes = 0
+        self.failures = 0
+        self.on_path_refreshes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def _auth_request(self):
+        """刷新令牌使用的请求对象，启用共享连接池时复用其会话"""
+        if self._request is None:
+            if CONFIG.shared_http_transport:
+                from services.http_transport import get_shared_transport
+                self._request = get_shared_transport().refresh_request()
+            else:
+                self._request = google.auth.transport.requests.Request()
+        return self._request
+
+    def register(self, name: str, credentials_file: str) -> ManagedToken:
+        """登记凭据文件，后台线程会为其预取和续期令牌"""
+        with self._lock:
+            token = self._tokens.get(credentials_file)
+            if token is None:
+                token = ManagedToken(name, credentials_file)
+                self._tokens[credentials_file] = token
+            return token
+
+    def get_credentials(self, credentials_file: str, name: Optional[str] = None):
+        """返回共享凭据；后台尚未取得令牌时在此同步获取一次（并发调用只刷新一次）"""
+        token = self.register(name or credentials_file, credentials_file)
+        with token.lock:
+            credentials = token.load()
+            if not credentials.valid:
+                with self._stats_lock:
+                    self.on_path_refreshes += 1
+                self._refresh_locked(token)
+        return credentials
+
+    def _refresh_locked(self, token: ManagedToken):
+        start_time = time.monotonic()
+        try:
+            token.load().refresh(self._auth_request())
+        except Exception as e:
+            token.failure_count += 1
+            token.consecutive_failures += 1
+            token.last_error = str(e)
+            token.next_attempt = time.monotonic() + min(
+                MAX_FAILURE_BACKOFF, self.check_interval * 2 ** (token.consecutive_failures - 1)
+            )
+            with self._stats_lock:
+                self.failures += 1
+            logging.error(f"刷新服务账号 {token.name} 的访问令牌失败: {e}")
+            raise
+
+        latency = time.monotonic() - start_time
+        token.refresh_count += 1
+        token.consecutive_failures = 0
+        token.last_error = None
+        token.last_refresh_at = datetime.utcnow()
+        token.last_latency = latency
+        token.next_attempt = 0.0
+        with self._stats_lock:
+            self.refreshes += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        logging.debug(f"已刷新服务账号 {token.name} 的访问令牌，耗时 {latency:.3f} 秒")
+
+    def refresh_due(self):
+        """刷新所有即将过期的令牌"""
+        with self._lock:
+            tokens = list(self._tokens.values())
+
+        now = time.monotonic()
+        for token in tokens:
+            if self._stop_event.is_set():
+                return
+            if now < token.next_attempt or not token.needs_refresh(self.refresh_margin):
+                continue
+            with token.lock:
+                # 持锁后再检查一次，请求路径可能刚刚刷新过
+                if token.needs_refresh(self.refresh_margin):
+                    try:
+                        self._refresh_locked(token)
+                    except Exception:
+                        pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='token-refresher', daemon=True)
+        self._thread.start()
+        logging.info(f"令牌预刷新线程已启动: 管理 {len(self._tokens)} 个服务账号, 提前 {self.refresh_margin} 秒刷新")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_due()
+            except Exception as e:
+                logging.error(f"令牌预刷新失败: {e}")
+            self._stop_event.wait(self.check_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tokens = list(self._tokens.values())
+        with self._stats_lock:
+            stats = {
+                'accounts': len(tokens),
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'on_path_refreshes': self.on_path_refreshes,
+                'avg_refresh_latency': round(self.total_latency / self.refreshes, 4) if self.refreshes else None,
+                'max_refresh_latency': round(self.max_latency, 4)
+            }
+        stats['tokens'] = [
+            {
+                'name': token.name,
+                'expires_in': token.expires_in(),
+                'refresh_count': token.refresh_count,
+                'failure_count': token.failure_count,
+                'last_refresh_at': token.last_refresh_at.isoformat() if token.last_refresh_at else None,
+                'last_latency': round(token.last_latency, 4) if token.last_latency is not None else None,
+                'last_error': token.last_error
+            }
+            for token in tokens
+        ]
+        return stats
+
+# 全局令牌管理器
+_manager: Optional[TokenManager] = None
+_manager_lock = threading.Lock()
+
+def init_token_manager(app) -> Optional[TokenManager]:
+    """登记配置中的服务账号并启动后台预刷新线程，未启用时返回 None"""
+    global _manager
+
+    if not CONFIG.token_manager_enabled:
+        return None
+
+    with _manager_lock:
+        if _manager is None:
+            _manager = TokenManager(CONFIG.token_refresh_margin, CONFIG.token_check_interval)
+            accounts: List[Dict[str, str]] = app.config.get('GCP_ACCOUNTS', [])
+            for account in accounts:
+                if account.get('name'):
+                    _manager.register(account['name'], account['credentials_file'])
+            _manager.start()
+            atexit.register(_manager.stop)
+    return _manager
+
+def get_credentials(credentials_file: str, name: Optional[str] = None):
+    """获取服务账号凭据: 启用令牌管理器时返回共享且已持有有效令牌的凭据"""
+    if _manager is None:
+        return service_account.Credentials.from_service_account_file(
+            credentials_file,
+            scopes=CLOUD_PLATFORM_SCOPES
+        )
+    return _manager.get_credentials(credentials_file, name)
+
+def get_token_stats() -> Optional[Dict[str, Any]]:
+    """令牌刷新统计，未启用时返回 None"""
+    return _manager.stats() if _manager is not None else None
@@ -0,0 +1,344 @@
+# services/tracing.py - 轻量链路追踪
+#
+# 记录嵌套的 span: 同步轮次 → 服务账号 → 阶段 → 单次 API 调用（重试记为事件），
+# 按 TRACE_SAMPLE_RATE 在根 span 处采样，未采样的整条链路都是空操作。
+# 结束的 span 由后台线程批量导出为 OTLP/JSON: 写入 TRACE_FILE（每行一个
+# ExportTraceServiceRequest，可被 OpenTelemetry Collector 的 otlpjsonfile 接收器读取），
+# 或 POST 到 TRACE_OTLP_ENDPOINT（如 http://otel-collector:4318/v1/traces）。
+#
+# 当前 span 保存在 contextvars 中，asyncio 任务自动继承；线程池中执行的函数需用 wrap() 包装。
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SERVICE_NAME = 'gcp-billing-monitor'
+
+# 导出批次大小和最长间隔（秒）
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL = 2.0
+
+# OTLP 状态码
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+class Span:
+    """一个已采样的 span"""
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns',
+                 'attributes', 'events', 'status', 'status_message', '_token')
+
+    recording = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.status = 0
+        self.status_message = ''
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({'name': name, 'time_ns': time.time_ns(), 'attributes': attributes})
+
+    def set_error(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None and self.status != STATUS_ERROR:
+            self.set_error(f"{exc_type.__name__}: {exc}")
+        _current_span.reset(self._token)
+        _exporter.submit(self)
+        return False
+
+class _NoopSpan:
+    """未启用或未采样时使用的空 span"""
+    __slots__ = ()
+    recording = False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def set_error(self, message: str):
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+def start_trace(name: str, **attributes):
+    """开始一条新链路（根 span），按采样率决定是否记录"""
+    from services.billing_service import CONFIG
+    if not CONFIG.tracing_enabled or random.random() >= CONFIG.trace_sample_rate:
+        return _NOOP_SPAN
+    return Span(name, '%032x' % random.getrandbits(128), None, attributes)
+
+def span(name: str, **attributes):
+    """在当前链路下开始子 span；当前没有已采样的链路时为空操作"""
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+def current_span():
+    """当前 span，没有时返回空 span"""
+    return _current_span.get() or _NOOP_SPAN
+
+def add_event(name: str, **attributes):
+    """在当前 span 上记录事件（如重试）"""
+    parent = _current_span.get()
+    if parent is not None:
+        parent.add_event(name, **attributes)
+
+def wrap(func: Callable) -> Callable:
+    """把当前 span 带到线程池中执行的函数里"""
+    parent = _current_span.get()
+    if parent is None:
+        return func
+
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run
+
+# ==================== 跨进程传递 ====================
+# 多进程执行模式: 父进程把当前 span 的上下文传给子进程，子进程在其下记录 span 并收集起来，
+# 随处理结果回传给父进程导出
+
+def trace_context() -> Optional[Tuple[str, str]]:
+    """当前已采样 span 的 (trace_id, span_id)，没有时返回 None"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return parent.trace_id, parent.span_id
+
+@contextlib.contextmanager
+def continue_trace(context: Optional[Tuple[str, str]]):
+    """在另一个进程中继续 trace_context() 对应的链路，其中开始的 span 挂在该 span 下"""
+    if context is None:
+        yield
+        return
+    parent = Span('remote-parent', context[0], None, {})
+    parent.span_id = context[1]
+    token = _current_span.set(parent)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+class _SpanCollector:
+    """代替导出器收集结束的 span（子进程不直接导出）"""
+
+    def __init__(self):
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def submit(self, item: Span):
+        with self._lock:
+            self._spans.append(item)
+
+    def drain(self) -> List[Span]:
+        with self._lock:
+            spans, self._spans = self._spans, []
+        return spans
+
+def collect_spans():
+    """本进程之后结束的 span 不再导出，改由 drain_spans() 取出"""
+    global _exporter
+    if not isinstance(_exporter, _SpanCollector):
+        _exporter = _SpanCollector()
+
+def drain_spans() -> List[Dict[str, Any]]:
+    """取出收集到的 span，转换为可序列化的字典"""
+    if not isinstance(_exporter, _SpanCollector):
+        return []
+    return [
+        {slot: getattr(item, slot) for slot in Span.__slots__ if slot != '_token'}
+        for item in _exporter.drain()
+    ]
+
+def submit_spans(items: List[Dict[str, Any]]):
+    """导出其他进程回传的 span"""
+    for fields in items:
+        item = Span.__new__(Span)
+        for slot, value in fields.items():
+            setattr(item, slot, value)
+        item._token = None
+        _exporter.submit(item)
+
+# ==================== OTLP/JSON 导出 ====================
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{'key': key, 'value': _attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+def _encode_span(item: Span) -> Dict[str, Any]:
+    encoded = {
+        'traceId': item.trace_id,
+        'spanId': item.span_id,
+        'name': item.name,
+        'kind': 1,  # SPAN_KIND_INTERNAL
+        'startTimeUnixNano': str(item.start_ns),
+        'endTimeUnixNano': str(item.end_ns),
+        'attributes': _attributes(item.attributes),
+        'events': [
+            {'timeUnixNano': str(event['time_ns']), 'name': event['name'], 'attributes': _attributes(event['attributes'])}
+            for event in item.events
+        ],
+        'status': {'code': item.status, 'message': item.status_message} if item.status else {}
+    }
+    if item.parent_id:
+        encoded['parentSpanId'] = item.parent_id
+    return encoded
+
+def encode_batch(spans: List[Span]) -> Dict[str, Any]:
+    """编码为 OTLP ExportTraceServiceRequest"""
+    from services.billing_service import CONFIG
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': _attributes({
+                'service.name': SERVICE_NAME,
+                'service.instance.id': CONFIG.worker_id or f"{os.uname().nodename}-{os.getpid()}"
+            })},
+            'scopeSpans': [{
+                'scope': {'name': 'services.tracing'},
+                'spans': [_encode_span(item) for item in spans]
+            }]
+        }]
+    }
+
+class SpanExporter:
+    """后台批量导出结束的 span，队列满时丢弃（不阻塞业务线程）"""
+
+    def __init__(self, max_queue_size: int = 10000):
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.exported = 0
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._session = None
+
+    def submit(self, item: Span):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch: List[Span] = []
+            flush_request = None
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    flush_request = item
+                    break
+                batch.append(item)
+            if batch:
+                self.export(batch)
+            if flush_request is not None:
+                flush_request.set()
+
+    def export(self, batch: List[Span]):
+        from services.billing_service import CONFIG
+        try:
+            payload = encode_batch(batch)
+            if CONFIG.trace_otlp_endpoint:
+                self._post(payload)
+            elif CONFIG.trace_file:
+                directory = os.path.dirname(CONFIG.trace_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(CONFIG.trace_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(payload, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logging.warning(f"导出 {len(batch)} 个 span 失败: {e}")
+
+    def _post(self, payload: Dict[str, Any]):
+        import requests
+        if self._session is None:
+            self._session = requests.Session()
+        response = self._session.post(CONFIG.trace_otlp_endpoint, json=payload, timeout=10)
+        response.raise_for_status()
+
+    def flush(self, timeout: float = 5.0):
+        """等待导出线程写出已结束的 span（测试和进程退出时使用）"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        flush_request = threading.Event()
+        try:
+            self.queue.put(flush_request, timeout=timeout)
+        except queue.Full:
+            return
+        flush_request.wait(timeout)
+
+_exporter = SpanExporter()
+
+def get_trace_stats() -> Dict[str, Any]:
+    from services.billing_service import CONFIG
+    return {
+        'enabled': CONFIG.tracing_enabled,
+        'sample_rate': CONFIG.trace_sample_rate,
+        'exported': _exporter.exported,
+        'dropped': _exporter.dropped,
+        'queued': _exporter.queue.qsize()
+    }
+
+def flush_traces(timeout: float = 5.0):
+    _exporter.flush(timeout)
@@ -296,6 +296,43 @@ function configureAxios() {
     }
 }
 
+// 等待异步任务完成 - 操作接口返回 202 时轮询 /api/jobs/<id>，结果转换为普通响应格式
+// 服务端超过 TASK_TIMEOUT（默认 600 秒）会把任务报告为失败，客户端最多等待 timeout 毫秒
+function waitForJob(response, interval = 1000, timeout = 11 * 60 * 1000) {
+    if (response.status !== 202 || !response.data.data || !response.data.data.id) {
+        return Promise.resolve(response);
+    }
+    
+    const jobId = response.data.data.id;
+    const deadline = Date.now() + timeout;
+    return new Promise(function(resolve, reject) {
+        function poll() {
+            axios.get(`/api/jobs/${jobId}`)
+                .then(function(jobResponse) {
+                    const job = jobResponse.data.data;
+                    if (job.status === 'queued' || job.status === 'running') {
+                        if (Date.now() >= deadline) {
+                            reject(new Error('等待任务结果超时，任务可能仍在执行，请稍后刷新页面查看'));
+                            return;
+                        }
+                        setTimeout(poll, interval);
+                        return;
+                    }
+                    resolve({
+                        status: 200,
+                        data: {
+                            status: job.status === 'succeeded' ? 'success' : 'error',
+                            message: job.message,
+                            data: job
+                        }
+                    });
+                })
+                .catch(reject);
+        }
+        setTimeout(poll, interval);
+    });
+}
+
 // 显示加载中动画
 function showLoading() {
     let loader = document.getElementById('global-loader');